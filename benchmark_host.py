@@ -0,0 +1,199 @@
+"""
+Benchmarks of the host side hot paths and the serial protocol.
+
+  python benchmark_host.py
+  python benchmark_host.py --compare benchmark_results/benchmark_2022-10-01_12-00-00.json
+
+The hardware is replaced by 'FakeFileExplorer' which answers 'fe.eval()'
+like the pico (without the serial latency). The results are written as json
+to 'benchmark_results/'.
+"""
+import argparse
+import itertools
+import json
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import simple_pid
+import datafile_csv
+from humidity_controller_2022 import CONTROL_INTERVAL_MS, DIRECTORY_OF_THIS_FILE, Controller, Pico
+from pico_simulator import SimulatedClock
+
+DIRECTORY_RESULTS = DIRECTORY_OF_THIS_FILE / "benchmark_results"
+
+MEASUREMENT_REPLY = repr(
+    {
+        'humi_temp_C': 25.4,
+        'humi_humi_pRH': 75.3,
+        'stage_temp_C': 26.3,
+        'stage_humi_pRH': 77.9,
+    }
+).encode("utf-8")
+
+
+class FakeFileExplorer:
+    """
+    Answers like 'micropython_logic' with 'real_setup = False'.
+    'eval()' returns bytes as 'mp.pyboard.Pyboard.eval()' does.
+    """
+
+    def __init__(self):
+        self.evals = 0
+
+    def eval(self, expression: str) -> bytes:
+        self.evals += 1
+        if expression.startswith("micropython_logic.step(") or expression.startswith("micropython_logic.get_measurement("):
+            return MEASUREMENT_REPLY
+        if expression.startswith("micropython_logic.get_status("):
+            return b"{}"
+        return b"None"
+
+    def exec_(self, command: str) -> bytes:
+        return b""
+
+
+def bench(function, number: int, repeat: int = 5) -> dict:
+    "Best of 'repeat' runs of 'number' calls"
+    timer = timeit.Timer(function)
+    best_s = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {"ns_per_call": best_s * 1e9, "calls_per_s": 1.0 / best_s, "number": number, "repeat": repeat}
+
+
+def benchmarks(directory: pathlib.Path) -> dict:
+    results = {}
+
+    pid = simple_pid.PID(Kp=3.0, Ki=0.2, Kd=0.1, setpoint=60.0, sample_time=None, output_limits=(10.0, 100.0))
+    results["pid_call"] = bench(lambda: pid(55.0, dt=1.0), number=100000)
+    pid_wallclock = simple_pid.PID(Kp=3.0, Ki=0.2, Kd=0.1, setpoint=60.0, sample_time=None, output_limits=(10.0, 100.0))
+    results["pid_call_wallclock"] = bench(lambda: pid_wallclock(55.0), number=100000)
+    # The rate of the pico: a new output every 'sample_time', the other calls return the last output
+    pid_sample_time = simple_pid.PID(Kp=3.0, Ki=0.2, Kd=0.1, setpoint=60.0, sample_time=0.6, output_limits=(10.0, 100.0))
+    results["pid_call_sample_time_skip"] = bench(lambda: pid_sample_time(55.0, dt=0.01), number=100000)
+    results["pid_components"] = bench(lambda: pid.components[1], number=100000)
+    results["pid_integral"] = bench(lambda: pid.integral, number=100000)
+    # A simulation: the PID reads the simulated clock instead of time.monotonic()
+    pid_clock = simple_pid.PID(
+        Kp=3.0, Ki=0.2, Kd=0.1, setpoint=60.0, sample_time=None, output_limits=(10.0, 100.0), clock=lambda: 0.0
+    )
+    results["pid_call_dt_injected_clock"] = bench(lambda: pid_clock(55.0, dt=1.0), number=100000)
+    # Many chambers or a gain search: one call per controller
+    pids = [
+        simple_pid.PID(Kp=0.1 * i, Ki=0.2, Kd=0.1, setpoint=60.0, sample_time=None, output_limits=(10.0, 100.0))
+        for i in range(100)
+    ]
+
+    def call_pids():
+        for p in pids:
+            p(55.0, dt=1.0)
+
+    results["pid_call_100_controllers"] = bench(call_pids, number=1000)
+    results["pid_call_100_controllers"]["ns_per_controller"] = results["pid_call_100_controllers"]["ns_per_call"] / len(pids)
+
+    csv = datafile_csv.Csv(directory / "bench_flush.txt")
+    csv.humi_humi_pRH = 55.5
+    results["csv_row_dict"] = bench(lambda: csv.row_dict, number=20000)
+    results["csv_text"] = bench(lambda: csv.text, number=20000)
+    results["csv_write_flush_every_row"] = bench(csv.write, number=5000)
+    csv.close()
+    csv = datafile_csv.Csv(
+        directory / "bench_buffered.txt",
+        flush_rows=60,
+        filename_binary=directory / "bench_buffered.bin",
+    )
+    results["csv_write_buffered"] = bench(csv.write, number=20000)
+    csv.close()
+
+    fe = FakeFileExplorer()
+    pico = Pico(fe=fe)
+    results["pico_get_measurement_parse"] = bench(lambda: pico.get_measurement(average_n=5), number=20000)
+    # Changing values: every call writes the fans and the leds
+    outputs = itertools.cycle(((40.0, (0, 100, 0)), (50.0, (0, 0, 100))))
+
+    def step_changing():
+        fan, color = next(outputs)
+        pico.step(fan_hum_intensity=fan, color=color, average_n=5)
+
+    results["pico_step"] = bench(step_changing, number=20000)
+    results["pico_step_unchanged"] = bench(lambda: pico.step(fan_hum_intensity=50.0, color=(0, 100, 0), average_n=5), number=20000)
+
+    # Every tick one control interval later: the PID computes a new output on every tick.
+    # The default gains, not the ones saved by 'pid_tuning.py'.
+    clock = SimulatedClock()
+    controller = Controller(pico=pico, filename_log=directory / "bench_controller.txt", clock=clock, filename_tuning=None)
+    controller.timing.enabled = False
+    pid = controller.pid
+    controller.set_controller(on=True, setpoint=pid.setpoint, Kp=pid.Kp, Ki=pid.Ki, Kd=pid.Kd)
+
+    def tick():
+        clock.advance(CONTROL_INTERVAL_MS / 1000.0)
+        controller.tick()
+
+    evals = fe.evals
+    results["controller_tick"] = bench(tick, number=5000)
+    results["controller_tick"]["evals_per_tick"] = (fe.evals - evals) / (5 * 5000)
+    controller.close()
+
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=DIRECTORY_OF_THIS_FILE, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, filename_previous: pathlib.Path) -> None:
+    previous = json.loads(filename_previous.read_text())["results"]
+    print(f"Compared with {filename_previous.name}:")
+    for name, result in results.items():
+        if name not in previous:
+            continue
+        ratio = result["ns_per_call"] / previous[name]["ns_per_call"]
+        flag = "  <-- slower" if ratio > 1.10 else ""
+        print(f"  {name:30s} {ratio:6.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the host side hot paths")
+    parser.add_argument("--output", type=pathlib.Path, default=None, help="json file")
+    parser.add_argument("--compare", type=pathlib.Path, default=None, help="json file of a previous run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = benchmarks(pathlib.Path(directory))
+
+    for name, result in results.items():
+        print(f"{name:30s} {result['ns_per_call']:12.0f} ns/call {result['calls_per_s']:12.0f} calls/s")
+
+    output = args.output
+    if output is None:
+        DIRECTORY_RESULTS.mkdir(exist_ok=True)
+        output = DIRECTORY_RESULTS / f"benchmark_{time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime())}.json"
+    output.write_text(
+        json.dumps(
+            {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+                "git": git_revision(),
+                "python": sys.version,
+                "platform": platform.platform(),
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"Written to {output}")
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
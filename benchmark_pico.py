@@ -0,0 +1,143 @@
+"""
+Benchmarks of the device code on the Raspberry Pico: .py against .mpy.
+
+  python benchmark_pico.py
+  python benchmark_pico.py --comport COM5 --compare benchmark_results/benchmark_pico_2022-10-01_12-00-00.json
+
+For each deployment (see 'micropython_deploy'):
+  - Import time and RAM used by 'import micropython_logic'.
+  - Round trips host -> pico: 'fe.eval("None")', 'get_measurement()', 'step()'.
+  - Loops on the pico: 'sht31.crc8()', 'Fan_pwm.set_intensity()', 'SHT31._convert()'.
+The results are written as json to 'benchmark_results/'.
+The pico keeps the deployment of the last run: 'Pico' syncs again on the next start.
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import pathlib
+
+import micropython_deploy
+from humidity_controller_2022 import Pico
+from benchmark_host import DIRECTORY_RESULTS, compare, git_revision
+
+LOOPS_DEVICE = 1000
+
+
+def result(duration_s: float, number: int) -> dict:
+    return {"ns_per_call": duration_s * 1e9, "calls_per_s": 1.0 / duration_s, "number": number}
+
+
+def round_trips(function, number: int) -> dict:
+    begin_s = time.perf_counter()
+    for _ in range(number):
+        function()
+    return result((time.perf_counter() - begin_s) / number, number)
+
+
+def device_loop(pico: Pico, statement: str, number: int = LOOPS_DEVICE) -> dict:
+    "'statement' is executed 'number' times on the pico, timed with 'time.ticks_us()'"
+    pico.fe.exec_(
+        "import time\n"
+        "def _bench():\n"
+        "    begin = time.ticks_us()\n"
+        f"    for _ in range({number}):\n"
+        f"        {statement}\n"
+        "    return time.ticks_diff(time.ticks_us(), begin)\n"
+    )
+    duration_us = int(pico.fe.eval("_bench()").decode("utf-8"))
+    return result(duration_us * 1e-6 / number, number)
+
+
+def import_cost(pico: Pico) -> dict:
+    """
+    The modules are removed from 'sys.modules' and 'micropython_logic' is imported again.
+    This is what happens after a soft reset: compile (.py) or load (.mpy) and run the module level code.
+    """
+    names = tuple(f.stem for f in micropython_deploy.source_files())
+    pico.fe.exec_(
+        "import sys, gc, time\n"
+        f"for _name in {names!r}:\n"
+        "    sys.modules.pop(_name, None)\n"
+        "gc.collect()\n"
+        "_free = gc.mem_free()\n"
+        "_begin = time.ticks_us()\n"
+        "import micropython_logic\n"
+        "_import_us = time.ticks_diff(time.ticks_us(), _begin)\n"
+        "gc.collect()\n"
+        "_ram_bytes = _free - gc.mem_free()\n"
+    )
+    pico.pyboard_init()
+    import_us = int(pico.fe.eval("_import_us").decode("utf-8"))
+    ram_bytes = int(pico.fe.eval("_ram_bytes").decode("utf-8"))
+    return {"import_ms": import_us * 1e-3, "ram_bytes": ram_bytes}
+
+
+def benchmarks(comport: str, mpy: bool, number: int) -> dict:
+    pico = Pico(comport=comport, mpy=mpy)
+    try:
+        results = {"import": import_cost(pico)}
+        results["eval_none"] = round_trips(lambda: pico.fe.eval("None"), number=number)
+        results["get_measurement"] = round_trips(lambda: pico.get_measurement(average_n=1), number=number)
+        # Changing values: 'Pico' would suppress repeated writes
+        intensities = itertools.cycle((10.0, 20.0))
+        results["step"] = round_trips(
+            lambda: pico.step(fan_hum_intensity=next(intensities), color=(0, 100, 0)), number=number
+        )
+        pico.set_fan_hum_intensity(0.0)
+
+        pico.fe.exec_("import sht31, pwm\n_buf = b'\\xbe\\xef\\x92'")
+        results["device_crc8"] = device_loop(pico, "sht31.crc8(_buf, 0, 2)")
+        results["device_set_intensity"] = device_loop(pico, "pwm.fans_hum.fan1.set_intensity(0.0)")
+        results["device_convert"] = device_loop(pico, "sht31.sensors.sensor_a_fix._convert(26000, 30000)")
+        return results
+    finally:
+        pico.board.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the device code: .py against .mpy")
+    parser.add_argument("--comport", default=None, help="if omitted: the only pico connected")
+    parser.add_argument("--number", type=int, default=100, help="round trips per benchmark")
+    parser.add_argument("--output", type=pathlib.Path, default=None, help="json file")
+    parser.add_argument("--compare", type=pathlib.Path, default=None, help="json file of a previous run")
+    args = parser.parse_args()
+
+    results = {}
+    for deployment, mpy in (("py", False), ("mpy", True)):
+        for name, value in benchmarks(comport=args.comport, mpy=mpy, number=args.number).items():
+            results[f"{deployment}_{name}"] = value
+
+    for name, value in results.items():
+        if "ns_per_call" in value:
+            print(f"{name:30s} {value['ns_per_call']:12.0f} ns/call {value['calls_per_s']:12.0f} calls/s")
+        else:
+            print(f"{name:30s} {value['import_ms']:12.1f} ms import {value['ram_bytes']:12d} bytes RAM")
+
+    output = args.output
+    if output is None:
+        DIRECTORY_RESULTS.mkdir(exist_ok=True)
+        output = DIRECTORY_RESULTS / f"benchmark_pico_{time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime())}.json"
+    output.write_text(
+        json.dumps(
+            {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+                "git": git_revision(),
+                "python": sys.version,
+                "platform": platform.platform(),
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"Written to {output}")
+
+    if args.compare is not None:
+        # 'import' has no 'ns_per_call'
+        compare({name: value for name, value in results.items() if "ns_per_call" in value}, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Replay a recorded log through the 'Controller': reproduce what the PID did.
+
+  python controller_replay.py log/controller_2022-10-04_12-00-00.bin --kp 3.0 --ki 0.2 --kd 0.0
+  python controller_replay.py log/controller_2022-10-04_12-00-00.txt log/controller_2022-10-04_12-00-00_001.txt
+
+The logged measurements are fed through 'Controller.tick()' with the time of
+the log, as fast as possible. The recomputed fan duty is compared with the
+column 'fan' of the log and the rows where they diverge are reported.
+
+Not logged, so taken from the command line: the gains and the filter.
+The controller is on while the logged fan duty is above 0 (the PID output
+is limited to 10..100%): switching it on resets the PID, as the gui does.
+The text log rounds 'fan' to 1% and the humidity to 0.1%RH. The binary log
+('.bin') keeps the values as float64 but 'time_s' is truncated to seconds:
+the 'dt' of the PID differs from the one of the run by the jitter of the
+loop, which shifts the integral term by a fraction of a percent. Only a run
+with a tick every whole second replays exactly. Logs of the autonomous mode
+(the PID runs on the pico) are replayed with the PID of the host.
+"""
+import argparse
+import pathlib
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List
+
+import pid_tuning
+from humidity_controller_2022 import CONTROL_INTERVAL_MS, PicoBase, Controller
+
+# '.txt': the resolution of 'fan'. '.bin': the PID integrates 'dt' from the truncated 'time_s'
+TOLERANCE_PERCENT = {".txt": 1.0, ".bin": 0.5}
+
+
+class ReplayClock:
+    """
+    The time of the row replayed, for 'Controller'.
+    'time_s' in the log is truncated to seconds: a time which does not
+    advance is replayed one interval after the previous one.
+    """
+
+    def __init__(self, interval_s: float = CONTROL_INTERVAL_MS / 1000.0):
+        self.interval_s = interval_s
+        self.time_s = 0.0
+        self._last_s = None
+
+    def __call__(self) -> float:
+        return self.time_s
+
+    def set(self, logged_s: float) -> None:
+        if (self._last_s is not None) and (logged_s <= self._last_s):
+            logged_s = self._last_s + self.interval_s
+        self.time_s = self._last_s = logged_s
+
+
+class ReplayPico(PicoBase):
+    """
+    Returns the logged measurement 'row' on every 'step()'.
+    The fan duty set by the 'Controller' is kept in 'fan_hum_intensity'.
+    """
+
+    def __init__(self):
+        self.row = None
+        self.fan_hum_intensity = 0.0
+        self.fan_circ_intensity = 0.0
+
+    def get_status(self) -> dict:
+        return {}
+
+    def get_measurement(self, average_n = 1) -> dict:
+        return self.row
+
+    def set_fan_circ_intensity(self, intensity_K: float) -> None:
+        self.fan_circ_intensity = intensity_K
+
+    def set_fan_hum_intensity(self, intensity_K: float) -> None:
+        self.fan_hum_intensity = intensity_K
+
+    def leds(self, color=(0,0,0)) -> None:
+        pass
+
+    def step(self, fan_hum_intensity: float, color=(0,0,0), average_n = 1) -> dict:
+        self.fan_hum_intensity = fan_hum_intensity
+        return self.row
+
+    def set_filter(self, spec: str = None) -> None:
+        # The log contains the values after a filter on the pico
+        pass
+
+    def reconnect(self) -> None:
+        pass
+
+    def start_autonomous(self, setpoint: float, Kp: float, Ki: float, Kd: float, interval_ms = CONTROL_INTERVAL_MS) -> None:
+        raise Exception("The replay runs the PID of the host: no autonomous mode")
+
+    def supervise(self, setpoint: float = None, Kp: float = None, Ki: float = None, Kd: float = None) -> dict:
+        raise Exception("The replay runs the PID of the host: no autonomous mode")
+
+    def stop_autonomous(self) -> None:
+        pass
+
+
+def load_rows(filenames: List[pathlib.Path]) -> Iterator[Dict[str, float]]:
+    "The rows of the logs in the given order: the segments of one run, see 'datafile_csv.Csv'"
+    for filename in filenames:
+        columns = pid_tuning.load_log(filename)
+        names = list(columns.keys())
+        for values in zip(*columns.values()):
+            yield dict(zip(names, values))
+
+
+def replay(controller: Controller, clock: ReplayClock, pico: ReplayPico, rows: Iterator[Dict[str, float]], Kp: float, Ki: float, Kd: float) -> Iterator[tuple]:
+    """
+    Yields (row, TickResult) for every row of the log.
+    The 'TickResult' holds the fan duty recomputed for this row.
+    """
+    rows = iter(rows)
+    row = next(rows, None)
+    while row is not None:
+        row_next = next(rows, None)
+        # 'fan' in a row was computed by the tick before
+        on = (row_next is not None) and (row_next["fan"] > 0.0)
+        if on != controller.controller_on:
+            controller.set_controller(on=on, setpoint=row["set_humi_pRH"], Kp=Kp, Ki=Ki, Kd=Kd)
+        controller.pid.setpoint = row["set_humi_pRH"]
+        clock.set(row["time_s"])
+        pico.row = row
+        yield row, controller.tick()
+        row = row_next
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a log through the controller and compare the fan duty")
+    parser.add_argument("filenames", type=pathlib.Path, nargs="+", help="the log files of one run (.txt or .bin), in order")
+    parser.add_argument("--kp", type=float, default=3.0)
+    parser.add_argument("--ki", type=float, default=0.2)
+    parser.add_argument("--kd", type=float, default=0.0)
+    parser.add_argument("--filter", default=None, help="the filter on the host, see 'sensor_filter'")
+    parser.add_argument("--tolerance", type=float, default=None, help="%% fan duty (default: 1.0 for .txt, 0.5 for .bin)")
+    parser.add_argument("--show", type=int, default=20, help="number of divergence points printed")
+    parser.add_argument("--output", type=pathlib.Path, default=None, help="log of the replay (default: not kept)")
+    args = parser.parse_args()
+    tolerance = args.tolerance
+    if tolerance is None:
+        tolerance = max(TOLERANCE_PERCENT.get(filename.suffix, TOLERANCE_PERCENT[".txt"]) for filename in args.filenames)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename_log = args.output
+        if filename_log is None:
+            filename_log = pathlib.Path(directory) / "replay.txt"
+        clock = ReplayClock()
+        pico = ReplayPico()
+        controller = Controller(pico=pico, filename_log=filename_log, clock=clock)
+        controller.timing.enabled = False
+        if args.filter is not None:
+            controller.set_filter(args.filter)
+
+        rows = 0
+        diverged = 0
+        diverging = False
+        max_diff = 0.0
+        points = []
+        start = time.perf_counter()
+        try:
+            for row, result in replay(controller, clock, pico, load_rows(args.filenames), Kp=args.kp, Ki=args.ki, Kd=args.kd):
+                rows += 1
+                diff = abs(result.values["fan"] - row["fan"])
+                max_diff = max(max_diff, diff)
+                if diff <= tolerance:
+                    diverging = False
+                    continue
+                diverged += 1
+                if not diverging:
+                    # The first row of a divergent run
+                    diverging = True
+                    points.append((row, result))
+        finally:
+            controller.close()
+        elapsed_s = time.perf_counter() - start
+
+    print(f"Replayed {rows} rows in {elapsed_s:0.2f}s ({rows / max(elapsed_s, 1e-9):0.0f} rows/s)")
+    print(f"Diverged: {diverged} rows in {len(points)} runs, max difference {max_diff:0.2f}%")
+    if len(points) > 0:
+        print(f"{'time_s':>8s} {'set_pRH':>8s} {'humi_pRH':>8s} {'fan_log':>8s} {'fan_new':>8s}")
+    for row, result in points[: args.show]:
+        print(f"{row['time_s']:8.0f} {row['set_humi_pRH']:8.1f} {row['humi_humi_pRH']:8.1f} {row['fan']:8.1f} {result.values['fan']:8.1f}")
+    sys.exit(0 if diverged == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,82 @@ time,fan,rh
 223,34.5,78.5
 """
 
+import atexit
 import csv
+import json
+import operator
 import pathlib
-from typing import Dict
+import struct
+import sys
+import time
+from typing import Dict, Iterator, List
+
+BINARY_MAGIC = b"HCLOG1\n"
+_STRUCT_CODES = {"<i4": "i", "<f8": "d"}
+
+
+class BinaryLog:
+    """
+    Fixed width little endian records, one per row.
+    The file starts with BINARY_MAGIC followed by one line of json with
+    the column names and numpy dtypes. See 'read_binary()'.
+    """
+
+    def __init__(self, filename: pathlib.Path, names: List[str], dtypes: List[str]):
+        assert isinstance(filename, pathlib.Path)
+        assert len(names) == len(dtypes)
+        self._struct = struct.Struct("<" + "".join([_STRUCT_CODES[dtype] for dtype in dtypes]))
+        self._pending = bytearray()
+        self._f = filename.open("wb")
+        header = json.dumps({"names": names, "dtypes": dtypes}).encode("ascii")
+        self._f.write(BINARY_MAGIC + header + b"\n")
+        self._f.flush()
+
+    def write(self, values: tuple) -> None:
+        self._pending += self._struct.pack(*values)
+
+    def flush(self) -> None:
+        if len(self._pending) == 0:
+            return
+        self._f.write(self._pending)
+        self._f.flush()
+        self._pending.clear()
+
+    def close(self) -> None:
+        if self._f.closed:
+            return
+        self.flush()
+        self._f.close()
 
 
 class Csv:
-    def __init__(self, filename: pathlib.Path):
+    def __init__(
+        self,
+        filename: pathlib.Path,
+        flush_rows: int = 1,
+        flush_interval_s: float = None,
+        filename_binary: pathlib.Path = None,
+        max_bytes: int = None,
+        max_age_s: float = None,
+        extra_columns: Dict[str, str] = None,
+    ):
+        """
+        The rows are buffered in memory and written when 'flush_rows' rows
+        are pending or the oldest pending row is older than 'flush_interval_s'.
+        'flush_rows=1' writes every row immediately.
+        Pending rows are written on 'close()' and at interpreter exit.
+        If 'filename_binary' is given, the rows are also written to a 'BinaryLog'.
+
+        A new file is started when a file grows beyond 'max_bytes' or becomes
+        older than 'max_age_s': 'controller_x.txt', 'controller_x_001.txt', ...
+        Every flushed block of rows is recorded in the index 'controller_x.idx',
+        see 'query()'.
+
+        'extra_columns' adds columns after the default ones: {name: format}.
+        The values start with 0 and are set as attributes like the default columns.
+        """
         assert isinstance(filename, pathlib.Path)
+        assert flush_rows >= 1
         self.time_s: int = 0
         self.fan: float = 0.0
         self.set_humi_pRH: float = 0.0
@@ -20,10 +88,59 @@ class Csv:
         self.stage_temp_C: float = 0.0
         self._names = ["time_s", "fan", "set_humi_pRH", "humi_humi_pRH", "stage_humi_pRH", "humi_temp_C", "stage_temp_C"]
         self._formats = {"time_s": '5d', "fan": "3.0f", "set_humi_pRH": "3.1f", "humi_humi_pRH": "3.1f", "stage_humi_pRH": "3.1f", "humi_temp_C": "3.1f", "stage_temp_C": "3.1f"}
-        self._f = filename.open('w', newline="")
-        self._writer = csv.DictWriter(
-            self._f, fieldnames=self._names, delimiter="\t")
-        self._writer.writeheader()
+        if extra_columns is not None:
+            for name, _format in extra_columns.items():
+                assert name not in self._formats
+                setattr(self, name, 0 if _dtype(_format) == "<i4" else 0.0)
+                self._names.append(name)
+                self._formats[name] = _format
+        # Precompiled: one format() call per row
+        self._line_format = "\t".join([self._field_format(name) for name in self._names]) + "\r\n"
+        self._text_format = "  ".join([f"{name}={self._field_format(name)}" for name in self._names])
+        self._binary_values = operator.attrgetter(*self._names)
+        self.flush_rows = flush_rows
+        self.flush_interval_s = flush_interval_s
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self._pending = []
+        self._pending_since = None
+        self._filename = filename
+        self._filename_binary = filename_binary
+        self._index = filename.with_suffix(".idx").open("w", newline="")
+        self._segment = 0
+        self._open_segment()
+        atexit.register(self.close)
+
+    def _open_segment(self) -> None:
+        self._f = _segment_filename(self._filename, self._segment).open('w', newline="")
+        header = "\t".join(self._names) + "\r\n"
+        self._f.write(header)
+        self._f.flush()
+        self._offset = len(header.encode())
+        self._segment_since = time.monotonic()
+        self._binary = None
+        if self._filename_binary is not None:
+            self._binary = BinaryLog(_segment_filename(self._filename_binary, self._segment), self._names, self._dtypes)
+
+    @property
+    def filename(self) -> pathlib.Path:
+        "The file currently written (changes with the rotation)"
+        return pathlib.Path(self._f.name)
+
+    def _rotate(self) -> None:
+        self._f.close()
+        if self._binary is not None:
+            self._binary.close()
+        self._segment += 1
+        self._open_segment()
+
+    @property
+    def _dtypes(self) -> List[str]:
+        return [_dtype(self._formats.get(name, "")) for name in self._names]
+
+    def _field_format(self, name: str) -> str:
+        _format = self._formats.get(name, "")
+        return f"{{0.{name}:{_format}}}"
 
     @property
     def row_dict(self) -> Dict[str, str]:
@@ -39,19 +156,193 @@ class Csv:
         return row
 
     def write(self) -> None:
-        self._writer.writerow(rowdict=self.row_dict)
+        if self._f.closed:
+            return
+        self._pending.append(self._line_format.format(self))
+        if self._binary is not None:
+            self._binary.write(self._binary_values(self))
+        if len(self._pending) == 1:
+            self._pending_since = time.monotonic()
+            self._pending_epoch_s = time.time()
+            self._pending_time_s = self.time_s
+        self._pending_epoch_last_s = time.time()
+        if len(self._pending) >= self.flush_rows:
+            self.flush()
+            return
+        if self.flush_interval_s is not None:
+            if time.monotonic() - self._pending_since >= self.flush_interval_s:
+                self.flush()
+
+    def flush(self) -> None:
+        if len(self._pending) == 0:
+            return
+        block = "".join(self._pending)
+        length = len(block.encode())
+        self._f.write(block)
         self._f.flush()
+        if self._binary is not None:
+            self._binary.flush()
+        self._index.write(
+            f"{self._pending_epoch_s:0.1f}\t{self._pending_epoch_last_s:0.1f}\t{self._pending_time_s:d}\t"
+            f"{pathlib.Path(self._f.name).name}\t{self._offset:d}\t{length:d}\r\n"
+        )
+        self._index.flush()
+        self._offset += length
+        self._pending.clear()
+        if (self.max_bytes is not None) and (self._offset >= self.max_bytes):
+            self._rotate()
+        elif (self.max_age_s is not None) and (time.monotonic() - self._segment_since >= self.max_age_s):
+            self._rotate()
+
+    def close(self) -> None:
+        if self._f.closed:
+            return
+        self.flush()
+        self._f.close()
+        self._index.close()
+        if self._binary is not None:
+            self._binary.close()
+        atexit.unregister(self.close)
+
+    @property
+    def values(self) -> Dict[str, float]:
+        "The values of the current row"
+        return dict(zip(self._names, self._binary_values(self)))
 
     @property
     def text(self) -> str:
         "time=xx fan=xx rh=zz"
-        row_dict = self.row_dict
-        list_text = [f"{name}={row_dict[name]}" for name in self._names]
-        return "  ".join(list_text)
+        return self._text_format.format(self)
+
+
+def _segment_filename(filename: pathlib.Path, segment: int) -> pathlib.Path:
+    "'controller_x.txt', 0 -> 'controller_x.txt'. 'controller_x.txt', 2 -> 'controller_x_002.txt'"
+    if segment == 0:
+        return filename
+    return filename.with_name(f"{filename.stem}_{segment:03d}{filename.suffix}")
+
+
+def query(filename_index: pathlib.Path, epoch_from_s: float, epoch_to_s: float) -> Iterator[Dict[str, float]]:
+    """
+    Yield the rows logged between 'epoch_from_s' and 'epoch_to_s' (time.time()).
+    Only the blocks listed in the index 'controller_x.idx' which overlap the
+    time range are read from the log files.
+    Every row gets an additional column 'epoch_s'.
+    """
+    assert isinstance(filename_index, pathlib.Path)
+    directory = filename_index.parent
+    with filename_index.open("r", newline="") as f_index:
+        for line in f_index:
+            fields = line.rstrip("\r\n").split("\t")
+            if len(fields) != 6:
+                # The last line may be written partially
+                continue
+            epoch_first_s, epoch_last_s = float(fields[0]), float(fields[1])
+            if (epoch_last_s < epoch_from_s) or (epoch_first_s > epoch_to_s):
+                continue
+            time_s_first = int(fields[2])
+            filename, offset, length = directory / fields[3], int(fields[4]), int(fields[5])
+            with filename.open("rb") as f:
+                names = f.readline().decode().rstrip("\r\n").split("\t")
+                f.seek(offset)
+                block = f.read(length).decode()
+            for row in block.splitlines():
+                values = row.split("\t")
+                if len(values) != len(names):
+                    continue
+                row_dict = {name: float(value) for name, value in zip(names, values)}
+                epoch_s = epoch_first_s + row_dict["time_s"] - time_s_first
+                if epoch_from_s <= epoch_s <= epoch_to_s:
+                    row_dict["epoch_s"] = epoch_s
+                    yield row_dict
+
+
+def _dtype(_format: str) -> str:
+    "'5d' -> '<i4', '3.1f' -> '<f8'"
+    if _format.endswith("d"):
+        return "<i4"
+    return "<f8"
+
+
+def read_binary(filename: pathlib.Path):
+    """
+    Map a 'BinaryLog' file into memory, nothing is read until used.
+    Returns a numpy structured array: read_binary(f)["humi_humi_pRH"] is a zero copy column.
+    """
+    assert isinstance(filename, pathlib.Path)
+    try:
+        import numpy
+    except ModuleNotFoundError:
+        raise Exception(
+            'The module "numpy" is missing. Did you call "pip -r requirements.txt"?'
+        )
+    with filename.open("rb") as f:
+        magic = f.read(len(BINARY_MAGIC))
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"{filename}: Not a binary log")
+        header = json.loads(f.readline())
+        offset = f.tell()
+    dtype = numpy.dtype(list(zip(header["names"], header["dtypes"])))
+    rows = (filename.stat().st_size - offset) // dtype.itemsize
+    if rows == 0:
+        return numpy.zeros(0, dtype=dtype)
+    # A partially written last record is ignored
+    return numpy.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=(rows,))
+
+
+def convert_text_log(filename: pathlib.Path, filename_binary: pathlib.Path = None) -> pathlib.Path:
+    """
+    Convert a tab separated log written by 'Csv' into a 'BinaryLog'.
+    Incomplete rows are skipped.
+    """
+    assert isinstance(filename, pathlib.Path)
+    if filename_binary is None:
+        filename_binary = filename.with_suffix(".bin")
+    with filename.open("r", newline="") as f:
+        reader = csv.reader(f, delimiter="\t")
+        names = next(reader)
+        dtypes = ["<i4" if name == "time_s" else "<f8" for name in names]
+        converters = [int if dtype == "<i4" else float for dtype in dtypes]
+        binary = BinaryLog(filename_binary, names, dtypes)
+        try:
+            for i, row in enumerate(reader):
+                if len(row) != len(names):
+                    continue
+                try:
+                    binary.write(tuple([converter(value) for converter, value in zip(converters, row)]))
+                except ValueError:
+                    continue
+                if i % 10000 == 0:
+                    binary.flush()
+        finally:
+            binary.close()
+    return filename_binary
+
+
+def _parse_time(text: str) -> float:
+    "'2022-10-04 02:00' -> epoch seconds"
+    for _format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(text, _format))
+        except ValueError:
+            continue
+    raise ValueError(f"Unknown time format: {text}")
 
 
 if __name__ == "__main__":
-    df = Csv('test_csv.csv')
+    if (len(sys.argv) == 5) and (sys.argv[1] == "query"):
+        # python datafile_csv.py query log/controller_x.idx "2022-10-04 02:00" "2022-10-04 03:00"
+        filename_index = pathlib.Path(sys.argv[2])
+        for row_dict in query(filename_index, _parse_time(sys.argv[3]), _parse_time(sys.argv[4])):
+            print("\t".join([str(value) for value in row_dict.values()]))
+        sys.exit(0)
+    if len(sys.argv) > 1:
+        # python datafile_csv.py log/controller_*.txt
+        for filename in sys.argv[1:]:
+            filename_binary = convert_text_log(pathlib.Path(filename))
+            print(f"{filename} -> {filename_binary}")
+        sys.exit(0)
+    df = Csv(pathlib.Path('test_csv.csv'))
     df.rh = 33.56876986796
     df.write()
     print(df.text)
@@ -0,0 +1,801 @@
+"""
+The humidity controller without gui: the pico, the control loop and the
+thread which owns the serial connection.
+"""
+import abc
+import pathlib
+import logging
+import time
+import ast
+import sys
+import importlib.util
+import queue
+import struct
+import threading
+import collections
+from typing import List
+
+import simple_pid
+import datafile_csv
+import setpoint_schedule
+import micropython_deploy
+import pid_tuning
+import loop_timing
+
+logger = logging.getLogger("humidity_controller_2022")
+
+logger.setLevel(logging.DEBUG)
+
+DIRECTORY_OF_THIS_FILE = pathlib.Path(__file__).absolute().parent
+
+START_TIME = time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime())
+FILENAME_LOG = DIRECTORY_OF_THIS_FILE / "log" / f"controller_{START_TIME}.txt"
+FILENAME_LOG.parent.mkdir(parents=True, exist_ok=True)
+
+# Period of the control loop. Limited by the measurement time on the pico (average_n)
+CONTROL_INTERVAL_MS = 1000
+
+# The fan pwm runs at 25kHz: 125MHz/25kHz = 5000 steps. Smaller changes have no effect.
+FAN_DEADBAND_PERCENT = 100.0 / 5000
+# Unchanged values are sent again after this time, in case the pico missed something
+RESYNC_INTERVAL_S = 30.0
+# Autonomous mode: the pico switches the fans off if the host is silent for this time
+HOST_TIMEOUT_MS = 60000
+
+
+def _import_src_micropython(name: str):
+    "Import a module of 'src_micropython' which also runs on the host, see 'sensor_filter'"
+    spec = importlib.util.spec_from_file_location(name, DIRECTORY_OF_THIS_FILE / "src_micropython" / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+sensor_filter = _import_src_micropython("sensor_filter")
+
+
+try:
+    import mp
+    import mp.version
+    import mp.micropythonshell
+    import mp.pyboard
+    import mp.pyboard_query
+except ModuleNotFoundError as ex:
+    # Only required for the real hardware, see 'Pico'
+    mp = None
+
+# The connection to the pico is lost. 'PyboardError' is derived from BaseException!
+# 'serial.SerialException' is an OSError.
+if mp is None:
+    CONNECTION_ERRORS = (OSError,)
+else:
+    CONNECTION_ERRORS = (OSError, mp.pyboard.PyboardError)
+
+
+class PicoError(Exception):
+    """
+    The code on the pico raised an exception, for example an I2C error.
+    The connection is fine: 'Pico' raises this instead of the 'PyboardError'.
+    """
+
+
+def _is_device_exception(e: BaseException) -> bool:
+    "mpfshell2 raises PyboardError('exception', stdout, traceback) for an exception on the pico"
+    return (len(e.args) == 3) and (e.args[0] == "exception")
+
+
+def list_picos() -> List[str]:
+    "The comports of all Raspberry Picos connected"
+    if mp is None:
+        raise Exception(
+            'The module "mpfshell2" is missing. Did you call "pip -r requirements.txt"?'
+        )
+    import serial.tools.list_ports
+
+    product = mp.pyboard_query.Product.RaspberryPico
+    return sorted(
+        [port.device for port in serial.tools.list_ports.comports() if product.is_type(port.vid, port.pid)]
+    )
+
+
+def chamber_name(comport: str) -> str:
+    "'COM3' -> 'COM3', '/dev/ttyACM0' -> 'ttyACM0'"
+    return pathlib.PurePath(comport).name
+
+
+def filename_log_chamber(name: str) -> pathlib.Path:
+    "All chambers of a run share the START_TIME in the name of the log"
+    return FILENAME_LOG.with_name(f"controller_{START_TIME}_{name}.txt")
+
+
+class PicoBase(abc.ABC):
+    """
+    The interface the 'Controller' uses to talk to the hardware.
+    Implemented by 'Pico' (real hardware) and 'pico_simulator.PicoSimulator'.
+    Intensities are in percent.
+    """
+
+    @abc.abstractmethod
+    def get_status(self) -> dict:
+        "Counters of the pico, for example the SHT31 crc errors"
+
+    @abc.abstractmethod
+    def get_measurement(self, average_n = 1) -> dict:
+        "Returns the keys 'humi_temp_C', 'humi_humi_pRH', 'stage_temp_C', 'stage_humi_pRH'"
+
+    @abc.abstractmethod
+    def set_fan_circ_intensity(self, intensity_K: float) -> None:
+        "The circulation fan"
+
+    @abc.abstractmethod
+    def set_fan_hum_intensity(self, intensity_K: float) -> None:
+        "The humidifier fans"
+
+    @abc.abstractmethod
+    def leds(self, color=(0,0,0)) -> None:
+        "(r, g, b) of the neopixel leds"
+
+    @abc.abstractmethod
+    def step(self, fan_hum_intensity: float, color=(0,0,0), average_n = 1) -> dict:
+        "set_fan_hum_intensity(), leds() and get_measurement() in one call"
+
+    @abc.abstractmethod
+    def set_filter(self, spec: str = None) -> None:
+        """
+        Filter the measurements on the pico, see 'sensor_filter'. None: no filter.
+        With an 'alpha_beta' stage, the measurement contains 'humi_humi_pRH_per_s'.
+        """
+
+    @abc.abstractmethod
+    def reconnect(self) -> None:
+        "Connect again after one of CONNECTION_ERRORS and restore the fans, leds..."
+
+    @abc.abstractmethod
+    def start_autonomous(self, setpoint: float, Kp: float, Ki: float, Kd: float, interval_ms = CONTROL_INTERVAL_MS) -> None:
+        "The PID runs on the pico, driven by a timer"
+
+    @abc.abstractmethod
+    def supervise(self, setpoint: float = None, Kp: float = None, Ki: float = None, Kd: float = None) -> dict:
+        """
+        Autonomous mode: Feed the watchdog of the pico, update the setpoint and the gains (None: unchanged).
+        Returns the measurement and 'fan', 'ticks', 'overruns', 'errors', 'fallback'.
+        """
+
+    @abc.abstractmethod
+    def stop_autonomous(self) -> None:
+        "The fans are switched off"
+
+
+class Pico(PicoBase):
+    def __init__(self, fe=None, comport: str = None, mpy: bool = False):
+        """
+        fe: A stand-in for the 'MpFileExplorer' (benchmarks, tests).
+        If None, the Raspberry Pico is connected.
+        comport: Connect the pico on this port, see 'list_picos()'.
+        If None, the only pico connected.
+        mpy: Deploy precompiled .mpy files, see 'micropython_deploy'.
+        """
+        self._sent = {}
+        self._sent_time_s = time.monotonic()
+        # Everything ever set: replayed after a reconnect
+        self._state = {}
+        self.writes_suppressed = 0
+        self._comport = comport
+        self._mpy = mpy
+        self.board = None
+        if fe is not None:
+            self.fe = fe
+            return
+        if mp is None:
+            raise Exception(
+                'The module "mpfshell2" is missing. Did you call "pip -r requirements.txt"?'
+            )
+        self._connect()
+
+    def _connect(self) -> None:
+        if self._comport is None:
+            self.board = mp.pyboard_query.ConnectHwtypeSerial(
+                product=mp.pyboard_query.Product.RaspberryPico
+            )
+        else:
+            self.board = mp.pyboard_query.ConnectComport(
+                comport=self._comport, product=mp.pyboard_query.Product.RaspberryPico
+            )
+        assert isinstance(self.board, mp.pyboard_query.Board)
+        self.board.systemexit_firmware_required(min="1.19.0", max="1.21.0")
+
+        self.shell = self.board.mpfshell
+        self.fe = self.shell.MpFileExplorer
+        self._sync()
+        # Start the program
+        self.fe.exec_("import micropython_logic")
+        self.pyboard_init()
+
+    def _eval(self, expression: str) -> bytes:
+        "'fe.eval()': an exception on the pico raises 'PicoError', a lost connection one of CONNECTION_ERRORS"
+        try:
+            return self.fe.eval(expression)
+        except CONNECTION_ERRORS as e:
+            if not _is_device_exception(e):
+                raise
+            # The values in the same call may not have been written: send them again
+            self.invalidate()
+            traceback = e.args[2].decode("utf-8", errors="replace").strip()
+            raise PicoError(f"{expression}: {traceback}") from None
+
+    def _sync(self) -> None:
+        "Download the source code if the manifest on the pico differs"
+        directory, manifest = micropython_deploy.prepared(mpy=self._mpy)
+        try:
+            # 'eval()' prints the result: the text of the manifest, not its repr
+            manifest_pico = self._eval(f"open({micropython_deploy.FILENAME_MANIFEST!r}).read()").decode("utf-8").strip()
+        except PicoError:
+            # No manifest on the pico: 'open()' raised
+            manifest_pico = None
+        if manifest_pico == manifest:
+            logger.info("src_micropython unchanged on the pico: sync skipped")
+            return
+        self.shell.sync_folder(directory)
+
+    def reconnect(self) -> None:
+        if self.board is not None:
+            try:
+                self.board.close()
+            except CONNECTION_ERRORS:
+                pass
+            self._connect()
+        self.invalidate()
+        setters = {
+            "fan_hum": self.set_fan_hum_intensity,
+            "fan_circ": self.set_fan_circ_intensity,
+            "leds": lambda color: self.leds(color=color),
+            "filter": self.set_filter,
+            "periodic": lambda periodic: self.set_periodic(*periodic),
+        }
+        for key, value in list(self._state.items()):
+            setters[key](value)
+
+    def get_status(self) -> dict:
+        """
+        Counters of the pico, for example the SHT31 crc errors
+        """
+        str_status = self._eval("micropython_logic.get_status()")
+        return ast.literal_eval(str_status.decode("utf-8"))
+
+    def get_measurement(self, average_n = 1) -> dict:
+        humidityRH = self._eval(f"micropython_logic.get_measurement(average_n = {average_n:d})")
+        return ast.literal_eval(humidityRH.decode("utf-8"))
+    
+    def set_periodic(self, mps = None, art = False) -> None:
+        """
+        mps=None: The sensors measure on request (single shot).
+        mps=0, 1, 2, 4, 10: Measurements per second (0: 0.5 mps).
+        art=True: Accelerated response time (4 mps).
+        """
+        self._state["periodic"] = (mps, art)
+        self._eval(f"micropython_logic.set_periodic(mps = {mps!r}, art = {art!r})")
+
+    def set_filter(self, spec: str = None) -> None:
+        self._state["filter"] = spec
+        self._eval(f"micropython_logic.set_filter({spec!r})")
+
+    def invalidate(self) -> None:
+        """
+        Forget what was sent: the next commands will be written.
+        Required after a reconnect.
+        """
+        self._sent.clear()
+        self._sent_time_s = time.monotonic()
+
+    def _changed(self, key: str, value, deadband: float = None) -> bool:
+        """
+        Returns False if 'value' was already sent. Records 'value' as sent otherwise.
+        """
+        if time.monotonic() - self._sent_time_s > RESYNC_INTERVAL_S:
+            self.invalidate()
+        self._state[key] = value
+        if key in self._sent:
+            sent = self._sent[key]
+            if deadband is None:
+                unchanged = sent == value
+            else:
+                unchanged = abs(sent - value) < deadband
+            if unchanged:
+                self.writes_suppressed += 1
+                return False
+        self._sent[key] = value
+        return True
+
+    def set_fan_circ_intensity(self, intensity_K: float) -> None:
+        assert isinstance(intensity_K, float)
+        if not self._changed("fan_circ", intensity_K, FAN_DEADBAND_PERCENT):
+            return
+        str_value = self._eval(
+            f"micropython_logic.set_fan_circ_intensity({intensity_K:0.2f})"
+        )
+
+    def set_fan_hum_intensity(self, intensity_K: float) -> None:
+        assert isinstance(intensity_K, float)
+        if not self._changed("fan_hum", intensity_K, FAN_DEADBAND_PERCENT):
+            return
+        str_value = self._eval(
+            f"micropython_logic.set_fan_hum_intensity({intensity_K:0.2f})"
+        )
+        #value = float(str_value)
+        # return value
+    def pyboard_init(self) -> None:
+        pass
+
+    def leds(self,color=(0,0,0)) -> None:
+        if not self._changed("leds", tuple(color)):
+            return
+        d=[]
+        for i in color:
+            d.append(str(i))
+        tuple_str = ','.join(d)
+        self._eval(f"micropython_logic.leds(color=({tuple_str:s}))")
+
+    def step(self, fan_hum_intensity: float, color=(0,0,0), average_n = 1) -> dict:
+        """
+        Set the humidity fans and the leds and return the measurement.
+        One REPL round trip instead of three.
+        Unchanged values are not sent.
+        """
+        assert isinstance(fan_hum_intensity, float)
+        str_fan = "None"
+        if self._changed("fan_hum", fan_hum_intensity, FAN_DEADBAND_PERCENT):
+            str_fan = f"{fan_hum_intensity:0.2f}"
+        str_color = "None"
+        if self._changed("leds", tuple(color)):
+            str_color = "(" + ','.join([str(i) for i in color]) + ")"
+        measurement = self._eval(
+            f"micropython_logic.step({str_fan:s}, color={str_color:s}, average_n = {average_n:d})"
+        )
+        return ast.literal_eval(measurement.decode("utf-8"))
+
+    def start_autonomous(self, setpoint: float, Kp: float, Ki: float, Kd: float, interval_ms = CONTROL_INTERVAL_MS) -> None:
+        self._eval(
+            f"micropython_logic.start_autonomous({setpoint!r}, {Kp!r}, {Ki!r}, {Kd!r}, interval_ms = {interval_ms:d}, host_timeout_ms = {HOST_TIMEOUT_MS:d})"
+        )
+        # The pico now writes the fans and leds itself
+        self.invalidate()
+
+    def supervise(self, setpoint: float = None, Kp: float = None, Ki: float = None, Kd: float = None) -> dict:
+        telemetry = self._eval(
+            f"micropython_logic.supervise(setpoint = {setpoint!r}, Kp = {Kp!r}, Ki = {Ki!r}, Kd = {Kd!r})"
+        )
+        return ast.literal_eval(telemetry.decode("utf-8"))
+
+    def stop_autonomous(self) -> None:
+        self._eval("micropython_logic.stop_autonomous()")
+        self.invalidate()
+
+    def stream(self, interval_ms = 1000, average_n = 1) -> "TelemetryStream":
+        """
+        Start the streaming mode: The pico pushes binary frames.
+        The REPL is blocked until 'TelemetryStream.stop()' is called.
+        """
+        telemetry = TelemetryStream(self)
+        telemetry.start(interval_ms=interval_ms, average_n=average_n)
+        return telemetry
+
+
+TelemetryFrame = collections.namedtuple(
+    "TelemetryFrame",
+    ["seq", "ticks_ms", "humi_temp_C", "humi_humi_pRH", "stage_temp_C", "stage_humi_pRH"],
+)
+
+
+class TelemetryStream:
+    """
+    Reads the frames written by 'micropython_logic.stream()' in a thread.
+    The latest frames are available in 'frames' (a ring buffer).
+    """
+
+    # Must match 'micropython_logic.FRAME_FORMAT'
+    FRAME_MAGIC = b"HC"
+    FRAME = struct.Struct("<2sIIffff")
+    FRAME_SIZE = FRAME.size + 1  # checksum
+
+    def __init__(self, pico: Pico, maxlen = 10000):
+        self._pico = pico
+        self._con = pico.fe.con
+        self.frames = collections.deque(maxlen=maxlen)
+        self.frames_lost = 0
+        self.checksum_errors = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+
+    def start(self, interval_ms = 1000, average_n = 1) -> None:
+        self._pico.fe.exec_raw_no_follow(
+            f"micropython_logic.stream(interval_ms = {interval_ms:d}, average_n = {average_n:d})"
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        # Interrupt 'stream()'. Discard the remaining frames and the traceback.
+        self._con.write(b"\x03")
+        time.sleep(0.2)
+        while self._con.inWaiting() > 0:
+            self._con.read(self._con.inWaiting())
+            time.sleep(0.2)
+        # ctrl-A: Reset the raw REPL, 'exec_raw_no_follow()' expects the prompt again
+        self._con.write(b"\x01")
+        self._pico.fe.read_until(1, b"raw REPL; CTRL-B to exit\r\n")
+
+    @property
+    def latest(self) -> TelemetryFrame:
+        return self.frames[-1]
+
+    def _run(self) -> None:
+        buf = bytearray()
+        last_seq = None
+        while not self._stop.is_set():
+            buf += self._con.read(max(1, self._con.inWaiting()))
+            while len(buf) >= self.FRAME_SIZE:
+                start = buf.find(self.FRAME_MAGIC)
+                if start < 0:
+                    del buf[:-1]
+                    break
+                if start > 0:
+                    del buf[:start]
+                    continue
+                if len(buf) < self.FRAME_SIZE:
+                    break
+                frame = buf[: self.FRAME_SIZE]
+                if sum(frame[:-1]) & 0xFF != frame[-1]:
+                    # Not a frame boundary: resync on the next magic
+                    self.checksum_errors += 1
+                    del buf[:1]
+                    continue
+                del buf[: self.FRAME_SIZE]
+                _magic, *values = self.FRAME.unpack(frame[:-1])
+                frame = TelemetryFrame(*values)
+                if (last_seq is not None) and (frame.seq > last_seq):
+                    self.frames_lost += frame.seq - last_seq - 1
+                last_seq = frame.seq
+                self.frames.append(frame)
+
+
+# Returned by 'Controller.tick()': the text line and the values of the row logged (None on error)
+TickResult = collections.namedtuple("TickResult", ["text", "values"])
+
+
+class Controller:
+    """
+    The control loop. 'tick()' is called by the 'HardwareWorker' every CONTROL_INTERVAL_MS.
+    All methods must be called from the thread of the 'HardwareWorker'.
+    """
+
+    def __init__(self, pico: PicoBase, filename_log: pathlib.Path = FILENAME_LOG, clock=time.monotonic, autonomous: bool = False, filename_tuning: pathlib.Path = pid_tuning.FILENAME_TUNING):
+        """
+        clock: Returns the time in seconds. A simulation may pass a clock
+        which runs faster than real time, see 'pico_simulator.SimulatedClock'.
+        autonomous: The PID runs on the pico. 'tick()' only supervises and logs.
+        filename_tuning: The gains saved by 'pid_tuning.py'. None: the default gains.
+        """
+        assert isinstance(pico, PicoBase)
+        self._pico = pico
+        self._clock = clock
+        self._starttime = clock()
+        self._last_tick_s = None
+        self.timing = loop_timing.LoopTiming(interval_s=CONTROL_INTERVAL_MS / 1000.0)
+
+        self._csv = datafile_csv.Csv(
+            filename_log,
+            flush_rows=60,
+            flush_interval_s=10.0,
+            filename_binary=filename_log.with_suffix(".bin"),
+            max_bytes=100_000_000,
+            max_age_s=24 * 3600.0,
+            extra_columns={"schedule_segment": "3d", "schedule_progress": "5.1f"},
+        )
+        self.fan_intensity=0.0
+        self.leds_color=(100,0,0)
+        self.controller_on = False
+        self.autonomous = autonomous
+        self._autonomous_running = False
+        self._supervise_gains = None
+        self.schedule = None
+        self._schedule_start_s = None
+        # Filter of 'humi_humi_pRH' on the host, see 'set_filter()'
+        self._filter = None
+        self._filter_spec = None
+        self._filter_on_pico = False
+
+        # The PID uses the controller clock: a simulation or a replay never reads the wall clock
+        self.pid = simple_pid.PID(Kp=3.0, Ki=0.2, Kd=0.0, sample_time=0.6, output_limits=(
+            10.0, 100.0), proportional_on_measurement=False, setpoint = 60.0, clock=clock)
+        tuning = None if filename_tuning is None else pid_tuning.load_tuning(filename_tuning)
+        if tuning is not None:
+            # Recommended by 'python pid_tuning.py <logs>'
+            logger.info(f"Tuning from {pid_tuning.FILENAME_TUNING.name}: {tuning}")
+            self.pid.tunings = (tuning["Kp"], tuning["Ki"], tuning["Kd"])
+
+        self._pico.set_fan_circ_intensity(0.0) 
+
+    def tick(self) -> TickResult:
+        if self._autonomous_running:
+            return self._tick_autonomous()
+        timing = self.timing
+        timing.tick()
+        t = timing.start()
+        now_s = self._clock()
+        self._csv.time_s=int(now_s - self._starttime)
+        # The PID uses the time of the controller clock, not the wall clock
+        dt_s = None if self._last_tick_s is None else now_s - self._last_tick_s
+        self._last_tick_s = now_s
+        self._update_schedule(now_s)
+        # Apply the outputs calculated in the previous tick and measure
+        _dict = self._pico.step(fan_hum_intensity=self.fan_intensity, color=self.leds_color, average_n = 5)
+        t = timing.stage("pico_step", t)
+        self._csv.fan=self.fan_intensity
+        self._csv.set_humi_pRH=self.pid.setpoint
+        self._csv.humi_humi_pRH=float(_dict.get('humi_humi_pRH'))
+        self._csv.stage_humi_pRH=float(_dict.get('stage_humi_pRH'))
+        self._csv.humi_temp_C=float(_dict.get('humi_temp_C'))
+        self._csv.stage_temp_C=float(_dict.get('stage_temp_C'))
+        self._csv.write()
+        t = timing.stage("csv", t)
+
+        if not self.controller_on:
+            #self.pid.set_auto_mode(False)
+            self.fan_intensity=0.0
+            self.leds_color=(100,0,0)
+        else:
+            #self.pid.set_auto_mode(True, last_output=0.0)
+            humi_pRH, rate = self._filtered(_dict, dt_s)
+            if (dt_s is None) or (dt_s <= 0.0):
+                self.fan_intensity = self.pid(humi_pRH, input_rate=rate)
+            else:
+                self.fan_intensity = self.pid(humi_pRH, dt=dt_s, input_rate=rate)
+            if abs(self._csv.humi_humi_pRH - self._csv.humi_humi_pRH) < 2.0:
+                self.leds_color=(0,100,0)
+            else:
+                self.leds_color=(0,0,100)
+        timing.stage("pid", t)
+
+        return TickResult(text=f"{self._csv.text}\n", values=self._csv.values)
+
+    def _tick_autonomous(self) -> TickResult:
+        timing = self.timing
+        timing.tick()
+        t = timing.start()
+        now_s = self._clock()
+        self._csv.time_s=int(now_s - self._starttime)
+        self._last_tick_s = now_s
+        self._update_schedule(now_s)
+        # Only send the setpoint and the gains if they changed
+        pid = self.pid
+        gains = (pid.setpoint, pid.Kp, pid.Ki, pid.Kd)
+        if gains == self._supervise_gains:
+            _dict = self._pico.supervise()
+        else:
+            _dict = self._pico.supervise(setpoint=pid.setpoint, Kp=pid.Kp, Ki=pid.Ki, Kd=pid.Kd)
+            self._supervise_gains = gains
+        t = timing.stage("pico_supervise", t)
+        if _dict['fallback'] is not None:
+            logger.warning(f"Pico in fallback mode: {_dict['fallback']}")
+        self.fan_intensity=float(_dict['fan'])
+        self._csv.fan=self.fan_intensity
+        self._csv.set_humi_pRH=pid.setpoint
+        self._csv.humi_humi_pRH=float(_dict.get('humi_humi_pRH'))
+        self._csv.stage_humi_pRH=float(_dict.get('stage_humi_pRH'))
+        self._csv.humi_temp_C=float(_dict.get('humi_temp_C'))
+        self._csv.stage_temp_C=float(_dict.get('stage_temp_C'))
+        self._csv.write()
+        timing.stage("csv", t)
+
+        return TickResult(text=f"{self._csv.text}\n", values=self._csv.values)
+
+    def set_filter(self, spec: str = None, on_pico: bool = False) -> None:
+        """
+        Filter the humidity for the PID, see 'sensor_filter', for example 'median:3,alpha_beta:0.5:0.05'.
+        With an 'alpha_beta' stage, the PID uses its rate for the derivative term.
+        on_pico: The filter runs on the pico, on all sensors. Else on the host, for the PID only.
+        The log contains the values from the pico.
+        In autonomous mode the PID runs on the pico: a filter for the host runs on the pico too.
+        """
+        self._filter_spec = spec
+        self._filter_on_pico = on_pico
+        self._apply_filter()
+
+    def _apply_filter(self) -> None:
+        spec = self._filter_spec
+        if self._filter_on_pico or self._autonomous_running:
+            self._filter = None
+            self._pico.set_filter(spec)
+            return
+        self._pico.set_filter(None)
+        self._filter = None if spec is None else sensor_filter.Pipeline(spec)
+
+    def _filtered(self, _dict: dict, dt_s: float):
+        "Returns the humidity and its rate (None if not estimated) for the PID"
+        humi_pRH = float(_dict['humi_humi_pRH'])
+        if self._filter is None:
+            rate = _dict.get('humi_humi_pRH_per_s')
+            return humi_pRH, None if rate is None else float(rate)
+        if (dt_s is None) or (dt_s <= 0.0):
+            dt_s = CONTROL_INTERVAL_MS / 1000.0
+        humi_pRH = self._filter.update(humi_pRH, dt_s)
+        return humi_pRH, self._filter.rate
+
+    def start_schedule(self, filename: pathlib.Path) -> None:
+        """
+        Run the setpoint profile 'filename', see 'setpoint_schedule'.
+        The profile starts at the current setpoint and the PID keeps its state (bumpless).
+        """
+        self.schedule = setpoint_schedule.Schedule.load(filename, start_pRH=float(self.pid.setpoint))
+        self._schedule_start_s = self._clock()
+        logger.info(f"Schedule {filename.name} started: {self.schedule.duration_s / 3600.0:0.2f}h")
+
+    def stop_schedule(self) -> None:
+        "The setpoint stays where the schedule left it"
+        self.schedule = None
+        self._csv.schedule_segment = 0
+        self._csv.schedule_progress = 0.0
+
+    def _update_schedule(self, now_s: float) -> None:
+        if self.schedule is None:
+            return
+        elapsed_s = now_s - self._schedule_start_s
+        self.pid.setpoint = self.schedule.setpoint(elapsed_s)
+        self._csv.schedule_segment = self.schedule.segment(elapsed_s)
+        self._csv.schedule_progress = 100.0 * self.schedule.progress(elapsed_s)
+        if self.schedule.finished(elapsed_s):
+            logger.info("Schedule finished")
+            self.stop_schedule()
+
+    def _update_autonomous(self) -> None:
+        "Start or stop the PID on the pico"
+        run = self.controller_on and self.autonomous
+        if run == self._autonomous_running:
+            return
+        if run:
+            pid = self.pid
+            self._pico.start_autonomous(setpoint=pid.setpoint, Kp=pid.Kp, Ki=pid.Ki, Kd=pid.Kd)
+            self._supervise_gains = (pid.setpoint, pid.Kp, pid.Ki, pid.Kd)
+        else:
+            self._pico.stop_autonomous()
+            self.fan_intensity=0.0
+        self._autonomous_running = run
+        if (self._filter_spec is not None) and not self._filter_on_pico:
+            # The filter moves with the PID: to the pico and back to the host
+            logger.info(f"Filter {self._filter_spec!r} on the {'pico' if run else 'host'}")
+            self._apply_filter()
+
+    def reconnect(self) -> None:
+        "After one of CONNECTION_ERRORS: connect again and restore the state of the pico"
+        self._pico.reconnect()
+        if self._autonomous_running:
+            pid = self.pid
+            self._pico.start_autonomous(setpoint=pid.setpoint, Kp=pid.Kp, Ki=pid.Ki, Kd=pid.Kd)
+            self._supervise_gains = (pid.setpoint, pid.Kp, pid.Ki, pid.Kd)
+
+    def set_controller(self, on: bool, setpoint: float = None, Kp: float = None, Ki: float = None, Kd: float = None):
+        logger.debug(f"Controller {on}")
+        self.controller_on = on
+        if on:
+            self.pid.Kp=Kp
+            self.pid.Ki=Ki
+            self.pid.Kd=Kd
+            self.pid.setpoint=setpoint
+            self.pid.reset()
+            if self._filter is not None:
+                # The host filter only runs while the controller is on: drop the values from before
+                self._filter.reset()
+        self._update_autonomous()
+
+    def set_autonomous(self, on: bool):
+        "on: The PID runs on the pico"
+        self.autonomous = on
+        self._update_autonomous()
+
+    def set_circ(self, on: bool):
+        logger.debug(f"Fan circulation {on}")
+        if on:
+            self._pico.set_fan_circ_intensity(45.0)
+        else:
+            self._pico.set_fan_circ_intensity(0.0)
+
+    @property
+    def filename_log(self) -> pathlib.Path:
+        "The log file currently written"
+        return self._csv.filename
+
+    def close(self):
+        if self._autonomous_running:
+            self._pico.stop_autonomous()
+            self._autonomous_running = False
+        self._csv.close()
+
+
+class HardwareWorker:
+    """
+    Owns the connection to the pico: A thread calls 'Controller.tick()'
+    at a fixed cadence, independent of the gui.
+    With several chambers, every chamber has its own worker: the serial
+    round trips of the picos overlap.
+    Commands are passed in with 'call()', the 'TickResult's of the ticks
+    are returned in the queue 'results'.
+    """
+
+    def __init__(self, controller: Controller, interval_ms: int = CONTROL_INTERVAL_MS, name: str = ""):
+        self.controller = controller
+        self.interval_s = interval_ms / 1000.0
+        controller.timing.interval_s = self.interval_s
+        self.commands = queue.Queue()
+        self.results = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"hardware {name}".strip(), daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        # Wake up the thread
+        self.commands.put(None)
+        self._thread.join()
+
+    def call(self, function, **kwargs) -> None:
+        """
+        'function(**kwargs)' will be called in the thread of the worker.
+        """
+        self.commands.put((function, kwargs))
+
+    def _run(self) -> None:
+        next_tick_s = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.results.put(self.controller.tick())
+            except CONNECTION_ERRORS as e:
+                logger.exception(e)
+                self.results.put(TickResult(text=f"ERROR: {e!r}\n", values=None))
+                self._reconnect()
+            except Exception as e:
+                logger.exception(e)
+                self.results.put(TickResult(text=f"ERROR: {e!r}\n", values=None))
+
+            next_tick_s += self.interval_s
+            if next_tick_s < time.monotonic():
+                # The tick took longer than interval_s: do not try to catch up
+                next_tick_s = time.monotonic()
+            self._wait_for_commands(next_tick_s)
+
+    def _reconnect(self) -> None:
+        "If it fails, the next tick fails too and the reconnect is tried again."
+        start_s = time.monotonic()
+        try:
+            self.controller.reconnect()
+        except (Exception,) + CONNECTION_ERRORS as e:
+            logger.exception(e)
+            self.results.put(TickResult(text=f"ERROR: reconnect failed: {e!r}\n", values=None))
+            return
+        self.results.put(TickResult(text=f"Reconnected in {time.monotonic() - start_s:0.1f}s\n", values=None))
+
+    def _wait_for_commands(self, until_s: float) -> None:
+        "Process the commands until it is time for the next tick."
+        while not self._stop.is_set():
+            timeout_s = until_s - time.monotonic()
+            if timeout_s <= 0.0:
+                return
+            try:
+                command = self.commands.get(timeout=timeout_s)
+            except queue.Empty:
+                return
+            if command is None:
+                return
+            function, kwargs = command
+            try:
+                function(**kwargs)
+            except CONNECTION_ERRORS as e:
+                logger.exception(e)
+                self.results.put(TickResult(text=f"ERROR: {e!r}\n", values=None))
+                self._reconnect()
+            except Exception as e:
+                logger.exception(e)
+                self.results.put(TickResult(text=f"ERROR: {e!r}\n", values=None))
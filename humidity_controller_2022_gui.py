@@ -2,81 +2,22 @@
 tkinter: See https://www.tutorialspoint.com/python3/python_gui_programming.htm
 """
 import tkinter
-import pathlib
+import argparse
 import logging
-import time
-
-import simple_pid
-import datafile_csv
-
-logger = logging.getLogger("humidity_controller_2022")
-
-logger.setLevel(logging.DEBUG)
-
-DIRECTORY_OF_THIS_FILE = pathlib.Path(__file__).absolute().parent
-
-START_TIME = time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime())
-FILENAME_LOG = DIRECTORY_OF_THIS_FILE / "log" / f"controller_{START_TIME}.txt"
-FILENAME_LOG.parent.mkdir(parents=True, exist_ok=True)
-
-
-try:
-    import mp
-    import mp.version
-    import mp.micropythonshell
-    import mp.pyboard_query
-except ModuleNotFoundError as ex:
-    raise Exception(
-        'The module "mpfshell2" is missing. Did you call "pip -r requirements.txt"?'
-    )
-
-
-class Pico:
-    def __init__(self):
-        self.board = mp.pyboard_query.ConnectHwtypeSerial(
-            product=mp.pyboard_query.Product.RaspberryPico
-        )
-        assert isinstance(self.board, mp.pyboard_query.Board)
-        self.board.systemexit_firmware_required(min="1.19.0", max="1.21.0")
-
-        self.shell = self.board.mpfshell
-        self.fe = self.shell.MpFileExplorer
-        # Download the source code
-        self.shell.sync_folder(DIRECTORY_OF_THIS_FILE / "src_micropython")
-        # Start the program
-        self.fe.exec_("import micropython_logic")
-        self.pyboard_init()
-
-    def get_status(self) -> str:
-        str_status = self.fe.eval("micropython_logic.get_status()")
-        return str_status
-
-    def get_measurement(self, average_n = 1) -> dict:
-        humidityRH = self.fe.eval(f"micropython_logic.get_measurement(average_n = {average_n:d})")
-        return eval(humidityRH)
-    
-    def set_fan_circ_intensity(self, intensity_K: float) -> None:
-        assert isinstance(intensity_K, float)
-        str_value = self.fe.eval(
-            f"micropython_logic.set_fan_circ_intensity({intensity_K:0.2f})"
-        )
-
-    def set_fan_hum_intensity(self, intensity_K: float) -> None:
-        assert isinstance(intensity_K, float)
-        str_value = self.fe.eval(
-            f"micropython_logic.set_fan_hum_intensity({intensity_K:0.2f})"
-        )
-        #value = float(str_value)
-        # return value
-    def pyboard_init(self) -> None:
-        pass
+import pathlib
+import queue
+import collections
 
-    def leds(self,color=(0,0,0)) -> None:
-        d=[]
-        for i in color:
-            d.append(str(i))
-        tuple_str = ','.join(d)
-        self.fe.eval(f"micropython_logic.leds(color=({tuple_str:s}))")
+import plot_buffer
+from humidity_controller_2022 import (
+    Pico,
+    Controller,
+    HardwareWorker,
+    TickResult,
+    list_picos,
+    chamber_name,
+    filename_log_chamber,
+)
 
 
 class Entry:
@@ -104,11 +45,215 @@ class Entry:
         self._entry.config(state=state)
 
 
+def read_lines_before(filename: pathlib.Path, offset: int, n: int, chunk_size: int = 65536):
+    """
+    Read up to 'n' lines ending before byte 'offset' (None: end of file).
+    Returns the lines (oldest first) and the offset of the first line returned.
+    """
+    with filename.open("rb") as f:
+        if offset is None:
+            offset = f.seek(0, 2)
+        data = b""
+        start = offset
+        while start > 0 and data.count(b"\n") <= n:
+            read_size = min(chunk_size, start)
+            start -= read_size
+            f.seek(start)
+            data = f.read(read_size) + data
+    lines = data.splitlines(keepends=True)
+    if start > 0:
+        # The first line is incomplete
+        start += len(lines[0])
+        lines = lines[1:]
+    lines = lines[-n:]
+    return [line.decode() for line in lines], offset - sum([len(line) for line in lines])
+
+
+class LogView:
+    """
+    Shows the newest lines on top, at most 'max_lines'. Appended lines
+    are inserted into the widget in one batch every 'update_ms'.
+    Older lines are not kept in memory: 'older' loads them page by page
+    from the log file on disk.
+    """
+
+    def __init__(self, parent, max_lines: int = 500, update_ms: int = 250):
+        self.max_lines = max_lines
+        self._pending = collections.deque(maxlen=max_lines)
+        self._lines_live = 0
+        self._filename = None
+        self._offset_older = None
+
+        frame = tkinter.Frame(parent)
+        buttons = tkinter.Frame(frame)
+        tkinter.Button(buttons, text="older (log file)", command=self.older).pack(side=tkinter.LEFT)
+        tkinter.Button(buttons, text="newest", command=self.newest).pack(side=tkinter.LEFT)
+        buttons.pack(side=tkinter.TOP, fill=tkinter.X)
+        scrollbar = tkinter.Scrollbar(frame)
+        scrollbar.pack(side=tkinter.RIGHT, fill=tkinter.Y)
+        self._text = tkinter.Text(frame, yscrollcommand=scrollbar.set)
+        self._text.pack(fill=tkinter.BOTH, expand=tkinter.YES)
+        scrollbar.config(command=self._text.yview)
+        frame.pack(fill=tkinter.BOTH, expand=tkinter.YES)
+
+        def update():
+            self._text.after(update_ms, update)
+            self._update()
+
+        update()
+
+    def set_filename(self, filename: pathlib.Path) -> None:
+        "The log file to page through with 'older'."
+        if filename != self._filename:
+            # The log was rotated: the offset was in the previous file
+            self._offset_older = None
+        self._filename = filename
+
+    def append(self, line: str) -> None:
+        self._pending.append(line)
+
+    def _update(self) -> None:
+        if len(self._pending) == 0:
+            return
+        lines_live = self._lines_live + len(self._pending)
+        self._text.insert("1.0", "".join(reversed(self._pending)))
+        self._pending.clear()
+        if lines_live > self.max_lines:
+            # Drop the live lines beyond the newest 'max_lines'
+            self._text.delete(f"{self.max_lines + 1}.0", f"{lines_live + 1}.0")
+            lines_live = self.max_lines
+        self._lines_live = lines_live
+
+    def older(self) -> None:
+        "Replace the lines below the live lines by the next page from the log file."
+        if self._filename is None or not self._filename.exists():
+            return
+        if self._offset_older == 0:
+            return
+        lines, self._offset_older = read_lines_before(self._filename, self._offset_older, self.max_lines)
+        self._text.delete(f"{self._lines_live + 1}.0", tkinter.END)
+        self._text.insert(tkinter.END, f"--- {self._filename.name} ---\n" + "".join(reversed(lines)))
+        self._text.see(f"{self._lines_live + 1}.0")
+
+    def newest(self) -> None:
+        "Drop the lines from the log file."
+        self._offset_older = None
+        self._text.delete(f"{self._lines_live + 1}.0", tkinter.END)
+        self._text.see("1.0")
+
+
+class PlotView:
+    """
+    Live plot of the humidities, temperatures and the fan.
+    The values are kept in a 'plot_buffer.MinMaxRing', the canvas is redrawn
+    every 'redraw_ms' if new values arrived or the time span changed.
+    """
+
+    # (title, unit, [(name, color), ...])
+    PANELS = (
+        ("humidity", "%RH", (("humi_humi_pRH", "blue"), ("stage_humi_pRH", "green"), ("set_humi_pRH", "black"))),
+        ("temperature", "C", (("humi_temp_C", "blue"), ("stage_temp_C", "green"))),
+        ("fan", "%", (("fan", "red"),)),
+    )
+    SPANS_S = (("1 min", 60), ("10 min", 600), ("1 h", 3600), ("6 h", 6 * 3600), ("24 h", 24 * 3600))
+
+    def __init__(self, parent, width: int = 1000, height: int = 300, redraw_ms: int = 1000):
+        self._names = [name for _title, _unit, channels in self.PANELS for name, _color in channels]
+        self._ring = plot_buffer.MinMaxRing(self._names, capacity=4096, factor=4, levels=6)
+        self._dirty = False
+        self._last_time_s = 0.0
+
+        frame = tkinter.Frame(parent)
+        buttons = tkinter.Frame(frame)
+        self._var_span = tkinter.IntVar(value=self.SPANS_S[1][1])
+        for text, span_s in self.SPANS_S:
+            tkinter.Radiobutton(
+                buttons, text=text, variable=self._var_span, value=span_s, command=self._span_changed
+            ).pack(side=tkinter.LEFT)
+        buttons.pack(side=tkinter.TOP)
+        self._canvas = tkinter.Canvas(frame, width=width, height=height, background="white")
+        self._canvas.pack(fill=tkinter.BOTH, expand=tkinter.YES)
+        frame.pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=tkinter.YES)
+
+        def redraw():
+            self._canvas.after(redraw_ms, redraw)
+            if self._dirty:
+                self._redraw()
+
+        redraw()
+
+    def append(self, values: dict) -> None:
+        self._last_time_s = float(values["time_s"])
+        self._ring.append(self._last_time_s, [values[name] for name in self._names])
+        self._dirty = True
+
+    def _span_changed(self) -> None:
+        self._dirty = True
+
+    def _redraw(self) -> None:
+        self._dirty = False
+        canvas = self._canvas
+        canvas.delete("all")
+        width = max(canvas.winfo_width(), 100)
+        height = max(canvas.winfo_height(), 60)
+        span_s = self._var_span.get()
+        time_to_s = self._last_time_s
+        time_from_s = time_to_s - span_s
+        margin_left = 60
+        plot_width = width - margin_left - 10
+        times, v_min, v_max = self._ring.window(time_from_s, time_to_s, max_points=plot_width)
+        if len(times) == 0:
+            return
+        x = margin_left + (times - time_from_s) / span_s * plot_width
+
+        panel_height = height / len(self.PANELS)
+        column = 0
+        for i_panel, (title, unit, channels) in enumerate(self.PANELS):
+            top = i_panel * panel_height + 5
+            bottom = (i_panel + 1) * panel_height - 5
+            columns = range(column, column + len(channels))
+            column += len(channels)
+            lo = float(v_min[:, columns].min())
+            hi = float(v_max[:, columns].max())
+            if hi - lo < 1e-6:
+                lo, hi = lo - 0.5, hi + 0.5
+
+            def y(values):
+                return bottom - (values - lo) / (hi - lo) * (bottom - top)
+
+            canvas.create_rectangle(margin_left, top, width - 10, bottom, outline="gray")
+            canvas.create_text(5, top, anchor=tkinter.NW, text=f"{hi:0.1f} {unit}")
+            canvas.create_text(5, bottom, anchor=tkinter.SW, text=f"{lo:0.1f} {unit}")
+            canvas.create_text(margin_left + 5, top + 2, anchor=tkinter.NW, text=title, fill="gray")
+            for i_column, (_name, color) in zip(columns, channels):
+                # Min-max decimation: every point is drawn as a vertical stroke from min to max
+                y_min = y(v_min[:, i_column])
+                y_max = y(v_max[:, i_column])
+                points = []
+                for xi, y0, y1 in zip(x.tolist(), y_min.tolist(), y_max.tolist()):
+                    points.extend((xi, y0, xi, y1))
+                if len(points) >= 4:
+                    if len(points) == 4:
+                        points.extend((points[0] + 1, points[1]))
+                    canvas.create_line(*points, fill=color)
+
+
 class Window:
-    def __init__(self):
-        self._root = tkinter.Tk(className="Humidty Controller 2022")
+    def __init__(self, parent=None, title: str = None):
+        """
+        parent: None for a single chamber. Else the window of a chamber is
+        opened from the 'Overview' and only hidden when closed.
+        """
+        if parent is None:
+            self._root = tkinter.Tk(className="Humidty Controller 2022")
+        else:
+            self._root = tkinter.Toplevel(parent)
+            self._root.protocol("WM_DELETE_WINDOW", self._root.withdraw)
+            self._root.withdraw()
+        if title is not None:
+            self._root.title(title)
         self._root.maxsize(3000, 2000)
-        self._root.geometry('1000x500')
+        self._root.geometry('1000x900')
         self.entry_setRH = Entry(self._root, "Set %RH")
         self.entry_kp = Entry(self._root, "Kp")
         self.entry_ki = Entry(self._root, "Ki")
@@ -116,11 +261,14 @@ class Window:
         self._var_controller = self.add_check("controller on")
         self._var_circ = self.add_check("circulation on")
 
-        self._text = tkinter.Text(self._root)
-        self._text.pack(fill=tkinter.BOTH, expand=tkinter.YES)
+        self._var_timing = self.add_check("loop timing")
+        self._label_timing = tkinter.Label(self._root, text="", anchor=tkinter.W, justify=tkinter.LEFT)
+        self._label_timing.pack(side=tkinter.TOP, fill=tkinter.X)
+        self.plot_view = PlotView(self._root)
+        self.log_view = LogView(self._root)
 
     def text(self, msg: str):
-        self._text.insert("1.0", msg)
+        self.log_view.append(msg)
 
     def timer(self, interval_ms, callback):
         """
@@ -133,6 +281,22 @@ class Window:
 
         time_over()
 
+    def poll(self, results: queue.Queue, callback, interval_ms=100):
+        """
+        Call 'callback(result)' in the gui thread for every result
+        put into the queue by another thread.
+        """
+
+        def drain():
+            while True:
+                try:
+                    result = results.get_nowait()
+                except queue.Empty:
+                    return
+                callback(result)
+
+        self.timer(interval_ms=interval_ms, callback=drain)
+
     @property
     def controller_on(self) -> bool:
         return self._var_controller.get() == 1
@@ -141,6 +305,17 @@ class Window:
     def circ_on(self) -> bool:
         return self._var_circ.get() == 1
 
+    @property
+    def timing_on(self) -> bool:
+        return self._var_timing.get() == 1
+
+    @timing_on.setter
+    def timing_on(self, on: bool) -> None:
+        self._var_timing.set(1 if on else 0)
+
+    def status_timing(self, text: str) -> None:
+        self._label_timing.config(text=text)
+
     def callback_controller(self, callback):
         """
         The controller registers a callback
@@ -155,6 +330,11 @@ class Window:
             callback(on=self.circ_on)
         self._var_circ.trace_add("write", cb)
 
+    def callback_timing(self, callback):
+        def cb(*args):
+            callback(on=self.timing_on)
+        self._var_timing.trace_add("write", cb)
+
     def add_check(self, text):
         check_var = tkinter.IntVar()
         check_button = tkinter.Checkbutton(
@@ -163,102 +343,205 @@ class Window:
         check_button.pack(side=tkinter.TOP)
         return check_var
 
+    def show(self) -> None:
+        self._root.deiconify()
+        self._root.lift()
+
     def mainloop(self):
         self._root.mainloop()
 
 
-class Controller:
-    def __init__(self, pico: Pico, window: Window):
-        self._pico = pico
-        self._window = window
-        self._starttime = time.time()
+class Overview:
+    """
+    One row per chamber with the latest values. 'show' opens the window of the chamber.
+    """
+
+    # (name in 'TickResult.values', heading)
+    COLUMNS = (
+        ("humi_humi_pRH", "humi %RH"),
+        ("set_humi_pRH", "set %RH"),
+        ("stage_humi_pRH", "stage %RH"),
+        ("humi_temp_C", "humi C"),
+        ("stage_temp_C", "stage C"),
+        ("fan", "fan %"),
+    )
+
+    def __init__(self):
+        self.root = tkinter.Tk(className="Humidty Controller 2022")
+        self.root.title("Humidity Controller 2022: Overview")
+        self._table = tkinter.Frame(self.root)
+        self._table.pack(side=tkinter.TOP, fill=tkinter.X, padx=10, pady=10)
+        headings = ["chamber"] + [heading for _name, heading in self.COLUMNS] + ["status", ""]
+        for column, heading in enumerate(headings):
+            tkinter.Label(self._table, text=heading, font="TkDefaultFont 9 bold").grid(row=0, column=column, padx=5)
+        # name -> (labels of the values, label of the status)
+        self._rows = {}
+
+    def add_chamber(self, name: str, window: Window) -> None:
+        row = len(self._rows) + 1
+        tkinter.Label(self._table, text=name).grid(row=row, column=0, sticky=tkinter.W, padx=5)
+        labels = []
+        for column in range(len(self.COLUMNS)):
+            label = tkinter.Label(self._table, text="-", width=9, anchor=tkinter.E)
+            label.grid(row=row, column=column + 1, padx=5)
+            labels.append(label)
+        label_status = tkinter.Label(self._table, text="", width=30, anchor=tkinter.W)
+        label_status.grid(row=row, column=len(self.COLUMNS) + 1, padx=5)
+        tkinter.Button(self._table, text="show", command=window.show).grid(row=row, column=len(self.COLUMNS) + 2)
+        self._rows[name] = (labels, label_status)
+
+    def update(self, name: str, result: TickResult) -> None:
+        labels, label_status = self._rows[name]
+        if result.values is None:
+            label_status.config(text=result.text.strip()[:60], foreground="red")
+            return
+        for label, (column, _heading) in zip(labels, self.COLUMNS):
+            label.config(text=f"{result.values[column]:0.1f}")
+        label_status.config(text=f"time_s={result.values['time_s']}", foreground="black")
+
+    def mainloop(self):
+        self.root.mainloop()
+
 
-        self._csv = datafile_csv.Csv(FILENAME_LOG)
-        self.fan_intensity=0.0
+class Gui:
+    """
+    Connects the 'Window' with the 'Controller' which runs in the 'HardwareWorker'.
+    """
+
+    def __init__(self, window: Window, worker: HardwareWorker, overview: Overview = None, name: str = None, schedule: pathlib.Path = None):
+        """
+        schedule: A setpoint profile which starts when the controller is switched on.
+        """
+        self._window = window
+        self._schedule = schedule
+        self._worker = worker
+        self._controller = worker.controller
+        self._overview = overview
+        self._name = name
+        if overview is not None:
+            overview.add_chamber(name, window)
+
+        pid = self._controller.pid
+        self._window.entry_setRH.value = float(pid.setpoint)
+        self._window.entry_kp.value = float(pid.Kp)
+        self._window.entry_ki.value = float(pid.Ki)
+        self._window.entry_kd.value = float(pid.Kd)
 
         window.callback_controller(callback=self._button_pressed_controller)
         window.callback_circ(callback=self._button_pressed_circ)
-
-        self._window.entry_setRH.value = 60.0
-        self._window.entry_kp.value = 3.0
-        self._window.entry_ki.value = 0.2
-        self._window.entry_kd.value = 0.0
-
-        self.pid = simple_pid.PID(sample_time=0.6, output_limits=(
-            10.0, 100.0), proportional_on_measurement=False, setpoint = self._window.entry_setRH.value)
-
-        self._pico.set_fan_circ_intensity(0.0) 
-
-        # Start the controller
-        window.timer(interval_ms=1000, callback=self._control)
-
-
-    def _control(self):
-        # print(self._window.entry_kd.get())
-        #value = self._pico.set_fan_intensity(2.1)
-        #print(f"Control 2.1->{value}")
-        self._csv.time_s=int(time.time() - self._starttime)
-        _dict = self._pico.get_measurement(average_n = 5)
-        self._csv.fan=self.fan_intensity
-        self._csv.set_humi_pRH=self.pid.setpoint
-        self._csv.humi_humi_pRH=float(_dict.get('humi_humi_pRH'))
-        self._csv.stage_humi_pRH=float(_dict.get('stage_humi_pRH'))
-        self._csv.humi_temp_C=float(_dict.get('humi_temp_C'))
-        self._csv.stage_temp_C=float(_dict.get('stage_temp_C'))
-        #self._window.text(f"ping {self._counter} {self._csv.rh:0.1f} RH \n")
-        self._csv.write()
-        self._window.text(f"{self._csv.text}\n")
-
-        if not self._window.controller_on:
-            #self.pid.set_auto_mode(False)
-            self.fan_intensity=0.0
-            self._pico.set_fan_hum_intensity(0.0)
-            self._pico.leds(color=(100,0,0))
+        window.poll(worker.results, callback=self._result)
+
+        self._timing = self._controller.timing
+        window.timing_on = self._timing.enabled
+        window.callback_timing(callback=self._button_pressed_timing)
+        window.timer(interval_ms=2000, callback=self._update_timing)
+
+    def _result(self, result: TickResult):
+        t = self._timing.start()
+        self._window.text(result.text)
+        # The log file changes with the rotation, see 'datafile_csv.Csv'
+        self._window.log_view.set_filename(self._controller.filename_log)
+        if result.values is not None:
+            self._window.plot_view.append(result.values)
+        if self._overview is not None:
+            self._overview.update(self._name, result)
+        self._timing.stage("gui", t)
+
+    def _update_timing(self):
+        if self._timing.enabled:
+            self._window.status_timing(self._timing.summary())
+
+    def _button_pressed_timing(self, on: bool):
+        # Atomic, no need to pass it through the worker
+        self._timing.enabled = on
+        if on:
+            self._timing.reset()
         else:
-            #self.pid.set_auto_mode(True, last_output=0.0)
-            self.fan_intensity = self.pid(self._csv.humi_humi_pRH)
-            print(self.fan_intensity)
-            self._pico.set_fan_hum_intensity(self.fan_intensity)
-            if abs(self._csv.humi_humi_pRH - self._csv.humi_humi_pRH) < 2.0:
-                self._pico.leds(color=(0,100,0))
-            else:
-                self._pico.leds(color=(0,0,100))    
-
+            self._window.status_timing("")
 
     def _button_pressed_controller(self, on: bool):
-        print(f"vent {on}")
         enabled = not on
         self._window.entry_setRH.enabled = enabled
         self._window.entry_kd.enabled = enabled
         self._window.entry_ki.enabled = enabled
         self._window.entry_kp.enabled = enabled
-        if on:
-            self.pid.Kp=self._window.entry_kp.value
-            self.pid.Ki=self._window.entry_ki.value
-            self.pid.Kd=self._window.entry_kd.value
-            self.pid.setpoint=self._window.entry_setRH.value
-            self.pid.reset()
-            print('blabliblaenabled')
+        self._worker.call(
+            self._controller.set_controller,
+            on=on,
+            setpoint=self._window.entry_setRH.value,
+            Kp=self._window.entry_kp.value,
+            Ki=self._window.entry_ki.value,
+            Kd=self._window.entry_kd.value,
+        )
+        if self._schedule is not None:
+            if on:
+                self._worker.call(self._controller.start_schedule, filename=self._schedule)
+            else:
+                self._worker.call(self._controller.stop_schedule)
 
     def _button_pressed_circ(self, on: bool):
-        print(f"Fan circulation {on}")
-        if on:
-            self._pico.set_fan_circ_intensity(45.0)
-            print('Circulation Fan on')
-        else:
-            self._pico.set_fan_circ_intensity(0.0)    
-            print('Circulation Fan off')
-
+        self._worker.call(self._controller.set_circ, on=on)
 
 
 def main():
-    pico = Pico()
-
-    window = Window()
-
-    controller = Controller(pico=pico, window=window)
-
-    window.mainloop()
+    parser = argparse.ArgumentParser(description="Humidity Controller 2022")
+    parser.add_argument("--simulate", action="store_true", help="no hardware: simulated chamber in real time")
+    parser.add_argument("--autonomous", action="store_true", help="the PID runs on the pico, the gui supervises")
+    parser.add_argument("--comport", action="append", default=None, help="connect the pico on this port, may be repeated")
+    parser.add_argument("--all", action="store_true", help="connect all picos found: one chamber per pico")
+    parser.add_argument("--mpy", action="store_true", help="deploy precompiled .mpy files (requires mpy-cross)")
+    parser.add_argument("--chambers", type=int, default=1, help="with --simulate: number of simulated chambers")
+    parser.add_argument("--schedule", type=pathlib.Path, default=None, help="setpoint profile, starts with 'controller on'")
+    parser.add_argument("--filter", default=None, help="for example 'median:3,alpha_beta:0.5:0.05', see 'sensor_filter'")
+    parser.add_argument("--filter-on-pico", action="store_true", help="the filter runs on the pico")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # name -> pico
+    picos = {}
+    if args.simulate:
+        import pico_simulator
+
+        for i in range(args.chambers):
+            model = pico_simulator.ChamberModel(seed=i)
+            picos[f"simulated{i}"] = pico_simulator.PicoSimulator(model=model)
+    elif args.all or (args.comport is not None):
+        comports = args.comport if args.comport is not None else list_picos()
+        for comport in comports:
+            picos[chamber_name(comport)] = Pico(comport=comport, mpy=args.mpy)
+    else:
+        picos["pico"] = Pico(mpy=args.mpy)
+
+    if len(picos) == 0:
+        raise Exception("No pico found")
+
+    if len(picos) == 1:
+        pico = list(picos.values())[0]
+        controller = Controller(pico=pico, autonomous=args.autonomous)
+        worker = HardwareWorker(controller=controller)
+        window = Window()
+        gui = Gui(window=window, worker=worker, schedule=args.schedule)
+        workers = [worker]
+        root = window
+    else:
+        root = Overview()
+        workers = []
+        for name, pico in picos.items():
+            controller = Controller(pico=pico, filename_log=filename_log_chamber(name), autonomous=args.autonomous)
+            worker = HardwareWorker(controller=controller, name=name)
+            window = Window(parent=root.root, title=name)
+            gui = Gui(window=window, worker=worker, overview=root, name=name, schedule=args.schedule)
+            workers.append(worker)
+
+    for worker in workers:
+        if args.filter is not None:
+            worker.controller.set_filter(args.filter, on_pico=args.filter_on_pico)
+        worker.start()
+    root.mainloop()
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.controller.close()
 
 
 if __name__ == "__main__":
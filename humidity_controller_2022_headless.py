@@ -0,0 +1,248 @@
+"""
+The humidity controller without gui, controlled over a local socket.
+
+  python humidity_controller_2022_headless.py --port 8765
+
+The protocol is newline delimited json, one object per line.
+Commands and replies:
+
+  {"cmd": "controller", "on": true, "setpoint": 60.0, "Kp": 3.0, "Ki": 0.2, "Kd": 0.0}
+  {"cmd": "circulation", "on": true}
+  {"cmd": "autonomous", "on": true}
+  {"cmd": "schedule", "filename": "profiles/stress.json"}  (null: stop the schedule)
+  {"cmd": "status"}
+  -> {"ok": true, ...} or {"ok": false, "error": "..."}
+
+  {"cmd": "subscribe"}
+  -> {"ok": true}, then one line per tick: {"type": "telemetry", "time_s": 17, "fan": 10.0, ...}
+
+Omitted setpoint and gains of "controller" are left unchanged.
+Only connections from localhost are accepted.
+"""
+import argparse
+import json
+import logging
+import pathlib
+import queue
+import socketserver
+import threading
+
+from humidity_controller_2022 import Pico, Controller, HardwareWorker
+
+logger = logging.getLogger("humidity_controller_2022")
+
+PORT = 8765
+# Ticks buffered per subscriber. A slow client loses the oldest ticks, the control loop never waits.
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Subscribers:
+    """
+    Distributes the 'TickResult's of the worker to the subscribed clients.
+    Every client has its own bounded queue: 'publish()' never blocks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = []
+        self.dropped = 0
+
+    def add(self) -> queue.Queue:
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._queues.append(q)
+        return q
+
+    def remove(self, q: queue.Queue) -> None:
+        with self._lock:
+            self._queues.remove(q)
+
+    def publish(self, line: bytes) -> None:
+        with self._lock:
+            queues = list(self._queues)
+        for q in queues:
+            while True:
+                try:
+                    q.put_nowait(line)
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+
+class Daemon:
+    """
+    Runs the 'HardwareWorker' and serves the socket API.
+    """
+
+    def __init__(self, worker: HardwareWorker, port: int = PORT):
+        self.worker = worker
+        self.controller = worker.controller
+        self.subscribers = Subscribers()
+        self._stop = threading.Event()
+        self._thread_publish = threading.Thread(target=self._publish, name="publish", daemon=True)
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon._handle(self)
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+
+    def serve_forever(self) -> None:
+        self.worker.start()
+        self._thread_publish.start()
+        logger.info(f"Listening on {self.server.server_address}")
+        try:
+            self.server.serve_forever()
+        finally:
+            self._stop.set()
+            self.worker.stop()
+            self.controller.close()
+            self.server.server_close()
+
+    def shutdown(self) -> None:
+        "May be called from any thread but the one in 'serve_forever()'"
+        self.server.shutdown()
+
+    def _publish(self) -> None:
+        # Serialize once per tick, not once per client
+        while not self._stop.is_set():
+            try:
+                result = self.worker.results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if result.values is None:
+                message = {"type": "error", "text": result.text.strip()}
+            else:
+                message = {"type": "telemetry", **result.values}
+            self.subscribers.publish((json.dumps(message) + "\n").encode("utf-8"))
+
+    def _handle(self, handler: socketserver.StreamRequestHandler) -> None:
+        for line in handler.rfile:
+            if len(line.strip()) == 0:
+                continue
+            try:
+                command = json.loads(line)
+                cmd = command.pop("cmd")
+                if cmd == "subscribe":
+                    self._write(handler, {"ok": True})
+                    self._subscribe(handler)
+                    return
+                reply = self._command(cmd, command)
+            except Exception as e:
+                reply = {"ok": False, "error": repr(e)}
+            self._write(handler, reply)
+
+    def _write(self, handler: socketserver.StreamRequestHandler, message: dict) -> None:
+        handler.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+        handler.wfile.flush()
+
+    def _subscribe(self, handler: socketserver.StreamRequestHandler) -> None:
+        q = self.subscribers.add()
+        try:
+            while not self._stop.is_set():
+                try:
+                    line = q.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                handler.wfile.write(line)
+                handler.wfile.flush()
+        except OSError:
+            # The client disconnected
+            pass
+        finally:
+            self.subscribers.remove(q)
+
+    def _command(self, cmd: str, args: dict) -> dict:
+        """
+        The commands are executed in the thread of the worker, between two ticks.
+        """
+        controller = self.controller
+        if cmd == "controller":
+            self.worker.call(self._set_controller, on=bool(args["on"]), **self._gains(args))
+            return {"ok": True}
+        if cmd == "circulation":
+            self.worker.call(controller.set_circ, on=bool(args["on"]))
+            return {"ok": True}
+        if cmd == "autonomous":
+            self.worker.call(controller.set_autonomous, on=bool(args["on"]))
+            return {"ok": True}
+        if cmd == "schedule":
+            if args.get("filename") is None:
+                self.worker.call(controller.stop_schedule)
+            else:
+                filename = pathlib.Path(args["filename"])
+                if not filename.exists():
+                    raise FileNotFoundError(str(filename))
+                self.worker.call(controller.start_schedule, filename=filename)
+            return {"ok": True}
+        if cmd == "status":
+            pid = controller.pid
+            return {
+                "ok": True,
+                "controller_on": controller.controller_on,
+                "autonomous": controller.autonomous,
+                "setpoint": pid.setpoint,
+                "Kp": pid.Kp,
+                "Ki": pid.Ki,
+                "Kd": pid.Kd,
+                "schedule": controller.schedule is not None,
+                "fan": controller.fan_intensity,
+                "filename_log": str(controller.filename_log),
+                "subscribers_dropped": self.subscribers.dropped,
+                "timing": controller.timing.summary(),
+            }
+        raise ValueError(f"Unknown command {cmd!r}")
+
+    @staticmethod
+    def _gains(args: dict) -> dict:
+        gains = {}
+        for name in ("setpoint", "Kp", "Ki", "Kd"):
+            if args.get(name) is not None:
+                gains[name] = float(args[name])
+        return gains
+
+    def _set_controller(self, on: bool, **gains) -> None:
+        pid = self.controller.pid
+        self.controller.set_controller(
+            on=on,
+            setpoint=gains.get("setpoint", pid.setpoint),
+            Kp=gains.get("Kp", pid.Kp),
+            Ki=gains.get("Ki", pid.Ki),
+            Kd=gains.get("Kd", pid.Kd),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Humidity Controller 2022 without gui")
+    parser.add_argument("--port", type=int, default=PORT, help="tcp port on localhost")
+    parser.add_argument("--simulate", action="store_true", help="no hardware: simulated chamber in real time")
+    parser.add_argument("--autonomous", action="store_true", help="the PID runs on the pico")
+    parser.add_argument("--comport", default=None, help="connect the pico on this port")
+    parser.add_argument("--mpy", action="store_true", help="deploy precompiled .mpy files (requires mpy-cross)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.simulate:
+        import pico_simulator
+
+        pico = pico_simulator.PicoSimulator()
+    else:
+        pico = Pico(comport=args.comport, mpy=args.mpy)
+
+    controller = Controller(pico=pico, autonomous=args.autonomous)
+    daemon = Daemon(HardwareWorker(controller=controller), port=args.port)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
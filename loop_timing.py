@@ -0,0 +1,129 @@
+"""
+Low overhead timing of the control loop.
+
+Usage:
+  t = timing.start()
+  ... measurement ...
+  t = timing.stage("measurement", t)
+  ... pid ...
+  t = timing.stage("pid", t)
+
+Every stage is recorded in a 'Histogram' with logarithmic buckets:
+fixed memory and O(1) per value, the percentiles are read from the buckets.
+"""
+import logging
+import math
+import threading
+import time
+from typing import Dict
+
+logger = logging.getLogger("humidity_controller_2022")
+
+
+class Histogram:
+    def __init__(self, min_s: float = 1e-6, max_s: float = 100.0, buckets_per_decade: int = 20):
+        self.min_s = min_s
+        self.buckets_per_decade = buckets_per_decade
+        self._buckets = int(math.ceil(math.log10(max_s / min_s) * buckets_per_decade)) + 1
+        self._log_min = math.log10(min_s)
+        self.reset()
+
+    def reset(self) -> None:
+        self.counts = [0] * self._buckets
+        self.n = 0
+        self.max_s = 0.0
+
+    def record(self, value_s: float) -> None:
+        if value_s <= self.min_s:
+            index = 0
+        else:
+            index = min(int((math.log10(value_s) - self._log_min) * self.buckets_per_decade) + 1, self._buckets - 1)
+        self.counts[index] += 1
+        self.n += 1
+        if value_s > self.max_s:
+            self.max_s = value_s
+
+    def percentile(self, p: float) -> float:
+        """
+        p: 0.0..1.0. Returns the upper edge of the bucket (resolution about 12%).
+        """
+        if self.n == 0:
+            return 0.0
+        limit = p * self.n
+        cumulated = 0
+        for index, count in enumerate(self.counts):
+            cumulated += count
+            if cumulated >= limit:
+                return min(self.min_s * 10.0 ** (index / self.buckets_per_decade), self.max_s)
+        return self.max_s
+
+
+class LoopTiming:
+    """
+    Histograms for the stages of a tick, the tick period and the jitter
+    (deviation of the period from 'interval_s').
+    'enabled' may be toggled at runtime, from any thread.
+    """
+
+    def __init__(self, interval_s: float, enabled: bool = True, summary_interval_s: float = 60.0):
+        self.interval_s = interval_s
+        self.enabled = enabled
+        self.summary_interval_s = summary_interval_s
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Histogram] = {}
+        self._last_tick_s = None
+        self._last_summary_s = time.monotonic()
+
+    def start(self) -> float:
+        if not self.enabled:
+            return 0.0
+        return time.perf_counter()
+
+    def stage(self, name: str, start_s: float) -> float:
+        """
+        Record the time since 'start_s' for stage 'name'.
+        Returns the current time: the start of the next stage.
+        """
+        if not self.enabled:
+            return 0.0
+        now_s = time.perf_counter()
+        if start_s > 0.0:
+            self.record(name, now_s - start_s)
+        return now_s
+
+    def record(self, name: str, duration_s: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.record(duration_s)
+
+    def tick(self) -> None:
+        "Call at the start of every tick: records the period and the jitter."
+        if not self.enabled:
+            self._last_tick_s = None
+            return
+        now_s = time.perf_counter()
+        if self._last_tick_s is not None:
+            period_s = now_s - self._last_tick_s
+            self.record("period", period_s)
+            self.record("jitter", abs(period_s - self.interval_s))
+        self._last_tick_s = now_s
+        if time.monotonic() - self._last_summary_s >= self.summary_interval_s:
+            self._last_summary_s = time.monotonic()
+            logger.info(f"Loop timing: {self.summary()}")
+
+    def summary(self) -> str:
+        "'pico_step p50/p95/p99=31.6/35.5/39.8ms  pid ...'"
+        with self._lock:
+            histograms = list(self._histograms.items())
+        texts = []
+        for name, histogram in histograms:
+            p50, p95, p99 = [1000.0 * histogram.percentile(p) for p in (0.50, 0.95, 0.99)]
+            texts.append(f"{name} p50/p95/p99={p50:0.3g}/{p95:0.3g}/{p99:0.3g}ms")
+        return "  ".join(texts)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+        self._last_tick_s = None
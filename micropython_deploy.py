@@ -0,0 +1,115 @@
+"""
+Prepare 'src_micropython' for the pico.
+
+  python micropython_deploy.py --mpy
+
+The files are copied (or compiled to .mpy with 'mpy-cross') into
+'build/micropython/py' (or '.../mpy') together with 'manifest.txt': the
+sha256 of all files.
+'Pico' compares the manifest on the pico with the local one and skips
+'sync_folder()' if they match: one round trip instead of hashing every file
+on the pico. The directory is prepared once per process, see 'prepared()'.
+"""
+import argparse
+import hashlib
+import pathlib
+import shutil
+import subprocess
+import threading
+from typing import List, Tuple
+
+DIRECTORY_OF_THIS_FILE = pathlib.Path(__file__).absolute().parent
+DIRECTORY_SRC = DIRECTORY_OF_THIS_FILE / "src_micropython"
+DIRECTORY_DEPLOY = DIRECTORY_OF_THIS_FILE / "build" / "micropython"
+FILENAME_MANIFEST = "manifest.txt"
+# The RP2040 is a Cortex-M0+: required for @micropython.native and @micropython.viper in .mpy files.
+# mpy-cross must match the firmware (1.19, 1.20: mpy v6).
+MPY_CROSS_ARCH = "armv6m"
+
+# 'prepared()': mpy -> (directory, manifest)
+_prepared = {}
+_prepared_lock = threading.Lock()
+
+
+def source_files() -> List[pathlib.Path]:
+    return sorted([f for f in DIRECTORY_SRC.glob("*.py") if f.is_file()])
+
+
+def mpy_cross(src: pathlib.Path, dst: pathlib.Path) -> None:
+    try:
+        subprocess.run(["mpy-cross", f"-march={MPY_CROSS_ARCH}", "-o", str(dst), str(src)], check=True)
+    except FileNotFoundError:
+        raise Exception(
+            'The program "mpy-cross" is missing. Did you call "pip install mpy-cross"?'
+        )
+
+
+def manifest(directory: pathlib.Path) -> str:
+    "sha256 over the names and the contents of all files except the manifest"
+    sha256 = hashlib.sha256()
+    for f in sorted(directory.iterdir()):
+        if f.name == FILENAME_MANIFEST:
+            continue
+        sha256.update(f.name.encode("utf-8") + b"\0")
+        sha256.update(f.read_bytes())
+    return sha256.hexdigest()
+
+
+def directory_deploy(mpy: bool = False) -> pathlib.Path:
+    return DIRECTORY_DEPLOY / ("mpy" if mpy else "py")
+
+
+def prepare(mpy: bool = False, directory: pathlib.Path = None) -> pathlib.Path:
+    """
+    Fill 'directory' with the files for the pico and the manifest.
+    mpy: Compile to .mpy with 'mpy-cross'. 'benchmark_pico.py' measures .py against .mpy on a pico.
+    directory: If None, 'directory_deploy(mpy)'.
+    Returns 'directory'.
+    """
+    if directory is None:
+        directory = directory_deploy(mpy)
+    if directory.exists():
+        shutil.rmtree(directory)
+    directory.mkdir(parents=True)
+    for src in source_files():
+        if mpy:
+            mpy_cross(src, directory / f"{src.stem}.mpy")
+        else:
+            shutil.copyfile(src, directory / src.name)
+    (directory / FILENAME_MANIFEST).write_text(manifest(directory) + "\n")
+    return directory
+
+
+def read_manifest(directory: pathlib.Path) -> str:
+    return (directory / FILENAME_MANIFEST).read_text().strip()
+
+
+def prepared(mpy: bool = False) -> Tuple[pathlib.Path, str]:
+    """
+    'prepare()' on the first call only: returns the directory and its manifest.
+    The picos of several chambers sync from the same directory in their own
+    threads: it must not be rebuilt while one of them syncs.
+    """
+    with _prepared_lock:
+        if mpy not in _prepared:
+            directory = prepare(mpy=mpy)
+            _prepared[mpy] = (directory, read_manifest(directory))
+        return _prepared[mpy]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prepare src_micropython for the pico")
+    parser.add_argument("--mpy", action="store_true", help="compile to .mpy with mpy-cross")
+    args = parser.parse_args()
+
+    directory = prepare(mpy=args.mpy)
+    total = 0
+    for f in sorted(directory.iterdir()):
+        size = f.stat().st_size
+        total += size
+        print(f"{size:8d} {f.name}")
+    print(f"{total:8d} bytes in {directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Hardware-free replacement for 'Pico': a physical model of the humidity chamber.
+
+Run the full 'Controller' loop faster than real time:
+  python pico_simulator.py --duration 7200 --setpoint 60
+
+Or the gui against the simulator (real time):
+  python humidity_controller_2022_gui.py --simulate
+"""
+import argparse
+import collections
+import math
+import pathlib
+import random
+import time
+
+from humidity_controller_2022 import DIRECTORY_OF_THIS_FILE, START_TIME, HOST_TIMEOUT_MS, PicoBase, Controller, sensor_filter, _import_src_micropython
+
+# The autonomous mode runs the PID of the pico, not 'simple_pid'
+pid_micropython = _import_src_micropython("pid")
+
+
+class SimulatedClock:
+    """
+    A clock for 'Controller' and 'PicoSimulator' which only moves with 'advance()'.
+    """
+
+    def __init__(self, start_s: float = 0.0):
+        self.time_s = start_s
+
+    def __call__(self) -> float:
+        return self.time_s
+
+    def advance(self, dt_s: float) -> None:
+        assert dt_s >= 0.0
+        self.time_s += dt_s
+
+
+class ChamberModel:
+    """
+    The humidifier fans blow humid air into the chamber: the humidity at the
+    humidifier sensor follows the fan duty with a dead time and a first order lag.
+    The stage sensor follows the humidifier sensor, faster with circulation.
+    """
+
+    def __init__(
+        self,
+        ambient_pRH: float = 45.0,
+        humidifier_pRH: float = 95.0,
+        tau_s: float = 200.0,
+        dead_time_s: float = 20.0,
+        tau_stage_s: float = 120.0,
+        ambient_C: float = 22.0,
+        fan_heating_C: float = 1.5,
+        tau_temp_s: float = 600.0,
+        noise_pRH: float = 0.1,
+        noise_C: float = 0.02,
+        dt_internal_s: float = 0.1,
+        seed: int = None,
+    ):
+        self.ambient_pRH = ambient_pRH
+        self.humidifier_pRH = humidifier_pRH
+        self.tau_s = tau_s
+        self.dead_time_s = dead_time_s
+        self.tau_stage_s = tau_stage_s
+        self.ambient_C = ambient_C
+        self.fan_heating_C = fan_heating_C
+        self.tau_temp_s = tau_temp_s
+        self.noise_pRH = noise_pRH
+        self.noise_C = noise_C
+        self.dt_internal_s = dt_internal_s
+        self._random = random.Random(seed)
+
+        self.fan_hum_intensity = 0.0
+        self.fan_circ_intensity = 0.0
+        self.humi_pRH = ambient_pRH
+        self.stage_pRH = ambient_pRH
+        self.humi_C = ambient_C
+        self.stage_C = ambient_C
+        # Fan duty on its way to the sensor
+        self._pipe = collections.deque([0.0] * max(1, int(round(dead_time_s / dt_internal_s))))
+        self._remainder_s = 0.0
+
+    def advance(self, dt_s: float) -> None:
+        dt_s += self._remainder_s
+        steps = int(dt_s / self.dt_internal_s)
+        self._remainder_s = dt_s - steps * self.dt_internal_s
+        h = self.dt_internal_s
+        k_humi = 1.0 - math.exp(-h / self.tau_s)
+        # Circulation makes the stage follow up to 3 times faster
+        tau_stage_s = self.tau_stage_s / (1.0 + 2.0 * self.fan_circ_intensity / 100.0)
+        k_stage = 1.0 - math.exp(-h / tau_stage_s)
+        k_temp = 1.0 - math.exp(-h / self.tau_temp_s)
+        for _ in range(steps):
+            self._pipe.append(self.fan_hum_intensity)
+            u = self._pipe.popleft() / 100.0
+            target_pRH = self.ambient_pRH + (self.humidifier_pRH - self.ambient_pRH) * u
+            self.humi_pRH += (target_pRH - self.humi_pRH) * k_humi
+            self.stage_pRH += (self.humi_pRH - self.stage_pRH) * k_stage
+            target_C = self.ambient_C + self.fan_heating_C * u
+            self.humi_C += (target_C - self.humi_C) * k_temp
+            self.stage_C += (self.humi_C - self.stage_C) * k_temp
+
+    def measure(self, average_n: int = 1) -> dict:
+        "Averaging reduces the noise as on the pico"
+        noise = 1.0 / math.sqrt(max(1, average_n))
+        gauss = self._random.gauss
+        return {
+            'humi_temp_C': self.humi_C + gauss(0.0, self.noise_C * noise),
+            'humi_humi_pRH': self.humi_pRH + gauss(0.0, self.noise_pRH * noise),
+            'stage_temp_C': self.stage_C + gauss(0.0, self.noise_C * noise),
+            'stage_humi_pRH': self.stage_pRH + gauss(0.0, self.noise_pRH * noise),
+        }
+
+
+class PicoSimulator(PicoBase):
+    """
+    Behaves like 'Pico': before every call, the model is advanced to the time of 'clock'.
+    With the default clock, the simulation runs in real time.
+    """
+
+    def __init__(self, model: ChamberModel = None, clock=time.monotonic):
+        self.model = model or ChamberModel()
+        self.clock = clock
+        self._last_s = clock()
+        self.leds_color = (0, 0, 0)
+        self.calls = 0
+        # 'set_filter()': one pipeline per value as on the pico
+        self._filters = None
+        # Autonomous mode, see 'micropython_logic.Autonomous'
+        self._pid = None
+        self._interval_s = None
+        self._next_tick_s = None
+        self._host_s = None
+        self._ticks = 0
+        self._fallback = None
+        # The last measurement of the autonomous tick, returned by 'get_measurement()' and 'supervise()'
+        self._measurement = None
+
+    def _advance(self) -> None:
+        now_s = self.clock()
+        if self._pid is not None:
+            # The timer of the pico ticks independently of the calls of the host
+            while self._next_tick_s <= now_s:
+                self.model.advance(self._next_tick_s - self._last_s)
+                self._last_s = self._next_tick_s
+                self._tick_autonomous()
+                self._next_tick_s += self._interval_s
+        self.model.advance(now_s - self._last_s)
+        self._last_s = now_s
+        self.calls += 1
+
+    def _tick_autonomous(self) -> None:
+        self._ticks += 1
+        # As 'sht31.Sensors_sht31.collect()': the filters of the pico run once per tick
+        self._measurement = self._measure()
+        if self._last_s - self._host_s > HOST_TIMEOUT_MS / 1000.0:
+            self._fallback = 'host'
+            self.model.fan_hum_intensity = 0.0
+            return
+        if self._fallback is not None:
+            self._pid.reset()
+        self._fallback = None
+        self.model.fan_hum_intensity = self._pid(
+            self._measurement['humi_humi_pRH'], self._interval_s, self._measurement.get('humi_humi_pRH_per_s')
+        )
+
+    def get_status(self) -> dict:
+        return {'simulated': True, 'calls': self.calls}
+
+    def get_measurement(self, average_n = 1) -> dict:
+        self._advance()
+        if self._pid is not None:
+            # Autonomous: the values of the last tick, as 'micropython_logic.get_measurement()'
+            return dict(self._measurement)
+        return self._measure(average_n=average_n)
+
+    def _measure(self, average_n = 1) -> dict:
+        "The model measured, through the filters of 'set_filter()'"
+        measurement = self.model.measure(average_n=average_n)
+        if self._filters is not None:
+            dt_s = max(self._last_s - self._filter_last_s, 1e-3)
+            self._filter_last_s = self._last_s
+            for name, pipeline in self._filters.items():
+                measurement[name] = pipeline.update(measurement[name], dt_s)
+            rate = self._filters['humi_humi_pRH'].rate
+            if rate is not None:
+                measurement['humi_humi_pRH_per_s'] = rate
+        return measurement
+
+    def reconnect(self) -> None:
+        "Nothing to do: the simulator is never disconnected"
+
+    def set_filter(self, spec: str = None) -> None:
+        if spec is None:
+            self._filters = None
+            return
+        names = ('humi_temp_C', 'humi_humi_pRH', 'stage_temp_C', 'stage_humi_pRH')
+        self._filters = {name: sensor_filter.Pipeline(spec) for name in names}
+        self._filter_last_s = self.clock()
+
+    def set_fan_circ_intensity(self, intensity_K: float) -> None:
+        assert isinstance(intensity_K, float)
+        self._advance()
+        self.model.fan_circ_intensity = intensity_K
+
+    def set_fan_hum_intensity(self, intensity_K: float) -> None:
+        assert isinstance(intensity_K, float)
+        self._advance()
+        self.model.fan_hum_intensity = intensity_K
+
+    def leds(self, color=(0,0,0)) -> None:
+        self.leds_color = color
+
+    def step(self, fan_hum_intensity: float, color=(0,0,0), average_n = 1) -> dict:
+        self.set_fan_hum_intensity(fan_hum_intensity)
+        self.leds(color=color)
+        return self.get_measurement(average_n=average_n)
+
+    def start_autonomous(self, setpoint: float, Kp: float, Ki: float, Kd: float, interval_ms = 1000) -> None:
+        self._advance()
+        self._pid = pid_micropython.PID(Kp, Ki, Kd, setpoint, output_limits=(10.0, 100.0))
+        self._interval_s = interval_ms / 1000.0
+        self._next_tick_s = self._last_s + self._interval_s
+        self._host_s = self._last_s
+        self._ticks = 0
+        self._fallback = None
+        self._measurement = self.model.measure()
+
+    def supervise(self, setpoint: float = None, Kp: float = None, Ki: float = None, Kd: float = None) -> dict:
+        self._advance()
+        pid = self._pid
+        if pid is None:
+            raise RuntimeError("supervise(): the autonomous mode is not running, call start_autonomous() first")
+        self._host_s = self._last_s
+        if setpoint is not None:
+            pid.setpoint = setpoint
+        if Kp is not None:
+            pid.Kp = Kp
+        if Ki is not None:
+            pid.Ki = Ki
+        if Kd is not None:
+            pid.Kd = Kd
+        telemetry = dict(self._measurement)
+        telemetry.update(fan=self.model.fan_hum_intensity, ticks=self._ticks, overruns=0, errors=0, fallback=self._fallback)
+        return telemetry
+
+    def stop_autonomous(self) -> None:
+        self._advance()
+        self._pid = None
+        self.model.fan_hum_intensity = 0.0
+
+
+def run(controller: Controller, clock: SimulatedClock, duration_s: float, interval_s: float = 1.0):
+    """
+    Run the controller loop with simulated time, as fast as possible.
+    Yields the 'TickResult' of every tick.
+    """
+    for _ in range(int(duration_s / interval_s)):
+        yield controller.tick()
+        clock.advance(interval_s)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the controller against the simulated chamber")
+    parser.add_argument("--duration", type=float, default=7200.0, help="simulated seconds")
+    parser.add_argument("--setpoint", type=float, default=60.0, help="%%RH")
+    parser.add_argument("--kp", type=float, default=None)
+    parser.add_argument("--ki", type=float, default=None)
+    parser.add_argument("--kd", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--autonomous", action="store_true", help="the PID runs on the (simulated) pico")
+    parser.add_argument("--schedule", type=pathlib.Path, default=None, help="setpoint profile, see 'setpoint_schedule'")
+    parser.add_argument("--filter", default=None, help="for example 'median:3,alpha_beta:0.5:0.05', see 'sensor_filter'")
+    parser.add_argument("--filter-on-pico", action="store_true", help="the filter runs on the pico")
+    args = parser.parse_args()
+
+    clock = SimulatedClock()
+    pico = PicoSimulator(model=ChamberModel(seed=args.seed), clock=clock)
+    filename_log = DIRECTORY_OF_THIS_FILE / "log" / f"simulation_{START_TIME}.txt"
+    controller = Controller(pico=pico, filename_log=filename_log, clock=clock, autonomous=args.autonomous)
+    if args.filter is not None:
+        controller.set_filter(args.filter, on_pico=args.filter_on_pico)
+    pid = controller.pid
+    controller.set_controller(
+        on=True,
+        setpoint=args.setpoint,
+        Kp=pid.Kp if args.kp is None else args.kp,
+        Ki=pid.Ki if args.ki is None else args.ki,
+        Kd=pid.Kd if args.kd is None else args.kd,
+    )
+    if args.schedule is not None:
+        controller.start_schedule(args.schedule)
+
+    start = time.perf_counter()
+    iae = 0.0
+    for result in run(controller, clock, duration_s=args.duration):
+        iae += abs(result.values["set_humi_pRH"] - result.values["humi_humi_pRH"])
+    elapsed_s = time.perf_counter() - start
+    controller.close()
+    print(f"Simulated {args.duration:0.0f}s in {elapsed_s:0.2f}s ({args.duration / elapsed_s:0.0f}x real time)")
+    print(f"IAE={iae:0.1f} %RH*s, log: {filename_log}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+PID tuning from recorded logs.
+
+1. Fit a first-order-plus-dead-time (FOPDT) model of the humidity
+   'humi_humi_pRH' responding to the fan duty 'fan' from logs written by 'datafile_csv.Csv'.
+2. Simulate the closed loop for a grid of Kp/Ki/Kd in a process pool.
+3. Rank the candidates by IAE, overshoot and settling time.
+
+Usage:
+  python pid_tuning.py log/controller_2022-10-01_12-00-00.txt [more logs...]
+
+The recommended tuning is written to 'pid_tuning.json' which is loaded by the GUI.
+"""
+import argparse
+import concurrent.futures
+import csv
+import json
+import math
+import os
+import pathlib
+from typing import Dict, List
+
+import datafile_csv
+import simple_pid
+
+DIRECTORY_OF_THIS_FILE = pathlib.Path(__file__).absolute().parent
+FILENAME_TUNING = DIRECTORY_OF_THIS_FILE / "pid_tuning.json"
+
+# Same as in 'Controller'
+OUTPUT_LIMITS = (10.0, 100.0)
+SAMPLE_TIME_S = 0.6
+
+# Cost = IAE + OVERSHOOT_PENALTY * overshoot + SETTLING_PENALTY * settling time
+OVERSHOOT_PENALTY = 100.0
+SETTLING_PENALTY = 1.0
+
+
+def load_log(filename: pathlib.Path) -> Dict[str, list]:
+    """
+    Read a tab separated log written by 'datafile_csv.Csv' or a binary log ('.bin').
+    Returns the columns as lists of floats. Incomplete rows are skipped.
+    """
+    assert isinstance(filename, pathlib.Path)
+    if filename.suffix == ".bin":
+        data = datafile_csv.read_binary(filename)
+        return {name: data[name].tolist() for name in data.dtype.names}
+    columns: Dict[str, list] = {}
+    with filename.open("r", newline="") as f:
+        reader = csv.reader(f, delimiter="\t")
+        names = next(reader)
+        for name in names:
+            columns[name] = []
+        for row in reader:
+            if len(row) != len(names):
+                continue
+            try:
+                values = [float(value) for value in row]
+            except ValueError:
+                continue
+            for name, value in zip(names, values):
+                columns[name].append(value)
+    return columns
+
+
+class FopdtModel:
+    """
+    Discrete first-order-plus-dead-time model:
+      y[k+1] = a * y[k] + (1-a) * (offset_pRH + gain_pRH * u[k-delay])
+    with a = exp(-dt_s/tau_s) and delay = dead_time_s/dt_s.
+    """
+
+    def __init__(self, gain_pRH: float, tau_s: float, dead_time_s: float, offset_pRH: float, dt_s: float, rms_pRH: float = 0.0):
+        self.gain_pRH = gain_pRH
+        self.tau_s = tau_s
+        self.dead_time_s = dead_time_s
+        self.offset_pRH = offset_pRH
+        self.dt_s = dt_s
+        self.rms_pRH = rms_pRH
+
+    def __repr__(self):
+        return (
+            f"FopdtModel(gain_pRH={self.gain_pRH:0.4f} %RH per %fan, tau_s={self.tau_s:0.1f}, "
+            f"dead_time_s={self.dead_time_s:0.1f}, offset_pRH={self.offset_pRH:0.1f}, "
+            f"dt_s={self.dt_s:0.2f}, rms_pRH={self.rms_pRH:0.3f})"
+        )
+
+
+def fit_fopdt(logs: List[Dict[str, list]], max_dead_time_s: float = 120.0) -> FopdtModel:
+    """
+    Fit a FOPDT model by least squares on 'y[k+1] = a*y[k] + b*u[k-delay] + c'
+    for every delay up to 'max_dead_time_s'. The delay with the smallest residual wins.
+    """
+    np = simple_pid._import_numpy()
+
+    # Resample every log on a uniform time grid
+    segments = []
+    dts = []
+    for log in logs:
+        time_s = np.asarray(log["time_s"])
+        if len(time_s) < 10:
+            continue
+        dts.append(np.median(np.diff(time_s)))
+    if len(dts) == 0:
+        raise ValueError("Not enough data in the logs")
+    dt_s = max(float(np.median(dts)), 1e-3)
+    for log in logs:
+        time_s = np.asarray(log["time_s"])
+        if len(time_s) < 10:
+            continue
+        grid = np.arange(time_s[0], time_s[-1], dt_s)
+        u = np.interp(grid, time_s, np.asarray(log["fan"]))
+        y = np.interp(grid, time_s, np.asarray(log["humi_humi_pRH"]))
+        segments.append((u, y))
+
+    best = None
+    for delay in range(0, int(max_dead_time_s / dt_s) + 1):
+        rows = []
+        targets = []
+        for u, y in segments:
+            if len(y) <= delay + 2:
+                continue
+            rows.append(np.column_stack([y[delay:-1], u[: len(u) - 1 - delay], np.ones(len(y) - 1 - delay)]))
+            targets.append(y[delay + 1 :])
+        if len(rows) == 0:
+            break
+        A = np.concatenate(rows)
+        b = np.concatenate(targets)
+        coefficients, _residuals, _rank, _sv = np.linalg.lstsq(A, b, rcond=None)
+        a, b_u, c = coefficients
+        if not (0.0 < a < 1.0):
+            continue
+        rms = float(np.sqrt(np.mean((A @ coefficients - b) ** 2)))
+        if (best is None) or (rms < best[0]):
+            best = (rms, delay, a, b_u, c)
+
+    if best is None:
+        raise ValueError("No stable model found: does the log contain fan steps?")
+    rms, delay, a, b_u, c = best
+    return FopdtModel(
+        gain_pRH=float(b_u / (1.0 - a)),
+        tau_s=float(-dt_s / math.log(a)),
+        dead_time_s=delay * dt_s,
+        offset_pRH=float(c / (1.0 - a)),
+        dt_s=dt_s,
+        rms_pRH=rms,
+    )
+
+
+def simulate_closed_loop(model: FopdtModel, Kp: float, Ki: float, Kd: float, setpoint_pRH: float, start_pRH: float, duration_s: float = 3600.0, band_pRH: float = 1.0) -> dict:
+    """
+    Simulate a setpoint step from 'start_pRH' to 'setpoint_pRH'.
+    Returns the metrics 'iae', 'overshoot_pRH', 'settling_s' and 'cost'.
+    """
+    pid = simple_pid.PID(
+        Kp=Kp,
+        Ki=Ki,
+        Kd=Kd,
+        setpoint=setpoint_pRH,
+        sample_time=SAMPLE_TIME_S,
+        output_limits=OUTPUT_LIMITS,
+    )
+    dt_s = model.dt_s
+    a = math.exp(-dt_s / model.tau_s)
+    delay = int(round(model.dead_time_s / dt_s))
+    direction = 1.0 if setpoint_pRH >= start_pRH else -1.0
+    # Fan duty which is in the pipe (dead time): u[k-delay] as in 'fit_fopdt()'.
+    # One more tick: 'Controller.tick()' applies the output with the next 'pico.step()'.
+    pipe = [0.0] * (delay + 1)
+
+    y = start_pRH
+    iae = 0.0
+    overshoot_pRH = 0.0
+    settling_s = 0.0
+    steps = int(duration_s / dt_s)
+    for k in range(steps):
+        fan = pid(y, dt=dt_s)
+        pipe.append(fan)
+        u = pipe.pop(0)
+        y = a * y + (1.0 - a) * (model.offset_pRH + model.gain_pRH * u)
+        error = setpoint_pRH - y
+        iae += abs(error) * dt_s
+        overshoot_pRH = max(overshoot_pRH, -direction * error)
+        if abs(error) > band_pRH:
+            settling_s = (k + 1) * dt_s
+    cost = iae + OVERSHOOT_PENALTY * overshoot_pRH + SETTLING_PENALTY * settling_s
+    return {
+        "Kp": Kp,
+        "Ki": Ki,
+        "Kd": Kd,
+        "iae": iae,
+        "overshoot_pRH": overshoot_pRH,
+        "settling_s": settling_s,
+        "cost": cost,
+    }
+
+
+def _simulate_chunk(args) -> List[dict]:
+    model, candidates, setpoint_pRH, start_pRH, duration_s = args
+    return [
+        simulate_closed_loop(model, Kp, Ki, Kd, setpoint_pRH=setpoint_pRH, start_pRH=start_pRH, duration_s=duration_s)
+        for Kp, Ki, Kd in candidates
+    ]
+
+
+def candidates_grid(n_kp: int = 20, n_ki: int = 20, n_kd: int = 5) -> List[tuple]:
+    np = simple_pid._import_numpy()
+    list_kp = np.logspace(-1.0, 1.5, n_kp)
+    list_ki = np.logspace(-3.0, 0.0, n_ki)
+    list_kd = np.concatenate([[0.0], np.logspace(-1.0, 1.0, n_kd - 1)]) if n_kd > 1 else [0.0]
+    return [(float(Kp), float(Ki), float(Kd)) for Kp in list_kp for Ki in list_ki for Kd in list_kd]
+
+
+def search(model: FopdtModel, candidates: List[tuple], setpoint_pRH: float = 60.0, start_pRH: float = 50.0, duration_s: float = 3600.0, processes: int = None) -> List[dict]:
+    """
+    Simulate all candidates (Kp, Ki, Kd) in a process pool.
+    Returns the results sorted by cost, the best first.
+    """
+    processes = processes or os.cpu_count() or 1
+    chunk_size = max(1, len(candidates) // (4 * processes))
+    chunks = [
+        (model, candidates[i : i + chunk_size], setpoint_pRH, start_pRH, duration_s)
+        for i in range(0, len(candidates), chunk_size)
+    ]
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        for chunk_results in executor.map(_simulate_chunk, chunks):
+            results.extend(chunk_results)
+    results.sort(key=lambda result: result["cost"])
+    return results
+
+
+def format_table(results: List[dict], n: int = 20) -> str:
+    lines = [f"{'rank':>4} {'Kp':>8} {'Ki':>8} {'Kd':>8} {'IAE':>10} {'overshoot':>9} {'settling_s':>10} {'cost':>10}"]
+    for rank, result in enumerate(results[:n], start=1):
+        lines.append(
+            f"{rank:4d} {result['Kp']:8.3f} {result['Ki']:8.4f} {result['Kd']:8.3f} "
+            f"{result['iae']:10.1f} {result['overshoot_pRH']:9.2f} {result['settling_s']:10.0f} {result['cost']:10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def save_tuning(result: dict, filename: pathlib.Path = FILENAME_TUNING) -> None:
+    tuning = {name: result[name] for name in ("Kp", "Ki", "Kd")}
+    filename.write_text(json.dumps(tuning, indent=2))
+
+
+def load_tuning(filename: pathlib.Path = FILENAME_TUNING) -> dict:
+    """
+    Returns {'Kp': x, 'Ki': y, 'Kd': z} or None if no tuning was saved.
+    """
+    if not filename.exists():
+        return None
+    tuning = json.loads(filename.read_text())
+    return {name: float(tuning[name]) for name in ("Kp", "Ki", "Kd")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit a FOPDT model from logs and search PID gains")
+    parser.add_argument("logs", nargs="+", type=pathlib.Path)
+    parser.add_argument("--setpoint", type=float, default=60.0, help="%%RH")
+    parser.add_argument("--start", type=float, default=50.0, help="%%RH at the beginning of the simulated step")
+    parser.add_argument("--duration", type=float, default=3600.0, help="simulated seconds")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--no-save", action="store_true", help=f"do not write {FILENAME_TUNING.name}")
+    args = parser.parse_args()
+
+    logs = [load_log(filename) for filename in args.logs]
+    model = fit_fopdt(logs)
+    print(model)
+
+    candidates = candidates_grid()
+    print(f"Simulating {len(candidates)} candidates...")
+    results = search(model, candidates, setpoint_pRH=args.setpoint, start_pRH=args.start, duration_s=args.duration, processes=args.processes)
+    print(format_table(results, n=args.top))
+
+    best = results[0]
+    print(f"Recommended: Kp={best['Kp']:0.3f} Ki={best['Ki']:0.4f} Kd={best['Kd']:0.3f}")
+    if not args.no_save:
+        save_tuning(best)
+        print(f"Written to {FILENAME_TUNING}")
+
+
+if __name__ == "__main__":
+    main()
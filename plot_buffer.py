@@ -0,0 +1,103 @@
+"""
+Ring buffers for live plots.
+
+Every level holds 'capacity' points. Level 0 stores the samples, level n
+the min and max over factor**n samples. A time window is always read from
+the coarsest level which still provides 'max_points', so drawing 24 hours
+costs the same as drawing one minute.
+"""
+from typing import List, Tuple
+
+try:
+    import numpy as np
+except ModuleNotFoundError as ex:
+    raise Exception(
+        'The module "numpy" is missing. Did you call "pip -r requirements.txt"?'
+    )
+
+
+class MinMaxRing:
+    def __init__(self, names: List[str], capacity: int = 4096, factor: int = 4, levels: int = 6):
+        assert capacity > 0
+        assert factor >= 2
+        self.names = names
+        self.capacity = capacity
+        self.factor = factor
+        self.levels = levels
+        channels = len(names)
+        self._time = np.zeros((levels, capacity))
+        self._min = np.zeros((levels, capacity, channels))
+        self._max = np.zeros((levels, capacity, channels))
+        # Number of points ever written per level
+        self._count = [0] * levels
+        # Points accumulated for the next point of each level
+        self._acc_n = [0] * levels
+        self._acc_time = [0.0] * levels
+        self._acc_min = np.zeros((levels, channels))
+        self._acc_max = np.zeros((levels, channels))
+
+    def __len__(self) -> int:
+        return self._count[0]
+
+    def append(self, time_s: float, values) -> None:
+        """
+        values: one value per name.
+        """
+        values = np.asarray(values, dtype=float)
+        self._write(0, time_s, values, values)
+
+    def _write(self, level: int, time_s: float, v_min, v_max) -> None:
+        while True:
+            i = self._count[level] % self.capacity
+            self._time[level, i] = time_s
+            self._min[level, i] = v_min
+            self._max[level, i] = v_max
+            self._count[level] += 1
+
+            level += 1
+            if level >= self.levels:
+                return
+            # Accumulate into the next coarser level
+            if self._acc_n[level] == 0:
+                self._acc_time[level] = time_s
+                self._acc_min[level] = v_min
+                self._acc_max[level] = v_max
+            else:
+                np.minimum(self._acc_min[level], v_min, out=self._acc_min[level])
+                np.maximum(self._acc_max[level], v_max, out=self._acc_max[level])
+            self._acc_n[level] += 1
+            if self._acc_n[level] < self.factor:
+                return
+            self._acc_n[level] = 0
+            time_s = self._acc_time[level]
+            v_min = self._acc_min[level].copy()
+            v_max = self._acc_max[level].copy()
+
+    def _ordered(self, level: int) -> Tuple[int, int]:
+        "Returns (index of the oldest point, number of points) of a level."
+        count = self._count[level]
+        n = min(count, self.capacity)
+        return (count - n) % self.capacity, n
+
+    def window(self, time_from_s: float, time_to_s: float, max_points: int):
+        """
+        Returns (time, min, max) for the points between 'time_from_s' and 'time_to_s',
+        at most 'max_points' points if the levels allow. min and max have the shape (points, channels).
+        """
+        result = None
+        for level in range(self.levels):
+            start, n = self._ordered(level)
+            if n == 0:
+                break
+            index = (start + np.arange(n)) % self.capacity
+            times = self._time[level, index]
+            selected = index[(times >= time_from_s) & (times <= time_to_s)]
+            result = self._time[level, selected], self._min[level, selected], self._max[level, selected]
+            # The level has to hold the whole window: it did not overwrite older points yet or the oldest point is old enough
+            covers = (self._count[level] <= self.capacity) or (times[0] <= time_from_s)
+            if covers and len(selected) <= max_points:
+                break
+        if result is None:
+            channels = len(self.names)
+            return np.zeros(0), np.zeros((0, channels)), np.zeros((0, channels))
+        return result
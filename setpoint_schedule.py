@@ -0,0 +1,137 @@
+"""
+Setpoint profiles: ramps, holds and cycles over hours.
+
+A profile is a json file:
+
+  {
+    "segments": [
+      {"ramp": 80.0, "duration_s": 1800},
+      {"hold_s": 7200},
+      {"cycle": [
+          {"ramp": 40.0, "duration_s": 3600},
+          {"ramp": 80.0, "duration_s": 3600}
+        ], "repeat": 5},
+      {"step": 60.0}
+    ]
+  }
+
+'ramp': Linear from the current setpoint to 'ramp' within 'duration_s'.
+'hold_s': Keep the current setpoint.
+'step': Jump to 'step'.
+'cycle': The segments are repeated 'repeat' times.
+'start' (optional, at the top level): The setpoint at the beginning.
+If omitted, the profile starts at the setpoint of the running controller (bumpless).
+
+The profile is compiled into breakpoints once. A cursor follows the time,
+so every tick costs O(1).
+"""
+import bisect
+import json
+import pathlib
+from typing import List
+
+
+class Schedule:
+    def __init__(self, times_s: List[float], setpoints_pRH: List[float], segments: List[int]):
+        """
+        The setpoint is linear between the breakpoints 'times_s'.
+        'segments[i]' is the number of the segment which ends at breakpoint i.
+        """
+        assert len(times_s) == len(setpoints_pRH) == len(segments)
+        assert len(times_s) >= 1
+        self.times_s = times_s
+        self.setpoints_pRH = setpoints_pRH
+        self.segments = segments
+        self._cursor = 0
+
+    @classmethod
+    def from_profile(cls, profile: dict, start_pRH: float) -> "Schedule":
+        start_pRH = float(profile.get("start", start_pRH))
+        times_s = [0.0]
+        setpoints_pRH = [start_pRH]
+        segments = [0]
+
+        def add(segment: dict) -> None:
+            time_s = times_s[-1]
+            setpoint_pRH = setpoints_pRH[-1]
+            if "cycle" in segment:
+                for _ in range(int(segment.get("repeat", 1))):
+                    for child in segment["cycle"]:
+                        add(child)
+                return
+            if "ramp" in segment:
+                duration_s = float(segment["duration_s"])
+                if duration_s < 0.0:
+                    raise ValueError(f"Negative duration: {segment}")
+                time_s, setpoint_pRH = time_s + duration_s, float(segment["ramp"])
+            elif "hold_s" in segment:
+                duration_s = float(segment["hold_s"])
+                if duration_s < 0.0:
+                    raise ValueError(f"Negative duration: {segment}")
+                time_s += duration_s
+            elif "step" in segment:
+                setpoint_pRH = float(segment["step"])
+            else:
+                raise ValueError(f"Unknown segment: {segment}")
+            times_s.append(time_s)
+            setpoints_pRH.append(setpoint_pRH)
+            segments.append(segments[-1] + 1)
+
+        for segment in profile["segments"]:
+            add(segment)
+        return cls(times_s, setpoints_pRH, segments)
+
+    @classmethod
+    def load(cls, filename: pathlib.Path, start_pRH: float) -> "Schedule":
+        assert isinstance(filename, pathlib.Path)
+        return cls.from_profile(json.loads(filename.read_text()), start_pRH=start_pRH)
+
+    @property
+    def duration_s(self) -> float:
+        return self.times_s[-1]
+
+    def finished(self, elapsed_s: float) -> bool:
+        return elapsed_s >= self.duration_s
+
+    def _seek(self, elapsed_s: float) -> int:
+        "Returns i with times_s[i] <= elapsed_s < times_s[i+1]"
+        times_s = self.times_s
+        i = self._cursor
+        if elapsed_s < times_s[i]:
+            # The time went back: search
+            i = max(bisect.bisect_right(times_s, elapsed_s) - 1, 0)
+        last = len(times_s) - 1
+        while (i < last) and (times_s[i + 1] <= elapsed_s):
+            i += 1
+        self._cursor = i
+        return i
+
+    def setpoint(self, elapsed_s: float) -> float:
+        i = self._seek(elapsed_s)
+        if i >= len(self.times_s) - 1:
+            return self.setpoints_pRH[-1]
+        t0, t1 = self.times_s[i], self.times_s[i + 1]
+        v0, v1 = self.setpoints_pRH[i], self.setpoints_pRH[i + 1]
+        return v0 + (v1 - v0) * (elapsed_s - t0) / (t1 - t0)
+
+    def segment(self, elapsed_s: float) -> int:
+        "The number of the segment running, starting with 1"
+        i = self._seek(elapsed_s)
+        if i >= len(self.times_s) - 1:
+            return self.segments[-1]
+        return self.segments[i + 1]
+
+    def progress(self, elapsed_s: float) -> float:
+        "0.0 .. 1.0"
+        if self.duration_s <= 0.0:
+            return 1.0
+        return min(max(elapsed_s / self.duration_s, 0.0), 1.0)
+
+
+if __name__ == "__main__":
+    import sys
+
+    schedule = Schedule.load(pathlib.Path(sys.argv[1]), start_pRH=50.0)
+    print(f"duration {schedule.duration_s / 3600.0:0.2f}h, {len(schedule.times_s)} breakpoints")
+    for time_s, setpoint_pRH, segment in zip(schedule.times_s, schedule.setpoints_pRH, schedule.segments):
+        print(f"{time_s:10.0f}s {setpoint_pRH:6.1f}%RH  segment {segment}")
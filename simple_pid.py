@@ -22,8 +22,44 @@ except AttributeError:
     #print('time.monotonic() not available in python < 3.3, using time.time() as fallback')
 
 
+def _import_numpy():
+    try:
+        import numpy
+    except ModuleNotFoundError:
+        raise Exception(
+            'The module "numpy" is missing. Did you call "pip -r requirements.txt"?'
+        )
+    return numpy
+
+
 class PID(object):
-    """A simple PID controller."""
+    """
+    A simple PID controller.
+
+    The state is kept in slots: no instance '__dict__', cheap attribute access
+    for high call rates and many controllers.
+    """
+
+    __slots__ = (
+        'Kp',
+        'Ki',
+        'Kd',
+        'setpoint',
+        'sample_time',
+        'proportional_on_measurement',
+        'error_map',
+        '_clock',
+        '_min_output',
+        '_max_output',
+        '_auto_mode',
+        '_proportional',
+        '_integral',
+        '_derivative',
+        '_last_time',
+        '_last_dt',
+        '_last_output',
+        '_last_input',
+    )
 
     def __init__(
         self,
@@ -36,6 +72,7 @@ class PID(object):
         auto_mode=True,
         proportional_on_measurement=False,
         error_map=None,
+        clock=None,
     ):
         """
         Initialize a new PID controller.
@@ -59,7 +96,10 @@ class PID(object):
             the input directly rather than on the error (which is the traditional way). Using
             proportional-on-measurement avoids overshoot for some types of systems.
         :param error_map: Function to transform the error value in another constrained value.
+        :param clock: Returns the time in seconds, used when no *dt* is passed. Default:
+            time.monotonic(). A simulation or a replay passes its own clock.
         """
+        self._clock = _current_time if clock is None else clock
         self.Kp, self.Ki, self.Kd = Kp, Ki, Kd
         self.setpoint = setpoint
         self.sample_time = sample_time
@@ -74,13 +114,14 @@ class PID(object):
         self._derivative = 0
 
         self._last_time = None
+        self._last_dt = None
         self._last_output = None
         self._last_input = None
 
         self.output_limits = output_limits
         self.reset()
 
-    def __call__(self, input_, dt=None):
+    def __call__(self, input_, dt=None, input_rate=None):
         """
         Update the PID controller.
 
@@ -90,17 +131,26 @@ class PID(object):
 
         :param dt: If set, uses this value for timestep instead of real time. This can be used in
             simulations when simulation time is different from real time.
+        :param input_rate: If set, the derivative term uses this rate of change of the input
+            (per second), for example from a filter, instead of the difference to the last input.
         """
-        assert isinstance(input_, float)
-        
-        if not self.auto_mode:
+        if not self._auto_mode:
             return self._last_output
 
-        now = _current_time()
         if dt is None:
-            dt = now - self._last_time if (now - self._last_time) else 1e-16
+            now = self._clock()
+            last_time = self._last_time
+            if last_time is None:
+                # The last output was computed with dt passed: its time on the clock is unknown
+                dt = self._last_dt
+            else:
+                dt = now - last_time if (now - last_time) else 1e-16
         elif dt <= 0:
             raise ValueError('dt has negative value {}, must be positive'.format(dt))
+        else:
+            # The clock is not read: offline callers pass dt. A synthetic time would not
+            # match the clock if the next call does not pass dt.
+            now = None
 
         if self.sample_time is not None and dt < self.sample_time and self._last_output is not None:
             # Only update every sample_time seconds
@@ -108,7 +158,8 @@ class PID(object):
 
         # Compute error terms
         error = self.setpoint - input_
-        d_input = input_ - (self._last_input if (self._last_input is not None) else input_)
+        last_input = self._last_input
+        d_input = 0.0 if last_input is None else input_ - last_input
 
         # Check if must map the error
         if self.error_map is not None:
@@ -117,28 +168,127 @@ class PID(object):
         # Compute the proportional term
         if not self.proportional_on_measurement:
             # Regular proportional-on-error, simply set the proportional term
-            self._proportional = self.Kp * error
+            proportional = self._proportional = self.Kp * error
         else:
             # Add the proportional error on measurement to error_sum
-            self._proportional -= self.Kp * d_input
-
-        # Compute integral and derivative terms
-        self._integral += self.Ki * error * dt
-        self._integral = _clamp(self._integral, self.output_limits)  # Avoid integral windup
-
-        self._derivative = -self.Kd * d_input / dt
+            proportional = self._proportional = self._proportional - self.Kp * d_input
+
+        # Compute integral and derivative terms, the clamping inlined: avoid integral windup
+        lower, upper = self._min_output, self._max_output
+        integral = self._integral + self.Ki * error * dt
+        if (upper is not None) and (integral > upper):
+            integral = upper
+        elif (lower is not None) and (integral < lower):
+            integral = lower
+        self._integral = integral
+
+        if input_rate is None:
+            derivative = self._derivative = -self.Kd * d_input / dt
+        else:
+            derivative = self._derivative = -self.Kd * input_rate
 
         # Compute final output
-        output = self._proportional + self._integral + self._derivative
-        output = _clamp(output, self.output_limits)
+        output = proportional + integral + derivative
+        if (upper is not None) and (output > upper):
+            output = upper
+        elif (lower is not None) and (output < lower):
+            output = lower
 
         # Keep track of state
         self._last_output = output
         self._last_input = input_
         self._last_time = now
+        self._last_dt = dt
 
         return output
 
+    def simulate(self, inputs, dts, input_rates=None):
+        """
+        Feed a recorded series of inputs through the controller.
+
+        Equivalent to calling ``self(input_, dt=dt)`` for every pair of *inputs* and *dts*,
+        including the controller state at the end, but without the wall clock and the
+        per call overhead.
+
+        :param inputs: The inputs, a numpy array or a sequence of numbers.
+        :param dts: The timesteps, a numpy array or a sequence of numbers with the same length.
+        :param input_rates: Optional, the *input_rate* of every call.
+        :return: The numpy arrays (output, proportional, integral, derivative), each with the
+            same length as *inputs*. Calls which did not compute a new output return the previous
+            output and components, as the scalar path does.
+        """
+        np = _import_numpy()
+        inputs = np.asarray(inputs, dtype=float).tolist()
+        dts = np.asarray(dts, dtype=float).tolist()
+        if len(inputs) != len(dts):
+            raise ValueError('inputs and dts must have the same length')
+        if input_rates is None:
+            input_rates = [None] * len(inputs)
+        else:
+            input_rates = np.asarray(input_rates, dtype=float).tolist()
+            if len(input_rates) != len(inputs):
+                raise ValueError('inputs and input_rates must have the same length')
+
+        lower, upper = self.output_limits
+        Kp, Ki, Kd = self.Kp, self.Ki, self.Kd
+        setpoint = self.setpoint
+        sample_time = self.sample_time
+        error_map = self.error_map
+        proportional_on_measurement = self.proportional_on_measurement
+        auto_mode = self.auto_mode
+
+        proportional, integral, derivative = self._proportional, self._integral, self._derivative
+        last_output, last_input = self._last_output, self._last_input
+        last_time, last_dt = self._last_time, self._last_dt
+
+        outputs = []
+        proportionals = []
+        integrals = []
+        derivatives = []
+        for input_, dt, input_rate in zip(inputs, dts, input_rates):
+            if auto_mode:
+                if dt <= 0:
+                    raise ValueError('dt has negative value {}, must be positive'.format(dt))
+                if sample_time is None or dt >= sample_time or last_output is None:
+                    error = setpoint - input_
+                    d_input = input_ - (last_input if (last_input is not None) else input_)
+
+                    if error_map is not None:
+                        error = error_map(error)
+
+                    if not proportional_on_measurement:
+                        proportional = Kp * error
+                    else:
+                        proportional -= Kp * d_input
+
+                    integral += Ki * error * dt
+                    integral = _clamp(integral, (lower, upper))
+
+                    if input_rate is None:
+                        derivative = -Kd * d_input / dt
+                    else:
+                        derivative = -Kd * input_rate
+
+                    last_output = _clamp(proportional + integral + derivative, (lower, upper))
+                    last_input = input_
+                    last_time, last_dt = None, dt
+
+            outputs.append(last_output)
+            proportionals.append(proportional)
+            integrals.append(integral)
+            derivatives.append(derivative)
+
+        self._proportional, self._integral, self._derivative = proportional, integral, derivative
+        self._last_output, self._last_input = last_output, last_input
+        self._last_time, self._last_dt = last_time, last_dt
+
+        return (
+            np.array(outputs, dtype=float),
+            np.array(proportionals, dtype=float),
+            np.array(integrals, dtype=float),
+            np.array(derivatives, dtype=float),
+        )
+
     def __repr__(self):
         return (
             '{self.__class__.__name__}('
@@ -158,6 +308,21 @@ class PID(object):
         """
         return self._proportional, self._integral, self._derivative
 
+    @property
+    def proportional(self):
+        """The P-term from the last computation."""
+        return self._proportional
+
+    @property
+    def integral(self):
+        """The I-term from the last computation."""
+        return self._integral
+
+    @property
+    def derivative(self):
+        """The D-term from the last computation."""
+        return self._derivative
+
     @property
     def tunings(self):
         """The tunings used by the controller as a tuple: (Kp, Ki, Kd)."""
@@ -241,6 +406,104 @@ class PID(object):
 
         self._integral = _clamp(self._integral, self.output_limits)
 
-        self._last_time = _current_time()
+        self._last_time = self._clock()
         self._last_output = None
         self._last_input = None
+
+
+def simulate_gains(
+    inputs,
+    dts,
+    Kp,
+    Ki,
+    Kd,
+    setpoint=0,
+    sample_time=0.01,
+    output_limits=(None, None),
+    proportional_on_measurement=False,
+    error_map=None,
+    components=False,
+    input_rates=None,
+):
+    """
+    Feed a recorded series of inputs through many freshly reset controllers at once.
+
+    Every controller i behaves like ``PID(Kp[i], Ki[i], Kd[i], ...).simulate(inputs, dts)``.
+    The loop runs over the timesteps, the gains are processed as numpy vectors.
+
+    :param Kp, Ki, Kd: Arrays with the gains, one entry per controller (or scalars).
+    :param components: If True, the P-, I- and D-terms are returned as well.
+    :param input_rates: Optional, the *input_rate* of every call, see :meth:`PID.__call__`.
+    :return: The outputs as numpy array of shape (controllers, len(inputs)). If *components*
+        is True, a tuple (output, proportional, integral, derivative) of such arrays.
+    """
+    np = _import_numpy()
+    Kp, Ki, Kd = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(Kp, dtype=float)),
+        np.atleast_1d(np.asarray(Ki, dtype=float)),
+        np.atleast_1d(np.asarray(Kd, dtype=float)),
+    )
+    inputs = np.asarray(inputs, dtype=float).tolist()
+    dts = np.asarray(dts, dtype=float).tolist()
+    if len(inputs) != len(dts):
+        raise ValueError('inputs and dts must have the same length')
+    if input_rates is None:
+        input_rates = [None] * len(inputs)
+    else:
+        input_rates = np.asarray(input_rates, dtype=float).tolist()
+        if len(input_rates) != len(inputs):
+            raise ValueError('inputs and input_rates must have the same length')
+
+    lower, upper = output_limits if output_limits is not None else (None, None)
+    if (lower is not None) and (upper is not None) and (upper < lower):
+        raise ValueError('lower limit must be less than upper limit')
+    lower = -np.inf if lower is None else lower
+    upper = np.inf if upper is None else upper
+
+    n = Kp.shape[0]
+    shape = (n, len(inputs))
+    outputs = np.empty(shape)
+    if components:
+        proportionals = np.empty(shape)
+        integrals = np.empty(shape)
+        derivatives = np.empty(shape)
+
+    proportional = np.zeros(n)
+    integral = np.clip(np.zeros(n), lower, upper)
+    derivative = np.zeros(n)
+    last_output = None
+    last_input = None
+    for k, (input_, dt, input_rate) in enumerate(zip(inputs, dts, input_rates)):
+        if dt <= 0:
+            raise ValueError('dt has negative value {}, must be positive'.format(dt))
+        # The decision to skip is the same for all controllers
+        if sample_time is None or dt >= sample_time or last_output is None:
+            error = setpoint - input_
+            d_input = input_ - (last_input if (last_input is not None) else input_)
+
+            if error_map is not None:
+                error = error_map(error)
+
+            if not proportional_on_measurement:
+                proportional = Kp * error
+            else:
+                proportional = proportional - Kp * d_input
+
+            integral = np.clip(integral + Ki * error * dt, lower, upper)
+            if input_rate is None:
+                derivative = -Kd * d_input / dt
+            else:
+                derivative = -Kd * input_rate
+
+            last_output = np.clip(proportional + integral + derivative, lower, upper)
+            last_input = input_
+
+        outputs[:, k] = last_output
+        if components:
+            proportionals[:, k] = proportional
+            integrals[:, k] = integral
+            derivatives[:, k] = derivative
+
+    if components:
+        return outputs, proportionals, integrals, derivatives
+    return outputs
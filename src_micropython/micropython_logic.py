@@ -1,23 +1,54 @@
+import sys
 import time
+import struct
 import machine
 import micropython
 import neo_led
 import sht31
 import pwm
+import pid
 
 real_setup = True
 
+# Telemetry frame, see 'TelemetryStream' on the host.
+# magic, sequence number, ticks_ms, humi_temp_C, humi_humi_pRH, stage_temp_C, stage_humi_pRH
+# followed by one checksum byte (sum of all bytes).
+FRAME_MAGIC = b'HC'
+FRAME_FORMAT = '<2sIIffff'
+
+# Autonomous mode: the fans are switched off if the host did not call
+# 'supervise()' for 'host_timeout_ms' or if the sensors failed this many ticks in a row.
+SENSOR_FAILURES_MAX = 5
+COLOR_FALLBACK = (100,100,0)
+
+autonomous = None
+
 def pyboard_init():
     if real_setup:
         neo_led.np.fill((0,0,0))
         neo_led.np.write()
 
+def get_status():
+    if not real_setup:
+        return {}
+    sensors = sht31.sensors
+    return {
+        'periodic': sensors.periodic,
+        'crc_errors_a': sensors.sensor_a_fix.crc_errors,
+        'crc_errors_b': sensors.sensor_b_cable.crc_errors,
+        'retries': sensors.retry_count,
+        'discards': sensors.discard_count,
+    }
+
 def leds(color=(0,0,0)):
     if real_setup:
         neo_led.np.fill(color)
         neo_led.np.write()
 
 def get_measurement(average_n = 1):
+    if (autonomous is not None) and autonomous.running:
+        # The timer owns the sensors: return the values of its last tick
+        return autonomous.measurement()
     if real_setup == True:
         sht31.sensors.measure(average_n = average_n)
         dict = {
@@ -26,6 +57,9 @@ def get_measurement(average_n = 1):
             'stage_temp_C': sht31.sensors.temperature_C_b,
             'stage_humi_pRH': sht31.sensors.humidity_percent_b,
         }
+        if sht31.sensors.humidity_rate_a is not None:
+            # Filter with an 'alpha_beta' stage
+            dict['humi_humi_pRH_per_s'] = sht31.sensors.humidity_rate_a
     else:
         dict = {
             'humi_temp_C': 25.4,
@@ -35,6 +69,20 @@ def get_measurement(average_n = 1):
         }
     return dict
 
+def set_filter(spec = None):
+    # See 'sensor_filter'. None: no filter.
+    if real_setup:
+        sht31.sensors.set_filter(spec)
+
+def set_periodic(mps = None, art = False):
+    # mps=None: single shot mode. Else periodic mode with 'mps' measurements per second.
+    if not real_setup:
+        return
+    if sht31.sensors.periodic:
+        sht31.sensors.stop_periodic()
+    if (mps is not None) or art:
+        sht31.sensors.start_periodic(mps = mps, art = art)
+
 def set_fan_hum_intensity(value):
     pwm.fans_hum.set_fan_hum_intensity(value/100.0)
 
@@ -43,4 +91,191 @@ def set_fan_circ_intensity(value):
     if value < 0.1:
         pwm.fan_circ_on_off.set_intensity(1.0)
     else:
-        pwm.fan_circ_on_off.set_intensity(0.0) # Schaltet sonst nicht komplett aus. Bastel.
\ No newline at end of file
+        pwm.fan_circ_on_off.set_intensity(0.0) # Schaltet sonst nicht komplett aus. Bastel.
+
+def step(fan_hum=None, color=None, average_n = 1):
+    # One control tick in a single REPL exchange: apply the outputs, then measure.
+    # None: unchanged, nothing is written.
+    if fan_hum is not None:
+        set_fan_hum_intensity(fan_hum)
+    if color is not None:
+        leds(color=color)
+    return get_measurement(average_n = average_n)
+
+def stream(interval_ms = 1000, average_n = 1):
+    # Writes binary telemetry frames until the host sends ctrl-C.
+    out = sys.stdout.buffer
+    size = struct.calcsize(FRAME_FORMAT)
+    frame = bytearray(size + 1)
+    seq = 0
+    ticks_next = time.ticks_ms()
+    while True:
+        d = get_measurement(average_n = average_n)
+        struct.pack_into(FRAME_FORMAT, frame, 0, FRAME_MAGIC, seq, time.ticks_ms(),
+            d['humi_temp_C'], d['humi_humi_pRH'], d['stage_temp_C'], d['stage_humi_pRH'])
+        checksum = 0
+        for i in range(size):
+            checksum += frame[i]
+        frame[size] = checksum & 0xFF
+        out.write(frame)
+        seq += 1
+        ticks_next = time.ticks_add(ticks_next, interval_ms)
+        delay_ms = time.ticks_diff(ticks_next, time.ticks_ms())
+        if delay_ms > 0:
+            time.sleep_ms(delay_ms)
+        else:
+            # Measurement slower than interval_ms: do not try to catch up
+            ticks_next = time.ticks_ms()
+
+
+class Autonomous:
+    # The control loop on the pico. A machine.Timer schedules 'tick()' every 'interval_ms'.
+    # The sensors are triggered at the end of a tick and read at the beginning
+    # of the next one: the tick never sleeps.
+    def __init__(self, setpoint, Kp, Ki, Kd, interval_ms = 1000, host_timeout_ms = 60000):
+        self.pid = pid.PID(Kp, Ki, Kd, setpoint, output_limits=(10.0, 100.0))
+        self.interval_ms = interval_ms
+        self.host_timeout_ms = host_timeout_ms
+        self.running = False
+        self.fan = 0.0
+        self.color = None
+        self.fallback = None
+        self.ticks = 0
+        self.overruns = 0
+        self.errors = 0
+        self.sensor_failures = 0
+        self.humi_humi_pRH = 0.0
+        self.ticks_host = time.ticks_ms()
+        self.ticks_last = None
+        # Allocate the bound method once: 'micropython.schedule()' is called from the timer irq
+        self._tick_ref = self.tick
+        self._timer = machine.Timer()
+
+    def start(self):
+        if real_setup:
+            sht31.sensors.trigger()
+        self.ticks_host = time.ticks_ms()
+        self.running = True
+        self._timer.init(period=self.interval_ms, mode=machine.Timer.PERIODIC, callback=self._irq)
+
+    def stop(self):
+        self._timer.deinit()
+        self.running = False
+        set_fan_hum_intensity(0.0)
+
+    def _irq(self, timer):
+        try:
+            micropython.schedule(self._tick_ref, None)
+        except RuntimeError:
+            # The schedule queue is full: the previous tick is still pending
+            self.overruns += 1
+
+    def tick(self, _arg):
+        try:
+            self._tick()
+        except Exception:
+            self.errors += 1
+            self.fan = 0.0
+            set_fan_hum_intensity(0.0)
+
+    def _tick(self):
+        ticks_now = time.ticks_ms()
+        if self.ticks_last is None:
+            dt = self.interval_ms / 1000.0
+        else:
+            dt = time.ticks_diff(ticks_now, self.ticks_last) / 1000.0
+            if dt <= 0.0:
+                dt = self.interval_ms / 1000.0
+        self.ticks_last = ticks_now
+        self.ticks += 1
+
+        if real_setup:
+            if sht31.sensors.collect():
+                self.sensor_failures = 0
+            else:
+                self.sensor_failures += 1
+            self.humi_humi_pRH = sht31.sensors.humidity_percent_a
+            rate = sht31.sensors.humidity_rate_a
+        else:
+            self.humi_humi_pRH = 75.3
+            rate = None
+
+        # Watchdog
+        if self.sensor_failures >= SENSOR_FAILURES_MAX:
+            fallback = 'sensor'
+        elif time.ticks_diff(ticks_now, self.ticks_host) > self.host_timeout_ms:
+            fallback = 'host'
+        else:
+            fallback = None
+        if fallback is not None:
+            self.fan = 0.0
+            color = COLOR_FALLBACK
+        else:
+            if self.fallback is not None:
+                # Recovered: start without the old integral
+                self.pid.reset()
+            self.fan = self.pid(self.humi_humi_pRH, dt, rate)
+            if abs(self.pid.setpoint - self.humi_humi_pRH) < 2.0:
+                color = (0,100,0)
+            else:
+                color = (0,0,100)
+        self.fallback = fallback
+
+        set_fan_hum_intensity(self.fan)
+        if color != self.color:
+            leds(color=color)
+            self.color = color
+        if real_setup:
+            sht31.sensors.trigger()
+
+    def measurement(self):
+        if real_setup:
+            sensors = sht31.sensors
+            return {
+                'humi_temp_C': sensors.temperature_C_a,
+                'humi_humi_pRH': sensors.humidity_percent_a,
+                'stage_temp_C': sensors.temperature_C_b,
+                'stage_humi_pRH': sensors.humidity_percent_b,
+            }
+        return {
+            'humi_temp_C': 25.4,
+            'humi_humi_pRH': self.humi_humi_pRH,
+            'stage_temp_C': 26.3,
+            'stage_humi_pRH': 77.9,
+        }
+
+def start_autonomous(setpoint, Kp, Ki, Kd, interval_ms = 1000, host_timeout_ms = 60000):
+    global autonomous
+    stop_autonomous()
+    autonomous = Autonomous(setpoint, Kp, Ki, Kd, interval_ms = interval_ms, host_timeout_ms = host_timeout_ms)
+    autonomous.start()
+
+def stop_autonomous():
+    global autonomous
+    if autonomous is not None:
+        autonomous.stop()
+        autonomous = None
+
+def supervise(setpoint = None, Kp = None, Ki = None, Kd = None):
+    # Called by the host every tick: feeds the watchdog, updates the setpoint
+    # and the gains (None: unchanged) and returns the telemetry.
+    a = autonomous
+    if a is None:
+        raise RuntimeError('supervise(): the autonomous mode is not running, call start_autonomous() first')
+    a.ticks_host = time.ticks_ms()
+    p = a.pid
+    if setpoint is not None:
+        p.setpoint = setpoint
+    if Kp is not None:
+        p.Kp = Kp
+    if Ki is not None:
+        p.Ki = Ki
+    if Kd is not None:
+        p.Kd = Kd
+    d = a.measurement()
+    d['fan'] = a.fan
+    d['ticks'] = a.ticks
+    d['overruns'] = a.overruns
+    d['errors'] = a.errors
+    d['fallback'] = a.fallback
+    return d
@@ -21,17 +21,14 @@ def blink(speed,color1,color2): #change between two colors
     np.fill(color2); np.write()
     time.sleep_ms(speed); np.write()
     
-a=10; arra=[a]; rain=[] #making intensity array for rainbow
-for i in range(5):
-    for j in range(5): arra.append(a-2); a-=2
-    for j in range(5): arra.append(0)
-    for j in range(5): arra.append(a+2); a+=2
-for i in range(len(arra)-10):
-    rain.append((arra[i],arra[i+10],arra[i+5]))
-    
+# Rainbow: (r, g, b) for 15 steps, red -> green -> blue -> red. Frozen: no tables are built at import.
+_RAIN = b'\x0a\x00\x00\x08\x02\x00\x06\x04\x00\x04\x06\x00\x02\x08\x00\x00\x0a\x00\x00\x08\x02\x00\x06\x04\x00\x04\x06\x00\x02\x08\x00\x00\x0a\x02\x00\x08\x04\x00\x06\x06\x00\x04\x08\x00\x02'
+_RAIN_N = const(15)
+
 def rainbow(start):
     for i in range(leds):
-        np[i]=rain[i+start];
+        j = 3*((i+start) % _RAIN_N)
+        np[i]=(_RAIN[j], _RAIN[j+1], _RAIN[j+2])
         np.write()
         
 def rainbow_run(speed):
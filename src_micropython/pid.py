@@ -0,0 +1,44 @@
+# The same algorithm as 'simple_pid.PID' on the host, called with 'dt':
+# proportional on error, integral clamped to the output limits (no windup),
+# derivative on the measurement. 'input_rate' (per second), for example from
+# 'sensor_filter.AlphaBeta', replaces the difference of the inputs in the derivative.
+
+class PID:
+    def __init__(self, Kp=1.0, Ki=0.0, Kd=0.0, setpoint=0.0, output_limits=(None, None)):
+        self.Kp = Kp
+        self.Ki = Ki
+        self.Kd = Kd
+        self.setpoint = setpoint
+        self.lower, self.upper = output_limits
+        self.reset()
+
+    def reset(self):
+        self.proportional = 0.0
+        self.integral = self._clamp(0.0)
+        self.derivative = 0.0
+        self.last_input = None
+        self.last_output = None
+
+    def _clamp(self, value):
+        if (self.upper is not None) and (value > self.upper):
+            return self.upper
+        if (self.lower is not None) and (value < self.lower):
+            return self.lower
+        return value
+
+    def __call__(self, input_, dt, input_rate=None):
+        error = self.setpoint - input_
+        if self.last_input is None:
+            d_input = 0.0
+        else:
+            d_input = input_ - self.last_input
+        self.proportional = self.Kp * error
+        self.integral = self._clamp(self.integral + self.Ki * error * dt)
+        if input_rate is None:
+            self.derivative = -self.Kd * d_input / dt
+        else:
+            self.derivative = -self.Kd * input_rate
+        output = self._clamp(self.proportional + self.integral + self.derivative)
+        self.last_output = output
+        self.last_input = input_
+        return output
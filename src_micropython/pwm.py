@@ -1,9 +1,11 @@
 import machine
+import micropython
 
 class Fan_pwm:
     def __init__(self, pin_GPx = 0, frequency_Hz = 25000): 
         self.fan_pwm = machine.PWM(machine.Pin(pin_GPx))
         self.fan_pwm.freq(frequency_Hz)
+    @micropython.native
     def set_intensity(self, intensity = 0.2): # intensity 0.0...1.0
         intensity = 1.0 - intensity
         intensity_u16 = int(intensity * 2**16)
@@ -0,0 +1,104 @@
+# Filters for the sensor readings. Runs on the pico (micropython) and on the host.
+#
+# A pipeline is described by a string, the stages separated by ',':
+#   'median:3'              Median of the last 3 values: rejects single spikes
+#   'ema:0.3'               Exponential moving average, weight 0.3 for the new value
+#   'alpha_beta:0.5:0.05'   Alpha-beta tracker: value and rate (per second)
+# Example: 'median:3,alpha_beta:0.5:0.05'
+
+class Median:
+    def __init__(self, n=3):
+        self.n = n
+        self._values = []
+
+    def reset(self):
+        self._values = []
+
+    def update(self, x, dt):
+        values = self._values
+        values.append(x)
+        if len(values) > self.n:
+            values.pop(0)
+        ordered = sorted(values)
+        return ordered[len(ordered) // 2]
+
+
+class Ema:
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.y = None
+
+    def reset(self):
+        self.y = None
+
+    def update(self, x, dt):
+        if self.y is None:
+            self.y = x
+        else:
+            self.y += self.alpha * (x - self.y)
+        return self.y
+
+
+class AlphaBeta:
+    # A steady state Kalman filter for a constant rate model.
+    # alpha: weight of the measurement for the value, beta: for the rate.
+    def __init__(self, alpha=0.5, beta=0.05):
+        self.alpha = alpha
+        self.beta = beta
+        self.reset()
+
+    def reset(self):
+        self.x = None
+        self.rate = 0.0
+
+    def update(self, x, dt):
+        if self.x is None:
+            self.x = x
+            return x
+        predicted = self.x + self.rate * dt
+        residual = x - predicted
+        self.x = predicted + self.alpha * residual
+        self.rate += self.beta * residual / dt
+        return self.x
+
+
+_STAGES = {
+    'median': (Median, int),
+    'ema': (Ema, float),
+    'alpha_beta': (AlphaBeta, float),
+}
+
+
+class Pipeline:
+    def __init__(self, spec=''):
+        self.spec = spec
+        self.stages = []
+        for stage in spec.split(','):
+            stage = stage.strip()
+            if stage == '':
+                continue
+            fields = stage.split(':')
+            if fields[0] not in _STAGES:
+                raise ValueError('Unknown filter: ' + fields[0])
+            cls, convert = _STAGES[fields[0]]
+            self.stages.append(cls(*[convert(field) for field in fields[1:]]))
+        self.x = None
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+        self.x = None
+
+    def update(self, x, dt=1.0):
+        for stage in self.stages:
+            x = stage.update(x, dt)
+        self.x = x
+        return x
+
+    @property
+    def rate(self):
+        # The rate of the last stage which estimates one. None if there is none.
+        for stage in reversed(self.stages):
+            if isinstance(stage, AlphaBeta):
+                return stage.rate
+        return None
@@ -2,30 +2,74 @@
 
 from machine import I2C
 import time
+import micropython
+import sensor_filter
 
 R_HIGH   = const(1)
 R_MEDIUM = const(2)
 R_LOW    = const(3)
 
+# Measurements per second in periodic acquisition mode
+MPS_0_5  = const(0)
+MPS_1    = const(1)
+MPS_2    = const(2)
+MPS_4    = const(4)
+MPS_10   = const(10)
+
+# Single shot without clock stretching: the conversion time for each repeatability (datasheet max + margin).
+# Indexed by R_HIGH, R_MEDIUM, R_LOW.
+_map_wait_ms = (0, 16, 7, 5)
+
+
+# CRC-8, polynomial 0x31 (x8 + x5 + x4 + 1), see datasheet 4.12.
+# Frozen: in a .mpy file, the table is a constant and is not built at import.
+# table[i] = i shifted through the polynomial 8 times
+_CRC8_TABLE = (
+    b'\x00\x31\x62\x53\xc4\xf5\xa6\x97\xb9\x88\xdb\xea\x7d\x4c\x1f\x2e\x43\x72\x21\x10\x87\xb6\xe5\xd4\xfa\xcb\x98\xa9\x3e\x0f\x5c\x6d'
+    b'\x86\xb7\xe4\xd5\x42\x73\x20\x11\x3f\x0e\x5d\x6c\xfb\xca\x99\xa8\xc5\xf4\xa7\x96\x01\x30\x63\x52\x7c\x4d\x1e\x2f\xb8\x89\xda\xeb'
+    b'\x3d\x0c\x5f\x6e\xf9\xc8\x9b\xaa\x84\xb5\xe6\xd7\x40\x71\x22\x13\x7e\x4f\x1c\x2d\xba\x8b\xd8\xe9\xc7\xf6\xa5\x94\x03\x32\x61\x50'
+    b'\xbb\x8a\xd9\xe8\x7f\x4e\x1d\x2c\x02\x33\x60\x51\xc6\xf7\xa4\x95\xf8\xc9\x9a\xab\x3c\x0d\x5e\x6f\x41\x70\x23\x12\x85\xb4\xe7\xd6'
+    b'\x7a\x4b\x18\x29\xbe\x8f\xdc\xed\xc3\xf2\xa1\x90\x07\x36\x65\x54\x39\x08\x5b\x6a\xfd\xcc\x9f\xae\x80\xb1\xe2\xd3\x44\x75\x26\x17'
+    b'\xfc\xcd\x9e\xaf\x38\x09\x5a\x6b\x45\x74\x27\x16\x81\xb0\xe3\xd2\xbf\x8e\xdd\xec\x7b\x4a\x19\x28\x06\x37\x64\x55\xc2\xf3\xa0\x91'
+    b'\x47\x76\x25\x14\x83\xb2\xe1\xd0\xfe\xcf\x9c\xad\x3a\x0b\x58\x69\x04\x35\x66\x57\xc0\xf1\xa2\x93\xbd\x8c\xdf\xee\x79\x48\x1b\x2a'
+    b'\xc1\xf0\xa3\x92\x05\x34\x67\x56\x78\x49\x1a\x2b\xbc\x8d\xde\xef\x82\xb3\xe0\xd1\x46\x77\x24\x15\x3b\x0a\x59\x68\xff\xce\x9d\xac'
+)
+
+
+@micropython.viper
+def crc8(buf, start: int, end: int) -> int:
+    table = ptr8(_CRC8_TABLE)
+    data = ptr8(buf)
+    crc = 0xFF
+    for i in range(start, end):
+        crc = table[crc ^ data[i]]
+    return crc
+
+
+class CRCError(OSError):
+    pass
+
 class SHT31(object):
     """
     This class implements an interface to the SHT31 temprature and humidity
     sensor from Sensirion.
     """
 
-    # This static map helps keeping the heap and program logic cleaner
-    _map_cs_r = {
-    	True: {
-            R_HIGH : b'\x2c\x06',
-            R_MEDIUM : b'\x2c\x0d',
-            R_LOW: b'\x2c\x10'
-            },
-        False: {
-            R_HIGH : b'\x24\x00',
-            R_MEDIUM : b'\x24\x0b',
-            R_LOW: b'\x24\x16'
-            }
+    # Single shot commands, indexed by the repeatability R_HIGH, R_MEDIUM, R_LOW.
+    # Tuples of bytes are constants in a .mpy file: no dict is built at import.
+    _cmd_cs = (None, b'\x2c\x06', b'\x2c\x0d', b'\x2c\x10')
+    _cmd_no_cs = (None, b'\x24\x00', b'\x24\x0b', b'\x24\x16')
+
+    _map_periodic = {
+        MPS_0_5: {R_HIGH: b'\x20\x32', R_MEDIUM: b'\x20\x24', R_LOW: b'\x20\x2f'},
+        MPS_1: {R_HIGH: b'\x21\x30', R_MEDIUM: b'\x21\x26', R_LOW: b'\x21\x2d'},
+        MPS_2: {R_HIGH: b'\x22\x36', R_MEDIUM: b'\x22\x20', R_LOW: b'\x22\x2b'},
+        MPS_4: {R_HIGH: b'\x23\x34', R_MEDIUM: b'\x23\x22', R_LOW: b'\x23\x29'},
+        MPS_10: {R_HIGH: b'\x27\x37', R_MEDIUM: b'\x27\x21', R_LOW: b'\x27\x2a'},
         }
+    _cmd_art = b'\x2b\x32'
+    _cmd_fetch = b'\xe0\x00'
+    _cmd_break = b'\x30\x93'
 
     def __init__(self, i2c, addr=0x44):
         """
@@ -36,6 +80,11 @@ class SHT31(object):
             raise ValueError('I2C object needed as argument!')
         self._i2c = i2c
         self._addr = addr
+        # Preallocated: reading does not allocate
+        self._buf = bytearray(6)
+        self.raw_t = 0
+        self.raw_h = 0
+        self.crc_errors = 0
 
     def _send(self, buf):
         """
@@ -51,18 +100,32 @@ class SHT31(object):
         """
         return self._i2c.readfrom(self._addr, count)
 
+    @micropython.native
+    def _recv_raw(self):
+        """
+        Read temperature and humidity into 'raw_t' and 'raw_h' and check the CRC.
+        Raises CRCError if the CRC does not match.
+        """
+        buf = self._buf
+        self._i2c.readfrom_into(self._addr, buf)
+        if (crc8(buf, 0, 2) != buf[2]) or (crc8(buf, 3, 5) != buf[5]):
+            self.crc_errors += 1
+            raise CRCError('SHT31 0x%02x: CRC error' % self._addr)
+        self.raw_t = (buf[0] << 8) | buf[1]
+        self.raw_h = (buf[3] << 8) | buf[4]
+
     def _raw_temp_humi(self, r=R_HIGH, cs=True):
         """
-        Read the raw temperature and humidity from the sensor and skips CRC
-        checking.
+        Read the raw temperature and humidity from the sensor.
+        Raises CRCError if the CRC does not match.
         Returns a tuple for both values in that order.
         """
         if r not in (R_HIGH, R_MEDIUM, R_LOW):
             raise ValueError('Wrong repeatabillity value given!')
-        self._send(self._map_cs_r[cs][r])
+        self._send(self._cmd_cs[r] if cs else self._cmd_no_cs[r])
         time.sleep_ms(50)
-        raw = self._recv(6)
-        return (raw[0] << 8) + raw[1], (raw[3] << 8) + raw[4]
+        self._recv_raw()
+        return self.raw_t, self.raw_h
 
     def get_temp_humi(self, resolution=R_HIGH, clock_stretch=True, celsius=True):
         """
@@ -71,12 +134,64 @@ class SHT31(object):
         Returns a tuple for both values in that order.
         """
         t, h = self._raw_temp_humi(resolution, clock_stretch)
+        return self._convert(t, h, celsius)
+
+    @micropython.native
+    def _convert(self, t, h, celsius=True):
         if celsius:
             temp = -45 + (175 * (t / 65535))
         else:
             temp = -49 + (315 * (t / 65535))
         return temp, 100 * (h / 65535)
 
+    def trigger(self, r=R_HIGH):
+        """
+        Start a single shot measurement without clock stretching and return
+        immediately. The result may be read after '_map_wait_ms[r]'.
+        """
+        if r not in (R_HIGH, R_MEDIUM, R_LOW):
+            raise ValueError('Wrong repeatabillity value given!')
+        self._send(self._cmd_no_cs[r])
+
+    def read_temp_humi(self, celsius=True):
+        """
+        Read the result of 'trigger()' or 'fetch'.
+        Raises OSError if the sensor has no data yet (NACK) and CRCError
+        if the CRC does not match.
+        """
+        self._recv_raw()
+        return self._convert(self.raw_t, self.raw_h, celsius)
+
+    def start_periodic(self, mps=MPS_1, r=R_HIGH):
+        """
+        Start the periodic data acquisition mode.
+        The sensor measures 'mps' times per second, results are read with 'fetch_temp_humi()'.
+        """
+        if r not in (R_HIGH, R_MEDIUM, R_LOW):
+            raise ValueError('Wrong repeatabillity value given!')
+        self._send(self._map_periodic[mps][r])
+
+    def start_art(self):
+        """
+        Start the periodic mode with accelerated response time (4 mps).
+        """
+        self._send(self._cmd_art)
+
+    def stop_periodic(self):
+        """
+        Stop the periodic mode, back to single shot mode.
+        """
+        self._send(self._cmd_break)
+        time.sleep_ms(1)
+
+    def fetch_temp_humi(self, celsius=True):
+        """
+        Read the latest result in periodic mode.
+        Raises OSError if no new result is available since the last fetch.
+        """
+        self._send(self._cmd_fetch)
+        return self.read_temp_humi(celsius)
+
 
 class Sensors_sht31:
     def __init__(self):
@@ -87,24 +202,201 @@ class Sensors_sht31:
         self.humidity_percent_a = 0.0
         self.temperature_C_b = 0.0
         self.humidity_percent_b = 0.0
-    
+        self.resolution = R_HIGH
+        self.periodic = False
+        # Periodic mode: the last 'average_n' results of each sensor
+        self._periodic_samples_a = []
+        self._periodic_samples_b = []
+        # Retries after a CRC error or a NACK, then the sample is discarded
+        self.retry_max = 2
+        self.retry_count = 0
+        self.discard_count = 0
+        # See 'set_filter()'
+        self.filters = None
+        self.humidity_rate_a = None
+        self.humidity_rate_b = None
+        # Time of the last fresh sample of sensor a and b
+        self._ticks_filter = [None, None]
+
+    def set_filter(self, spec=None):
+        """
+        Filter the measurements, see 'sensor_filter'. None: no filter.
+        With an 'alpha_beta' stage, 'humidity_rate_a/b' is the rate in %RH per second.
+        """
+        if spec is None:
+            self.filters = None
+        else:
+            self.filters = [sensor_filter.Pipeline(spec) for i in range(4)]
+        self.humidity_rate_a = None
+        self.humidity_rate_b = None
+        self._ticks_filter = [None, None]
+
+    def _filter_dt(self, i, ticks):
+        last = self._ticks_filter[i]
+        self._ticks_filter[i] = ticks
+        if last is None:
+            return 1.0
+        return max(time.ticks_diff(ticks, last), 1) / 1000.0
+
+    def _filter(self, fresh_a, fresh_b):
+        # Only a fresh sample updates the pipelines of its sensor: a kept
+        # value has been filtered already.
+        filters = self.filters
+        if filters is None:
+            return
+        ticks = time.ticks_ms()
+        if fresh_a:
+            dt = self._filter_dt(0, ticks)
+            self.temperature_C_a = filters[0].update(self.temperature_C_a, dt)
+            self.humidity_percent_a = filters[1].update(self.humidity_percent_a, dt)
+            self.humidity_rate_a = filters[1].rate
+        if fresh_b:
+            dt = self._filter_dt(1, ticks)
+            self.temperature_C_b = filters[2].update(self.temperature_C_b, dt)
+            self.humidity_percent_b = filters[3].update(self.humidity_percent_b, dt)
+            self.humidity_rate_b = filters[3].rate
+
+    def start_periodic(self, mps=MPS_1, art=False):
+        """
+        Both sensors measure continuously. 'measure()' only fetches the results.
+        'measure(average_n)' then is a moving average over the last 'average_n'
+        results, across calls: not 'average_n' new samples as in single shot mode.
+        """
+        for sensor in (self.sensor_a_fix, self.sensor_b_cable):
+            if art:
+                sensor.start_art()
+            else:
+                sensor.start_periodic(mps=mps, r=self.resolution)
+        self._periodic_samples_a = []
+        self._periodic_samples_b = []
+        self.periodic = True
+
+    def stop_periodic(self):
+        for sensor in (self.sensor_a_fix, self.sensor_b_cable):
+            sensor.stop_periodic()
+        self.periodic = False
+
     def measure(self, average_n = 1):
-        temperature_C_a_average = 0.0
-        humidity_percent_a_average = 0.0
-        temperature_C_b_average = 0.0
-        humidity_percent_b_average = 0.0
+        if self.periodic:
+            fresh_a, fresh_b = self._measure_periodic(average_n)
+            self._filter(fresh_a, fresh_b)
+            return
+        sensor_a = self.sensor_a_fix
+        sensor_b = self.sensor_b_cable
+        # Average the raw values: no float allocations in the loop
+        t_a = h_a = n_a = 0
+        t_b = h_b = n_b = 0
+        wait_ms = _map_wait_ms[self.resolution]
         for i in range(average_n):
-            temperature_C_a, humidity_percent_a = self.sensor_a_fix.get_temp_humi()
-            temperature_C_b, humidity_percent_b = self.sensor_b_cable.get_temp_humi()
-            temperature_C_a_average += temperature_C_a
-            humidity_percent_a_average += humidity_percent_a
-            temperature_C_b_average += temperature_C_b
-            humidity_percent_b_average += humidity_percent_b
-        self.temperature_C_a = temperature_C_a_average / average_n
-        self.humidity_percent_a = humidity_percent_a_average / average_n
-        self.temperature_C_b = temperature_C_b_average / average_n
-        self.humidity_percent_b = humidity_percent_b_average / average_n
-    
+            # Both sensors convert at the same time
+            self._trigger(sensor_a)
+            self._trigger(sensor_b)
+            time.sleep_ms(wait_ms)
+            if self._read_raw(sensor_a, wait_ms):
+                t_a += sensor_a.raw_t
+                h_a += sensor_a.raw_h
+                n_a += 1
+            if self._read_raw(sensor_b, wait_ms):
+                t_b += sensor_b.raw_t
+                h_b += sensor_b.raw_h
+                n_b += 1
+        # If all samples were discarded, the previous values are kept
+        if n_a > 0:
+            self.temperature_C_a, self.humidity_percent_a = sensor_a._convert(t_a / n_a, h_a / n_a)
+        if n_b > 0:
+            self.temperature_C_b, self.humidity_percent_b = sensor_b._convert(t_b / n_b, h_b / n_b)
+        self._filter(n_a > 0, n_b > 0)
+
+    def trigger(self):
+        """
+        Start a single shot measurement on both sensors and return immediately.
+        Read the results with 'collect()' after '_map_wait_ms'.
+        """
+        self.sensor_a_fix.trigger(self.resolution)
+        self.sensor_b_cable.trigger(self.resolution)
+
+    def collect(self):
+        """
+        Read the results of 'trigger()'. No retry and no waiting: a failed
+        sample is discarded and the previous values are kept.
+        Returns False if a sample was discarded.
+        """
+        ok_a = ok_b = True
+        sensor = self.sensor_a_fix
+        try:
+            sensor._recv_raw()
+            self.temperature_C_a, self.humidity_percent_a = sensor._convert(sensor.raw_t, sensor.raw_h)
+        except OSError:
+            self.discard_count += 1
+            ok_a = False
+        sensor = self.sensor_b_cable
+        try:
+            sensor._recv_raw()
+            self.temperature_C_b, self.humidity_percent_b = sensor._convert(sensor.raw_t, sensor.raw_h)
+        except OSError:
+            self.discard_count += 1
+            ok_b = False
+        self._filter(ok_a, ok_b)
+        return ok_a and ok_b
+
+    def _trigger(self, sensor):
+        # A failed trigger (NACK) is noticed by '_read_raw()', which triggers again
+        try:
+            sensor.trigger(self.resolution)
+        except OSError:
+            pass
+
+    def _read_raw(self, sensor, wait_ms):
+        """
+        Read the triggered measurement into 'sensor.raw_t' and 'sensor.raw_h'.
+        On a CRC error or a NACK (no clock stretching: the conversion is not
+        finished), the measurement is repeated up to 'retry_max' times.
+        Returns False if the sample has to be discarded.
+        """
+        for retry in range(self.retry_max + 1):
+            if retry > 0:
+                self.retry_count += 1
+                self._trigger(sensor)
+                time.sleep_ms(wait_ms)
+            try:
+                sensor._recv_raw()
+                return True
+            except OSError:
+                # 'CRCError' is an OSError
+                pass
+        self.discard_count += 1
+        return False
+
+    def _measure_periodic(self, average_n):
+        # No waiting: fetch the newest result of each sensor. A sensor
+        # without a new result or with a CRC error keeps its values.
+        # Returns for sensor a and b: True if there was a new result.
+        result_a = self._fetch_periodic(self.sensor_a_fix, self._periodic_samples_a, average_n)
+        if result_a is not None:
+            self.temperature_C_a, self.humidity_percent_a = result_a
+        result_b = self._fetch_periodic(self.sensor_b_cable, self._periodic_samples_b, average_n)
+        if result_b is not None:
+            self.temperature_C_b, self.humidity_percent_b = result_b
+        return result_a is not None, result_b is not None
+
+    def _fetch_periodic(self, sensor, samples, average_n):
+        """
+        Fetch the newest result of 'sensor' into 'samples'.
+        Returns the average over the last 'average_n' results, None if there is no new result.
+        """
+        try:
+            samples.append(sensor.fetch_temp_humi())
+        except CRCError:
+            self.discard_count += 1
+            return None
+        except OSError:
+            # No new result since the last fetch
+            return None
+        while len(samples) > average_n:
+            samples.pop(0)
+        n = len(samples)
+        return sum([sample[0] for sample in samples]) / n, sum([sample[1] for sample in samples]) / n
+
 
 import machine
 
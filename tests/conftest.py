@@ -0,0 +1,5 @@
+import pathlib
+import sys
+
+# The modules are in the top directory of the repository
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
@@ -0,0 +1,114 @@
+import json
+import pathlib
+
+import pytest
+
+from humidity_controller_2022 import Controller, PicoBase
+from pico_simulator import ChamberModel, PicoSimulator, SimulatedClock, run
+
+FILTER = "median:3,alpha_beta:0.5:0.05"
+
+
+def make_controller(tmp_path: pathlib.Path, autonomous: bool = False):
+    clock = SimulatedClock()
+    pico = PicoSimulator(model=ChamberModel(seed=1), clock=clock)
+    controller = Controller(pico=pico, filename_log=tmp_path / "controller.txt", clock=clock, autonomous=autonomous)
+    return controller, pico, clock
+
+
+def test_host_filter_moves_to_the_pico_in_autonomous_mode(tmp_path):
+    controller, pico, clock = make_controller(tmp_path, autonomous=True)
+    controller.set_filter(FILTER)
+    assert pico._filters is None
+    controller.set_controller(on=True, setpoint=60.0, Kp=3.0, Ki=0.2, Kd=0.0)
+    assert pico._filters is not None
+    assert controller._filter is None
+    results = list(run(controller, clock, duration_s=60.0))
+    assert results[-1].values["fan"] > 0.0
+    controller.set_controller(on=False)
+    assert pico._filters is None
+    assert controller._filter is not None
+    controller.close()
+
+
+def test_schedule_columns_reset_when_finished(tmp_path):
+    controller, pico, clock = make_controller(tmp_path)
+    filename = tmp_path / "profile.json"
+    filename.write_text(json.dumps({"segments": [{"ramp": 70.0, "duration_s": 30}, {"step": 65.0}]}))
+    controller.set_controller(on=True, setpoint=60.0, Kp=3.0, Ki=0.2, Kd=0.0)
+    controller.start_schedule(filename)
+    results = list(run(controller, clock, duration_s=60.0))
+    assert results[10].values["schedule_segment"] == 1
+    assert results[10].values["set_humi_pRH"] == pytest.approx(60.0 + 10.0 * 10 / 30)
+    assert controller.schedule is None
+    assert results[-1].values["schedule_segment"] == 0
+    assert results[-1].values["schedule_progress"] == 0.0
+    assert results[-1].values["set_humi_pRH"] == 65.0
+    controller.close()
+
+
+def test_pico_base_is_abstract():
+    with pytest.raises(TypeError):
+        PicoBase()
+
+    class Incomplete(PicoBase):
+        def get_status(self) -> dict:
+            return {}
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+@pytest.mark.parametrize("autonomous", [False, True])
+def test_closed_loop_reaches_the_setpoint(tmp_path, autonomous):
+    controller, pico, clock = make_controller(tmp_path, autonomous=autonomous)
+    controller.set_controller(on=True, setpoint=60.0, Kp=3.0, Ki=0.2, Kd=0.0)
+    results = list(run(controller, clock, duration_s=3600.0))
+    assert len(results) == 3600
+    assert results[-1].values["time_s"] == 3599
+    # Started at the ambient humidity
+    assert results[0].values["humi_humi_pRH"] == pytest.approx(45.0, abs=1.0)
+    for result in results[-600:]:
+        assert result.values["humi_humi_pRH"] == pytest.approx(60.0, abs=1.5)
+        assert 10.0 <= result.values["fan"] <= 100.0
+    controller.set_controller(on=False)
+    # Host mode: 'step()' applies the output of the previous tick
+    controller.tick()
+    controller.tick()
+    assert pico.model.fan_hum_intensity == 0.0
+    controller.close()
+    # The log was written
+    assert len(controller.filename_log.read_text().splitlines()) == 1 + 3602
+
+
+def test_simulator_runs_the_pid_of_the_pico(tmp_path):
+    controller, pico, clock = make_controller(tmp_path)
+    with pytest.raises(RuntimeError):
+        pico.supervise()
+    pico.start_autonomous(setpoint=60.0, Kp=3.0, Ki=0.2, Kd=0.0)
+    assert type(pico._pid).__module__ == "pid"
+    clock.advance(10.0)
+    telemetry = pico.supervise(Kp=2.0)
+    assert pico._pid.Kp == 2.0
+    assert telemetry["ticks"] == 10
+    assert telemetry["fan"] > 10.0
+    pico.stop_autonomous()
+    controller.close()
+
+
+def test_host_filter_restarts_when_switched_on(tmp_path):
+    controller, pico, clock = make_controller(tmp_path)
+    controller.set_filter(FILTER)
+    controller.set_controller(on=True, setpoint=80.0, Kp=3.0, Ki=0.2, Kd=5.0)
+    list(run(controller, clock, duration_s=1800.0))
+    humi_on_pRH = controller._filter.stages[-1].x
+    controller.set_controller(on=False)
+    list(run(controller, clock, duration_s=3600.0))
+    assert pico.model.humi_pRH < humi_on_pRH - 20.0
+    controller.set_controller(on=True, setpoint=80.0, Kp=3.0, Ki=0.2, Kd=5.0)
+    result = controller.tick()
+    # The filter starts from the humidity now: no rate from the old value into the derivative
+    assert controller._filter.stages[-1].x == pytest.approx(result.values["humi_humi_pRH"], abs=0.5)
+    assert controller._filter.rate == 0.0
+    assert controller.pid.derivative == 0.0
+    controller.close()
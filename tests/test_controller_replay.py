@@ -0,0 +1,43 @@
+import random
+
+import pytest
+
+from controller_replay import TOLERANCE_PERCENT, ReplayClock, ReplayPico, load_rows, replay
+from humidity_controller_2022 import Controller
+from pico_simulator import ChamberModel, PicoSimulator, SimulatedClock
+
+GAINS = dict(Kp=3.0, Ki=0.2, Kd=0.0)
+
+
+def record(tmp_path, jitter_s: float):
+    "A simulated run: returns the binary log"
+    clock = SimulatedClock()
+    pico = PicoSimulator(model=ChamberModel(seed=1), clock=clock)
+    controller = Controller(pico=pico, filename_log=tmp_path / "run.txt", clock=clock)
+    controller.set_controller(on=True, setpoint=60.0, **GAINS)
+    jitter = random.Random(3)
+    for _ in range(1800):
+        controller.tick()
+        clock.advance(1.0 + jitter.uniform(-jitter_s, jitter_s))
+    controller.close()
+    return controller.filename_log.with_suffix(".bin")
+
+
+def max_difference(tmp_path, filename) -> float:
+    clock = ReplayClock()
+    pico = ReplayPico()
+    controller = Controller(pico=pico, filename_log=tmp_path / "replay.txt", clock=clock)
+    controller.timing.enabled = False
+    diffs = [abs(result.values["fan"] - row["fan"]) for row, result in replay(controller, clock, pico, load_rows([filename]), **GAINS)]
+    controller.close()
+    assert len(diffs) == 1800
+    return max(diffs)
+
+
+def test_replay_of_whole_seconds_is_exact(tmp_path):
+    assert max_difference(tmp_path, record(tmp_path, jitter_s=0.0)) == pytest.approx(0.0, abs=1e-9)
+
+
+def test_replay_with_jitter_within_tolerance(tmp_path):
+    # 'time_s' is truncated to seconds: the integral term differs slightly
+    assert 0.0 < max_difference(tmp_path, record(tmp_path, jitter_s=0.05)) <= TOLERANCE_PERCENT[".bin"]
@@ -0,0 +1,133 @@
+import pathlib
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import datafile_csv
+
+
+def write_log(tmp_path, monkeypatch, rows: int = 50, **kwargs):
+    "A row every 10s, the epoch (time.time()) starts at 1000000"
+    epoch = [0.0]
+    monkeypatch.setattr(datafile_csv.time, "time", lambda: epoch[0])
+    filename = tmp_path / "controller_x.txt"
+    csv = datafile_csv.Csv(filename, flush_rows=4, **kwargs)
+    for i in range(rows):
+        epoch[0] = 1000000.0 + 10.0 * i
+        csv.time_s = 10 * i
+        csv.humi_humi_pRH = float(i)
+        csv.write()
+    csv.close()
+    return filename.with_suffix(".idx")
+
+
+def test_query_all(tmp_path, monkeypatch):
+    filename_index = write_log(tmp_path, monkeypatch)
+    rows = list(datafile_csv.query(filename_index, 0.0, 2e6))
+    assert [row["humi_humi_pRH"] for row in rows] == [float(i) for i in range(50)]
+    assert [row["epoch_s"] for row in rows] == [1000000.0 + 10.0 * i for i in range(50)]
+
+
+def test_query_range(tmp_path, monkeypatch):
+    filename_index = write_log(tmp_path, monkeypatch)
+    rows = list(datafile_csv.query(filename_index, 1000095.0, 1000200.0))
+    assert [row["time_s"] for row in rows] == [float(t) for t in range(100, 201, 10)]
+    assert list(datafile_csv.query(filename_index, 0.0, 999999.0)) == []
+
+
+def test_query_over_segments(tmp_path, monkeypatch):
+    filename_index = write_log(tmp_path, monkeypatch, max_bytes=400)
+    assert (tmp_path / "controller_x_001.txt").exists()
+    rows = list(datafile_csv.query(filename_index, 1000000.0, 1000490.0))
+    assert [row["humi_humi_pRH"] for row in rows] == [float(i) for i in range(50)]
+
+
+def test_binary_log(tmp_path):
+    filename = tmp_path / "controller_x.txt"
+    csv = datafile_csv.Csv(filename, flush_rows=7, filename_binary=filename.with_suffix(".bin"))
+    for i in range(50):
+        csv.time_s = i
+        # Exact in the text log: 'fan' has no decimals, the humidity one
+        csv.fan = float(i % 20)
+        csv.humi_humi_pRH = 40.0 + 0.5 * i
+        csv.humi_temp_C = 25.0 - 0.1 * (i % 3)
+        csv.write()
+    csv.close()
+    rows = datafile_csv.read_binary(filename.with_suffix(".bin"))
+    assert isinstance(rows, np.memmap)
+    assert len(rows) == 50
+    assert rows["time_s"].tolist() == list(range(50))
+    assert rows["fan"].tolist() == [float(i % 20) for i in range(50)]
+    assert rows["humi_humi_pRH"].tolist() == [40.0 + 0.5 * i for i in range(50)]
+
+    converted = datafile_csv.read_binary(datafile_csv.convert_text_log(filename, tmp_path / "converted.bin"))
+    assert converted.dtype == rows.dtype
+    for name in rows.dtype.names:
+        assert converted[name].tolist() == pytest.approx(rows[name].tolist(), abs=1e-9)
+
+
+def test_binary_log_partial_record(tmp_path):
+    filename = tmp_path / "x.bin"
+    binary = datafile_csv.BinaryLog(filename, ["time_s", "fan"], ["<i4", "<f8"])
+    binary.write((1, 10.0))
+    binary.write((2, 20.0))
+    binary.close()
+    # A record cut by a crash
+    with filename.open("ab") as f:
+        f.write(b"\x03\x00")
+    rows = datafile_csv.read_binary(filename)
+    assert rows["fan"].tolist() == [10.0, 20.0]
+
+
+def test_read_binary_rejects_text(tmp_path):
+    filename = tmp_path / "x.bin"
+    filename.write_bytes(b"time_s\tfan\r\n")
+    with pytest.raises(ValueError):
+        datafile_csv.read_binary(filename)
+
+
+def data_lines(filename) -> int:
+    "The rows on disk, without the header"
+    return len(filename.read_text().splitlines()) - 1
+
+
+def test_rows_buffered(tmp_path, monkeypatch):
+    now_s = [0.0]
+    monkeypatch.setattr(datafile_csv.time, "monotonic", lambda: now_s[0])
+    filename = tmp_path / "controller_x.txt"
+    csv = datafile_csv.Csv(filename, flush_rows=5, flush_interval_s=10.0)
+    for _ in range(4):
+        csv.write()
+        now_s[0] += 1.0
+    assert data_lines(filename) == 0
+    # flush_rows reached
+    csv.write()
+    assert data_lines(filename) == 5
+    # flush_interval_s reached
+    csv.write()
+    now_s[0] += 9.0
+    csv.write()
+    assert data_lines(filename) == 5
+    now_s[0] += 1.0
+    csv.write()
+    assert data_lines(filename) == 8
+    # Pending rows are written on close()
+    csv.write()
+    assert data_lines(filename) == 8
+    csv.close()
+    assert data_lines(filename) == 9
+
+
+def test_rows_written_at_exit(tmp_path):
+    filename = tmp_path / "controller_x.txt"
+    script = (
+        "import pathlib, datafile_csv\n"
+        f"csv = datafile_csv.Csv(pathlib.Path({str(filename)!r}), flush_rows=100)\n"
+        "csv.write()\n"
+        "csv.write()\n"
+    )
+    directory = pathlib.Path(__file__).absolute().parent.parent
+    subprocess.run([sys.executable, "-c", script], cwd=directory, check=True)
+    assert data_lines(filename) == 2
@@ -0,0 +1,72 @@
+import pytest
+
+from humidity_controller_2022_gui import LogView, read_lines_before
+
+
+def write_lines(filename, first: int, n: int):
+    filename.write_bytes(b"".join(f"line {i}\r\n".encode() for i in range(first, first + n)))
+
+
+@pytest.mark.parametrize("chunk_size", [7, 65536])
+def test_read_lines_before_pages_to_the_start(tmp_path, chunk_size):
+    filename = tmp_path / "log.txt"
+    write_lines(filename, 0, 100)
+    pages = []
+    offset = None
+    while offset != 0:
+        lines, offset = read_lines_before(filename, offset, 30, chunk_size=chunk_size)
+        pages.append(lines)
+    assert [len(page) for page in pages] == [30, 30, 30, 10]
+    assert pages[0][0] == "line 70\r\n"
+    assert pages[0][-1] == "line 99\r\n"
+    assert [line for page in reversed(pages) for line in page] == [f"line {i}\r\n" for i in range(100)]
+
+
+class FakeText:
+    "The lines from the log file shown below the live lines"
+
+    def __init__(self):
+        self.older = ""
+
+    def delete(self, first, last):
+        self.older = ""
+
+    def insert(self, index, text):
+        self.older = text
+
+    def see(self, index):
+        pass
+
+
+def log_view(max_lines: int) -> LogView:
+    "Without the widgets"
+    view = LogView.__new__(LogView)
+    view.max_lines = max_lines
+    view._lines_live = 0
+    view._filename = None
+    view._offset_older = None
+    view._text = FakeText()
+    return view
+
+
+def test_log_view_pages_the_new_file_after_rotation(tmp_path):
+    filename = tmp_path / "controller_x.txt"
+    filename_rotated = tmp_path / "controller_x_001.txt"
+    write_lines(filename, 0, 100)
+    view = log_view(max_lines=30)
+    view.set_filename(filename)
+    view.older()
+    view.older()
+    assert view._text.older.splitlines()[1] == "line 69"
+    # Unchanged file: paging continues
+    view.set_filename(filename)
+    view.older()
+    assert view._text.older.splitlines()[1] == "line 39"
+
+    write_lines(filename_rotated, 100, 50)
+    view.set_filename(filename_rotated)
+    view.older()
+    lines = view._text.older.splitlines()
+    assert lines[0] == "--- controller_x_001.txt ---"
+    assert lines[1] == "line 149"
+    assert lines[-1] == "line 120"
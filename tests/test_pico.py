@@ -0,0 +1,250 @@
+import time
+import types
+
+import pytest
+
+import humidity_controller_2022
+import micropython_deploy
+from humidity_controller_2022 import HardwareWorker, Pico, PicoError, TelemetryStream, TickResult
+
+
+class FakePyboardError(BaseException):
+    "'mp.pyboard.PyboardError'"
+
+
+@pytest.fixture(autouse=True)
+def connection_errors(monkeypatch):
+    # mpfshell2 is not installed for the tests
+    monkeypatch.setattr(humidity_controller_2022, "CONNECTION_ERRORS", (OSError, FakePyboardError))
+
+
+def device_exception(message: str) -> FakePyboardError:
+    "As 'Pyboard.exec_()' raises it for an exception on the pico"
+    traceback = f"Traceback (most recent call last):\r\n  File \"<stdin>\", line 1, in <module>\r\n{message}\r\n"
+    return FakePyboardError("exception", b"", traceback.encode("utf-8"))
+
+
+class FakeFileExplorer:
+    "Like 'MpFileExplorer': 'eval()' returns what the pico prints"
+
+    def __init__(self):
+        self.files = {}
+
+    def eval(self, expression: str) -> bytes:
+        filename = micropython_deploy.FILENAME_MANIFEST
+        assert expression == f"open({filename!r}).read()"
+        if filename not in self.files:
+            raise device_exception("OSError: [Errno 2] ENOENT")
+        return self.files[filename].encode("utf-8")
+
+
+class FakeShell:
+    def __init__(self, fe: FakeFileExplorer):
+        self.fe = fe
+        self.syncs = 0
+
+    def sync_folder(self, directory):
+        self.syncs += 1
+        for f in directory.iterdir():
+            self.fe.files[f.name] = f.read_text(errors="replace")
+
+
+def test_sync_skipped_if_manifest_unchanged():
+    fe = FakeFileExplorer()
+    pico = Pico(fe=fe)
+    pico.shell = FakeShell(fe)
+    pico._sync()
+    assert pico.shell.syncs == 1
+    # The manifest is on the pico now: as after a restart or a reconnect
+    pico._sync()
+    pico._sync()
+    assert pico.shell.syncs == 1
+
+
+def test_sync_if_manifest_differs():
+    fe = FakeFileExplorer()
+    fe.files[micropython_deploy.FILENAME_MANIFEST] = "0123abcd\n"
+    pico = Pico(fe=fe)
+    pico.shell = FakeShell(fe)
+    pico._sync()
+    assert pico.shell.syncs == 1
+
+
+class RaisingFileExplorer:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+    def eval(self, expression: str) -> bytes:
+        raise self.exception
+
+
+def test_device_exception_is_a_pico_error():
+    pico = Pico(fe=RaisingFileExplorer(device_exception("OSError: [Errno 19] ENODEV")))
+    with pytest.raises(PicoError, match="ENODEV"):
+        pico.get_measurement()
+
+
+@pytest.mark.parametrize("exception", [FakePyboardError("could not enter raw repl"), OSError("port closed")])
+def test_transport_error_is_a_connection_error(exception):
+    pico = Pico(fe=RaisingFileExplorer(exception))
+    with pytest.raises(type(exception)):
+        pico.get_measurement()
+
+
+@pytest.mark.parametrize("exception, reconnects", [(PicoError("ENODEV"), 0), (OSError("port closed"), 1)])
+def test_worker_reconnects_on_connection_errors_only(exception, reconnects):
+    calls = {"tick": 0, "reconnect": 0}
+
+    def tick():
+        calls["tick"] += 1
+        if calls["tick"] == 1:
+            raise exception
+        return TickResult(text="", values={})
+
+    def reconnect():
+        calls["reconnect"] += 1
+
+    controller = types.SimpleNamespace(timing=types.SimpleNamespace(), tick=tick, reconnect=reconnect)
+    worker = HardwareWorker(controller, interval_ms=10)
+    worker.start()
+    time.sleep(0.1)
+    worker.stop()
+    assert calls["tick"] > 1
+    assert calls["reconnect"] == reconnects
+    assert worker.results.get_nowait().text.startswith("ERROR")
+
+
+def test_prepare_once_per_process(monkeypatch, tmp_path):
+    prepares = []
+
+    def prepare(mpy: bool = False):
+        prepares.append(mpy)
+        directory = tmp_path / ("mpy" if mpy else "py")
+        directory.mkdir()
+        (directory / micropython_deploy.FILENAME_MANIFEST).write_text("0123abcd\n")
+        return directory
+
+    monkeypatch.setattr(micropython_deploy, "prepare", prepare)
+    monkeypatch.setattr(micropython_deploy, "_prepared", {})
+    for _ in range(2):
+        # Two chambers
+        fe = FakeFileExplorer()
+        pico = Pico(fe=fe)
+        pico.shell = FakeShell(fe)
+        pico._sync()
+        pico._sync()
+        assert pico.shell.syncs == 1
+    assert prepares == [False]
+
+
+class RecordingFileExplorer:
+    "Records the expressions evaluated, 'step()' returns a measurement"
+
+    def __init__(self):
+        self.expressions = []
+
+    def eval(self, expression: str) -> bytes:
+        self.expressions.append(expression)
+        if expression.startswith("micropython_logic.step("):
+            return b"{'humi_temp_C': 25.0, 'humi_humi_pRH': 50.0, 'stage_temp_C': 25.0, 'stage_humi_pRH': 50.0}"
+        return b"None"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now_s = [1000.0]
+    monkeypatch.setattr(humidity_controller_2022.time, "monotonic", lambda: now_s[0])
+    return now_s
+
+
+def test_step_suppresses_unchanged_writes(clock):
+    fe = RecordingFileExplorer()
+    pico = Pico(fe=fe)
+    for _ in range(4):
+        pico.step(fan_hum_intensity=40.0, color=(0, 100, 0))
+    assert fe.expressions[0] == "micropython_logic.step(40.00, color=(0,100,0), average_n = 1)"
+    assert fe.expressions[1:] == ["micropython_logic.step(None, color=None, average_n = 1)"] * 3
+    assert pico.writes_suppressed == 6
+
+
+def test_step_deadband(clock):
+    fe = RecordingFileExplorer()
+    pico = Pico(fe=fe)
+    pico.step(fan_hum_intensity=40.0)
+    # Below the resolution of the pwm
+    pico.step(fan_hum_intensity=40.0 + humidity_controller_2022.FAN_DEADBAND_PERCENT / 2.0)
+    pico.step(fan_hum_intensity=41.0)
+    assert [e.split(",")[0] for e in fe.expressions] == [
+        "micropython_logic.step(40.00",
+        "micropython_logic.step(None",
+        "micropython_logic.step(41.00",
+    ]
+
+
+def test_step_resync_after_interval(clock):
+    fe = RecordingFileExplorer()
+    pico = Pico(fe=fe)
+    pico.step(fan_hum_intensity=40.0, color=(0, 100, 0))
+    clock[0] += humidity_controller_2022.RESYNC_INTERVAL_S / 2.0
+    pico.step(fan_hum_intensity=40.0, color=(0, 100, 0))
+    clock[0] += humidity_controller_2022.RESYNC_INTERVAL_S
+    pico.step(fan_hum_intensity=40.0, color=(0, 100, 0))
+    assert fe.expressions[1] == "micropython_logic.step(None, color=None, average_n = 1)"
+    # Written again: the pico may have been reset without the host noticing
+    assert fe.expressions[2] == fe.expressions[0]
+
+
+def test_reconnect_writes_the_state_again(clock):
+    fe = RecordingFileExplorer()
+    pico = Pico(fe=fe)
+    pico.set_fan_circ_intensity(45.0)
+    pico.step(fan_hum_intensity=40.0, color=(0, 100, 0))
+    fe.expressions.clear()
+    pico.reconnect()
+    assert sorted(fe.expressions) == [
+        "micropython_logic.leds(color=(0,100,0))",
+        "micropython_logic.set_fan_circ_intensity(45.00)",
+        "micropython_logic.set_fan_hum_intensity(40.00)",
+    ]
+    fe.expressions.clear()
+    pico.step(fan_hum_intensity=40.0, color=(0, 100, 0))
+    assert fe.expressions == ["micropython_logic.step(None, color=None, average_n = 1)"]
+    pico.step(fan_hum_intensity=20.0, color=(0, 100, 0))
+    assert fe.expressions[-1] == "micropython_logic.step(20.00, color=None, average_n = 1)"
+
+
+class FakeSerial:
+    "Returns 'data' in chunks of 'chunk' bytes, then stops the stream"
+
+    def __init__(self, data: bytes, chunk: int = 7):
+        self.chunks = [data[i : i + chunk] for i in range(0, len(data), chunk)]
+        self.stream = None
+
+    def inWaiting(self) -> int:
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size: int) -> bytes:
+        if not self.chunks:
+            self.stream._stop.set()
+            return b""
+        return self.chunks.pop(0)
+
+
+def telemetry_frame(seq: int) -> bytes:
+    frame = TelemetryStream.FRAME.pack(TelemetryStream.FRAME_MAGIC, seq, 1000 * seq, 25.0, 50.0 + seq, 25.5, 49.0)
+    return frame + bytes([sum(frame) & 0xFF])
+
+
+def test_telemetry_stream_resyncs():
+    data = b"\x00\x13garbage>" + b"".join(telemetry_frame(seq) for seq in range(5))
+    # Frame 5 truncated, 6 and 7 lost
+    data += telemetry_frame(5)[:10] + telemetry_frame(8)
+    con = FakeSerial(data)
+    pico = Pico(fe=types.SimpleNamespace(con=con))
+    stream = TelemetryStream(pico)
+    con.stream = stream
+    stream._run()
+    assert [frame.seq for frame in stream.frames] == [0, 1, 2, 3, 4, 8]
+    assert stream.latest.humi_humi_pRH == 58.0
+    assert stream.frames_lost == 3
+    assert stream.checksum_errors == 1
@@ -0,0 +1,44 @@
+import math
+
+import pytest
+
+import pid_tuning
+import simple_pid
+
+
+def open_loop_log(delay: int, a: float = 0.95, gain_pRH: float = 0.4, offset_pRH: float = 40.0) -> dict:
+    "y[k+1] = a*y[k] + (1-a)*(offset + gain*u[k-delay]), fan steps every 200 samples"
+    fans = [20.0 + 60.0 * ((k // 200) % 2) for k in range(2000)]
+    y = [offset_pRH + gain_pRH * fans[0]]
+    for k in range(len(fans) - 1):
+        u = fans[k - delay] if k >= delay else fans[0]
+        y.append(a * y[k] + (1.0 - a) * (offset_pRH + gain_pRH * u))
+    return {"time_s": [float(k) for k in range(len(fans))], "fan": fans, "humi_humi_pRH": y}
+
+
+@pytest.mark.parametrize("delay", [0, 3])
+def test_fit_fopdt(delay):
+    model = pid_tuning.fit_fopdt([open_loop_log(delay)])
+    assert model.dead_time_s == pytest.approx(delay * model.dt_s)
+    assert model.gain_pRH == pytest.approx(0.4, rel=1e-3)
+    assert model.tau_s == pytest.approx(-1.0 / math.log(0.95), rel=1e-3)
+
+
+@pytest.mark.parametrize("delay", [0, 3])
+def test_simulate_closed_loop_models_the_dead_time_and_the_tick_delay(delay):
+    model = pid_tuning.FopdtModel(gain_pRH=0.4, tau_s=20.0, dead_time_s=float(delay), offset_pRH=40.0, dt_s=1.0)
+    result = pid_tuning.simulate_closed_loop(model, Kp=2.0, Ki=0.1, Kd=0.0, setpoint_pRH=60.0, start_pRH=50.0, duration_s=300.0)
+
+    # Reference: y[k+1] = a*y[k] + (1-a)*(offset + gain*u[k-delay]) with u[k] = pid(y[k-1]):
+    # the controller applies its output one tick later
+    pid = simple_pid.PID(Kp=2.0, Ki=0.1, Kd=0.0, setpoint=60.0, sample_time=pid_tuning.SAMPLE_TIME_S, output_limits=pid_tuning.OUTPUT_LIMITS)
+    a = math.exp(-1.0 / 20.0)
+    y = 50.0
+    fans = []
+    iae = 0.0
+    for k in range(300):
+        fans.append(pid(y, dt=1.0))
+        u = fans[k - delay - 1] if k >= delay + 1 else 0.0
+        y = a * y + (1.0 - a) * (40.0 + 0.4 * u)
+        iae += abs(60.0 - y)
+    assert result["iae"] == pytest.approx(iae)
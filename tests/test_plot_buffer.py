@@ -0,0 +1,38 @@
+import numpy as np
+
+from plot_buffer import MinMaxRing
+
+
+def test_level_0_holds_the_samples():
+    ring = MinMaxRing(["a", "b"], capacity=16, factor=4, levels=3)
+    for i in range(10):
+        ring.append(float(i), [i, -i])
+    assert len(ring) == 10
+    time_s, v_min, v_max = ring.window(2.0, 5.0, max_points=100)
+    assert time_s.tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert v_min[:, 0].tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert v_max[:, 1].tolist() == [-2.0, -3.0, -4.0, -5.0]
+
+
+def test_coarser_level_keeps_min_and_max():
+    ring = MinMaxRing(["a"], capacity=16, factor=4, levels=3)
+    values = [0.0, 5.0, -3.0, 1.0] * 25
+    for i, value in enumerate(values):
+        ring.append(float(i), [value])
+    # Level 0 holds 84..99: level 1 (4 samples per point, 36..96) covers the window
+    time_s, v_min, v_max = ring.window(40.0, 99.0, max_points=1000)
+    assert time_s.tolist() == [40.0 + 4.0 * i for i in range(15)]
+    assert np.all(v_min[:, 0] == -3.0)
+    assert np.all(v_max[:, 0] == 5.0)
+    # Level 1 has overwritten the beginning: level 2 (16 samples per point)
+    time_s, v_min, v_max = ring.window(0.0, 99.0, max_points=1000)
+    assert time_s.tolist() == [0.0, 16.0, 32.0, 48.0, 64.0, 80.0]
+    assert np.all(v_min[:, 0] == -3.0)
+    assert np.all(v_max[:, 0] == 5.0)
+
+
+def test_empty():
+    ring = MinMaxRing(["a", "b"])
+    time_s, v_min, v_max = ring.window(0.0, 1.0, max_points=10)
+    assert len(time_s) == 0
+    assert v_min.shape == (0, 2)
@@ -0,0 +1,57 @@
+import pytest
+
+from setpoint_schedule import Schedule
+
+PROFILE = {
+    "segments": [
+        {"ramp": 80.0, "duration_s": 100},
+        {"hold_s": 50},
+        {"step": 60.0},
+        {"cycle": [{"ramp": 40.0, "duration_s": 10}, {"ramp": 60.0, "duration_s": 10}], "repeat": 3},
+    ]
+}
+
+
+def test_cycle_expansion():
+    schedule = Schedule.from_profile(PROFILE, start_pRH=50.0)
+    assert schedule.times_s == [0.0, 100.0, 150.0, 150.0, 160.0, 170.0, 180.0, 190.0, 200.0, 210.0]
+    assert schedule.setpoints_pRH == [50.0, 80.0, 80.0, 60.0, 40.0, 60.0, 40.0, 60.0, 40.0, 60.0]
+    assert schedule.segments == list(range(10))
+    assert schedule.duration_s == 210.0
+
+
+def test_step_has_zero_length():
+    schedule = Schedule.from_profile(PROFILE, start_pRH=50.0)
+    assert schedule.setpoint(149.999) == pytest.approx(80.0)
+    # The step and the following ramp start at 150s
+    assert schedule.setpoint(150.0) == 60.0
+    assert schedule.segment(150.0) == 4
+    assert schedule.setpoint(155.0) == pytest.approx(50.0)
+
+
+def test_start_from_profile():
+    schedule = Schedule.from_profile({"start": 30.0, "segments": [{"hold_s": 10}]}, start_pRH=50.0)
+    assert schedule.setpoint(5.0) == 30.0
+
+
+def test_cursor_seeking():
+    schedule = Schedule.from_profile(PROFILE, start_pRH=50.0)
+    assert schedule.setpoint(50.0) == pytest.approx(65.0)
+    assert schedule.segment(120.0) == 2
+    assert schedule.setpoint(205.0) == pytest.approx(50.0)
+    # The time goes back: the cursor searches
+    assert schedule.setpoint(25.0) == pytest.approx(57.5)
+    assert schedule.segment(25.0) == 1
+    # After the end
+    assert schedule.setpoint(1000.0) == 60.0
+    assert schedule.segment(1000.0) == 9
+    assert schedule.finished(210.0)
+    assert not schedule.finished(209.0)
+    assert schedule.progress(105.0) == pytest.approx(0.5)
+
+
+def test_invalid_segments():
+    with pytest.raises(ValueError):
+        Schedule.from_profile({"segments": [{"hold_s": -1}]}, start_pRH=50.0)
+    with pytest.raises(ValueError):
+        Schedule.from_profile({"segments": [{"unknown": 1}]}, start_pRH=50.0)
@@ -0,0 +1,150 @@
+"""
+'src_micropython/sht31.py' on the host: 'machine', 'micropython' and the
+micropython builtins are replaced by fakes.
+"""
+import builtins
+import collections
+import importlib.util
+import pathlib
+import sys
+import time
+import types
+
+import pytest
+
+DIRECTORY_SRC_MICROPYTHON = pathlib.Path(__file__).absolute().parent.parent / "src_micropython"
+ADDR_A = 0x45
+ADDR_B = 0x44
+
+
+class FakeI2C:
+    "'readfrom_into()' returns the next response queued for the address: bytes or an exception"
+
+    responses = collections.defaultdict(collections.deque)
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def writeto(self, addr, buf):
+        pass
+
+    def readfrom_into(self, addr, buf):
+        response = self.responses[addr].popleft()
+        if isinstance(response, Exception):
+            raise response
+        buf[:] = response
+
+
+def crc8_reference(data: bytes) -> int:
+    "Datasheet 4.12: polynomial 0x31, init 0xff, bitwise"
+    crc = 0xFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def frame(raw_t: int, raw_h: int, crc_ok: bool = True) -> bytes:
+    t = raw_t.to_bytes(2, "big")
+    h = raw_h.to_bytes(2, "big")
+    crc_t = crc8_reference(t)
+    if not crc_ok:
+        crc_t ^= 0xFF
+    return t + bytes([crc_t]) + h + bytes([crc8_reference(h)])
+
+
+@pytest.fixture
+def sht31(monkeypatch):
+    machine = types.ModuleType("machine")
+    machine.I2C = FakeI2C
+    machine.Pin = lambda *args, **kwargs: None
+    micropython = types.ModuleType("micropython")
+    micropython.native = lambda function: function
+    micropython.viper = lambda function: function
+    monkeypatch.setitem(sys.modules, "machine", machine)
+    monkeypatch.setitem(sys.modules, "micropython", micropython)
+    monkeypatch.setattr(builtins, "const", lambda value: value, raising=False)
+    monkeypatch.setattr(builtins, "ptr8", lambda buf: buf, raising=False)
+    ticks = [0]
+    monkeypatch.setattr(time, "sleep_ms", lambda ms: None, raising=False)
+    monkeypatch.setattr(time, "ticks_ms", lambda: ticks[0], raising=False)
+    monkeypatch.setattr(time, "ticks_diff", lambda a, b: a - b, raising=False)
+    monkeypatch.setattr(sys, "path", [str(DIRECTORY_SRC_MICROPYTHON)] + sys.path)
+    FakeI2C.responses.clear()
+
+    spec = importlib.util.spec_from_file_location("sht31", DIRECTORY_SRC_MICROPYTHON / "sht31.py")
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, "sht31", module)
+    spec.loader.exec_module(module)
+    module.ticks = ticks
+    return module
+
+
+def test_crc8_table(sht31):
+    assert len(sht31._CRC8_TABLE) == 256
+    for i in range(256):
+        # crc8 starts with 0xff: the table entry i is the crc of the byte i ^ 0xff
+        assert sht31._CRC8_TABLE[i] == crc8_reference(bytes([i ^ 0xFF]))
+    # Datasheet example: 0xbeef -> 0x92
+    assert sht31.crc8(b"\xbe\xef\x92", 0, 2) == 0x92
+
+
+def test_periodic_crc_error_on_b_keeps_a(sht31):
+    sensors = sht31.sensors
+    sensors.start_periodic()
+    FakeI2C.responses[ADDR_A].append(frame(26000, 30000))
+    FakeI2C.responses[ADDR_B].append(frame(26000, 40000, crc_ok=False))
+    sensors.measure(average_n=1)
+    assert sensors.humidity_percent_a == pytest.approx(100.0 * 30000 / 65535)
+    assert sensors.humidity_percent_b == 0.0
+    assert sensors.discard_count == 1
+
+    # B without a new result (NACK), A averaged over the last 2 results
+    FakeI2C.responses[ADDR_A].append(frame(26000, 32000))
+    FakeI2C.responses[ADDR_B].append(OSError("ENODEV"))
+    sensors.measure(average_n=2)
+    assert sensors.humidity_percent_a == pytest.approx(100.0 * 31000 / 65535)
+    assert sensors.humidity_percent_b == 0.0
+
+
+def test_filter_only_fresh_samples(sht31):
+    sensors = sht31.sensors
+    sensors.set_filter("median:3")
+    # The first read of a fails: the pipeline is not seeded with the initial 0.0
+    FakeI2C.responses[ADDR_A].append(OSError("ENODEV"))
+    FakeI2C.responses[ADDR_B].append(frame(26000, 40000))
+    assert not sensors.collect()
+    assert sensors.filters[1].stages[0]._values == []
+    assert len(sensors.filters[3].stages[0]._values) == 1
+
+    FakeI2C.responses[ADDR_A].append(frame(26000, 30000))
+    FakeI2C.responses[ADDR_B].append(OSError("ENODEV"))
+    sht31.ticks[0] += 1000
+    assert not sensors.collect()
+    humidity_a = sensors.humidity_percent_a
+    assert humidity_a == pytest.approx(100.0 * 30000 / 65535)
+    # b kept its value and was not fed again
+    assert len(sensors.filters[3].stages[0]._values) == 1
+
+    # Single shot: all samples of a discarded, the kept value is not fed again
+    FakeI2C.responses[ADDR_A].extend([frame(26000, 30000, crc_ok=False)] * 3)
+    FakeI2C.responses[ADDR_B].append(frame(26000, 40000))
+    sht31.ticks[0] += 1000
+    sensors.measure(average_n=1)
+    assert sensors.humidity_percent_a == humidity_a
+    assert len(sensors.filters[1].stages[0]._values) == 1
+    assert len(sensors.filters[3].stages[0]._values) == 2
+
+
+def test_single_shot_retries_on_nack(sht31):
+    sensors = sht31.sensors
+    # a: not finished converting (NACK), then the result. b: absent.
+    FakeI2C.responses[ADDR_A].extend([OSError("ENODEV"), frame(26000, 30000)])
+    FakeI2C.responses[ADDR_B].extend([OSError("ENODEV")] * 3)
+    sensors.measure(average_n=1)
+    assert sensors.humidity_percent_a == pytest.approx(100.0 * 30000 / 65535)
+    # b keeps its previous values
+    assert sensors.humidity_percent_b == 0.0
+    assert sensors.retry_count == 1 + 2
+    assert sensors.discard_count == 1
@@ -0,0 +1,95 @@
+import random
+
+import numpy as np
+import pytest
+
+import simple_pid
+
+
+def random_series(n: int = 500, seed: int = 1):
+    r = random.Random(seed)
+    inputs = [50.0 + 20.0 * r.random() for _ in range(n)]
+    dts = [r.choice([0.1, 0.5, 1.0, 1.3]) for _ in range(n)]
+    rates = [r.random() - 0.5 for _ in range(n)]
+    return inputs, dts, rates
+
+
+def make_pid(**kwargs):
+    return simple_pid.PID(Kp=3.0, Ki=0.2, Kd=0.5, setpoint=60.0, output_limits=(10.0, 100.0), clock=lambda: 0.0, **kwargs)
+
+
+@pytest.mark.parametrize("sample_time", [None, 0.6])
+@pytest.mark.parametrize("proportional_on_measurement", [False, True])
+@pytest.mark.parametrize("with_rates", [False, True])
+def test_simulate_equals_scalar(sample_time, proportional_on_measurement, with_rates):
+    inputs, dts, rates = random_series()
+    if not with_rates:
+        rates = None
+    scalar = make_pid(sample_time=sample_time, proportional_on_measurement=proportional_on_measurement)
+    vector = make_pid(sample_time=sample_time, proportional_on_measurement=proportional_on_measurement)
+    outputs = []
+    components = []
+    for k, (input_, dt) in enumerate(zip(inputs, dts)):
+        outputs.append(scalar(input_, dt=dt, input_rate=None if rates is None else rates[k]))
+        components.append(scalar.components)
+    output, proportional, integral, derivative = vector.simulate(inputs, dts, rates)
+    assert output.tolist() == outputs
+    assert np.column_stack([proportional, integral, derivative]).tolist() == [list(c) for c in components]
+    # The state at the end
+    assert vector.components == scalar.components
+    assert (vector._last_time, vector._last_dt) == (scalar._last_time, scalar._last_dt)
+    assert vector(55.0, dt=1.0) == scalar(55.0, dt=1.0)
+
+
+def test_simulate_gains_equals_simulate():
+    inputs, dts, rates = random_series()
+    Kp = [0.5, 3.0, 10.0]
+    outputs = simple_pid.simulate_gains(
+        inputs, dts, Kp=Kp, Ki=0.2, Kd=0.5, setpoint=60.0, sample_time=0.6, output_limits=(10.0, 100.0), input_rates=rates
+    )
+    for i, kp in enumerate(Kp):
+        pid = simple_pid.PID(Kp=kp, Ki=0.2, Kd=0.5, setpoint=60.0, sample_time=0.6, output_limits=(10.0, 100.0))
+        output, _, _, _ = pid.simulate(inputs, dts, rates)
+        assert outputs[i] == pytest.approx(output)
+
+
+def test_no_clock_read_with_dt():
+    reads = []
+
+    def clock():
+        reads.append(None)
+        return 0.0
+
+    pid = simple_pid.PID(Kp=1.0, Ki=1.0, Kd=1.0, clock=clock)
+    reads.clear()
+    for _ in range(10):
+        pid(1.0, dt=1.0)
+    assert reads == []
+    assert (pid.proportional, pid.integral, pid.derivative) == pid.components
+
+
+def test_output_limits():
+    pid = make_pid(sample_time=None)
+    assert pid(0.0, dt=1.0) == 100.0
+    assert pid.integral <= 100.0
+    pid.setpoint = -1000.0
+    assert pid(0.0, dt=1.0) == 10.0
+    with pytest.raises(ValueError):
+        pid.output_limits = (100.0, 10.0)
+
+
+def test_mixed_calls_with_and_without_dt():
+    now_s = [1000.0]
+    pid = simple_pid.PID(Kp=0.0, Ki=1.0, Kd=0.0, setpoint=1.0, sample_time=None, clock=lambda: now_s[0])
+    pid(0.0)
+    assert pid.integral == pytest.approx(1e-16)
+    for _ in range(10):
+        pid(0.0, dt=1.0)
+    assert pid.integral == pytest.approx(10.0)
+    # The clock did not advance with the dt passed: the interval of the last call
+    now_s[0] += 0.5
+    pid(0.0)
+    assert pid.integral == pytest.approx(11.0)
+    now_s[0] += 1.5
+    pid(0.0)
+    assert pid.integral == pytest.approx(12.5)